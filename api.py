@@ -1,27 +1,56 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, current_app, stream_with_context
 from flask_cors import CORS
-from dotenv import load_dotenv
-from google import genai
-from google.genai import types
-from typing import Any
+from typing import Any, Iterator
+from datetime import timedelta
 
 import logging
 import json
+import csv
+import io
+import itertools
+import time
 
 # Import the db for using
 from db import *
-from sqlalchemy import inspect, text
+from jobs import job_queue
+from llm_cache import llm_cache, make_key
+from prompts import prompt_registry, estimate_tokens, RenderedPrompt
+from llm import llm, ResponseShape
+from metrics import metrics
+from rate_limit import rate_limiter, GenAIUnavailableError, PRIORITY_INTERACTIVE, PRIORITY_BULK
+from json_stream import TopLevelMemberParser
+from json_repair import extract_members, key_number, valid_member
+from response_cache import response_cache
+from embeddings import embedding_index, COURSE_WEEK_NO
+from singleflight import single_flight
+from batching import batch_scheduler, BatchItem
+from db_transfer import export_rows, import_rows, table_columns, IMPORT_BATCH_SIZE
+from db_profile import begin_immediate
+from search import search, is_search_table, SearchUnavailableError, KINDS as SEARCH_KINDS
+from sqlalchemy import inspect, or_, text
+from sqlalchemy.orm import joinedload, selectinload
 
-use_actual_ai_response = True
+# Page sizes of /api/courses
+COURSE_INDEX_PAGE_SIZE = 50
+COURSE_INDEX_MAX_PAGE_SIZE = 500
 
-import os
-load_dotenv()
+# Page sizes of /api/segments
+SEGMENTS_PAGE_SIZE = 100
+SEGMENTS_MAX_PAGE_SIZE = 1000
 
-api_key = os.getenv("GENAI_API_KEY")
-if api_key is None:
-    raise ValueError("GENAI_API_KEY cannot be found")
+# Page sizes of /api/search
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
 
-client = genai.Client(api_key=api_key)
+# Max courses in one /api/courses/batch upload
+COURSE_BATCH_MAX_ROWS = 500
+
+# Characters kept of every chunk of related material put in a prompt
+RELATED_TEXT_CHARS = 400
+
+# Expected answer (estimated tokens) of one week of a course structure / one session's minutes, to fill the batched prompts
+WEEK_ANSWER_TOKENS = 150
+SESSION_ANSWER_TOKENS = 800
 
 api_bp = Blueprint("api", __name__)
 
@@ -36,37 +65,371 @@ def generate_course_structure():
         return jsonify({"error": "No data was provided"}), 400
     
     try:
-        teacherEmail = data['teacherEmail']
-        courseCode = data['courseCode']
-        courseName = data['courseName']
-        content = data['content']
-        objectives = data['objectives']
-        prereq = data['prerequisites']
-        duration = data['duration']
-        sessions_per_week = data['sessionsPerWeek']
-        homework = data['homework']
-
-        # Assuming standard 5 ECTs course values if parsing fails
-        duration = int(duration) if duration else 12
-        sessions_per_week = int(sessions_per_week) if sessions_per_week else 2
-        homework = int(homework) if homework else 6
-        
-        create_new_course(
-            teacherEmail=teacherEmail,
-            courseCode=courseCode,
-            courseName=courseName,
-            content=content,
-            objectives=objectives,
-            prerequisites=prereq,
-            duration=duration,
-            sessions_per_week=sessions_per_week,
-            homework=homework
-        )
+        course_data = parse_course_form(data)
+        
+        # The AI call can take a long time, so the course is created by a background worker
+        job = job_queue.enqueue("course_structure", course_data)
         
-        return jsonify({"status": f"New course created: {courseName}"}), 200
+        return jsonify({
+            "status": f"Course generation queued: {course_data['courseName']}",
+            "job_id": job.id,
+            "status_url": f"/api/jobs/{job.id}"
+        }), 202
     except Exception as e:
         logging.exception("An error occurred during processing")
         return jsonify({"error": f"{e}"}), 400
+
+def parse_course_form(data) -> dict[str, Any]:
+    """
+    Turns the course form into create_new_course() arguments
+    """
+    teacherEmail = data['teacherEmail']
+    courseCode = data['courseCode']
+    courseName = data['courseName']
+    content = data['content']
+    objectives = data['objectives']
+    prereq = data['prerequisites']
+    duration = data['duration']
+    sessions_per_week = data['sessionsPerWeek']
+    homework = data['homework']
+    # Skip the LLM response cache and force a fresh generation
+    use_cache = str(data.get('noCache', '')).lower() not in ('1', 'true')
+
+    # Assuming standard 5 ECTs course values if parsing fails
+    duration = int(duration) if duration else 12
+    sessions_per_week = int(sessions_per_week) if sessions_per_week else 2
+    homework = int(homework) if homework else 6
+    
+    # Fail fast here, the worker would only report it through the job status
+    if not validate_email(teacherEmail):
+        raise ValueError("Teacher Email is not in correct format: FirstName.LastName@metropolia.fi")
+    
+    return {
+        "teacherEmail": teacherEmail,
+        "courseCode": courseCode,
+        "courseName": courseName,
+        "content": content,
+        "objectives": objectives,
+        "prerequisites": prereq,
+        "duration": duration,
+        "sessions_per_week": sessions_per_week,
+        "homework": homework,
+        "use_cache": use_cache
+    }
+
+@api_bp.route('/generate-course-structure/stream', methods=['POST'])
+def stream_course_structure():
+    """
+    Streaming version of /generate-course-structure/ (Server-Sent Events).
+    The course is stored first, then every week is stored and sent as a "week" event as soon as GenAI finished it.
+    """
+    data = request.form
+    
+    if not data:
+        return jsonify({"error": "No data was provided"}), 400
+    
+    try:
+        course_data = parse_course_form(data)
+    except Exception as e:
+        return jsonify({"error": f"{e}"}), 400
+    
+    duration = course_data['duration']
+    prompt = render_course_prompt(
+        course_data['courseName'], course_data['content'], course_data['objectives'],
+        course_data['prerequisites'], duration, course_data['sessions_per_week'], course_data['homework']
+    )
+    
+    def generate():
+        course_id = None
+        try:
+            course = insert_course(
+                course_data['teacherEmail'], course_data['courseCode'], course_data['courseName'], course_data['content'], {
+                    "objectives": course_data['objectives'],
+                    "prerequisites": course_data['prerequisites'],
+                    "duration": duration,
+                    "sessions_per_week": course_data['sessions_per_week'],
+                    "homework_hours": course_data['homework']
+                }
+            )
+            if not course:
+                yield sse("failed", {"error": f"Course {course_data['courseCode']} already exists"})
+                return
+            # Committed on its own so the course shows up while its weeks are still streaming
+            timed_commit()
+            course_id = course.id
+            invalidate_cached_reads(course_id=course.id)
+            yield sse("course", {"id": course.id, "code": course.code, "name": course.name})
+            
+            stored_weeks = set()
+            
+            def store_week(key: str, week_data: Any):
+                week_no = key_number(key, "week")
+                if week_no is None or week_no in stored_weeks or not 1 <= week_no <= duration or not valid_member("week", week_data):
+                    return None
+                week = make_week(course.id, week_no, week_data)
+                db.session.add(week)
+                timed_commit()
+                invalidate_cached_reads(course_id=course.id)
+                stored_weeks.add(week_no)
+                return sse("week", {
+                    "id": week.id,
+                    "week_number": week.week_number,
+                    "topic": week.topic,
+                    "summary": week.summary,
+                    "planned": week.planned
+                })
+            
+            shape = ResponseShape("week", duration)
+            parser = TopLevelMemberParser()
+            for chunk in ask_genai_stream(prompt.text, shape, use_cache=course_data['use_cache']):
+                for key, week_data in parser.feed(chunk):
+                    event = store_week(key, week_data)
+                    if event:
+                        yield event
+            
+            # Weeks the parser could not take on their own or GenAI skipped, then placeholders for the ones still missing
+            response = stream_leftovers(prompt.text, shape, parser.buffer, stored_weeks, course_data['use_cache'])
+            for week_no in range(1, duration + 1):
+                event = store_week(f"week {week_no}", response.get(f"week {week_no}", {"topic": "WIP", "summary": "WIP"}))
+                if event:
+                    yield event
+            
+            yield sse("done", {"id": course.id, "weeks": len(stored_weeks)})
+        except Exception as e:
+            logging.exception("An error occurred during streaming")
+            db.session.rollback()
+            if course_id is not None:
+                add_placeholder_weeks(course_id, duration)
+            yield sse("failed", {"error": str(e), "retry_after": getattr(e, "retry_after", None)})
+        except GeneratorExit:
+            # The client went away halfway: the course keeps all of its weeks, the ones not streamed yet as WIP
+            if course_id is not None:
+                db.session.rollback()
+                add_placeholder_weeks(course_id, duration)
+            raise
+    
+    return event_stream(generate())
+
+def add_placeholder_weeks(course_id: int, duration: int) -> None:
+    """
+    Commits a WIP week for every week of the course that a failed or cut off stream did not store
+    """
+    # OR IGNORE: the weeks stored already stay as they are
+    db.session.execute(db.insert(Week).prefix_with("OR IGNORE"), [
+        week_values(course_id, week_no, {}) for week_no in range(1, duration + 1)
+    ])
+    timed_commit()
+    invalidate_cached_reads(course_id=course_id)
+
+def event_stream(events: Iterator[str]) -> Response:
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"   # Don't let a reverse proxy buffer the events
+        }
+    )
+
+@job_queue.handler("course_structure")
+def run_course_structure_job(payload: dict, report_progress) -> dict:
+    create_new_course(**payload)
+    return {"status": f"New course created: {payload['courseName']}"}
+
+@api_bp.route('/courses/batch', methods=['POST'])
+def create_course_batch():
+    """
+    Creates many courses from one uploaded file (multipart field "file"), CSV with a header row or a JSON list.
+    The columns are the fields of the course form (teacherEmail, courseCode, courseName, ...).
+    Rows are numbered from 1, invalid rows are reported right away, the rest are created by a background job.
+    """
+    try:
+        records = read_course_batch(request.files.get('file'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if len(records) > COURSE_BATCH_MAX_ROWS:
+        return jsonify({"error": f"At most {COURSE_BATCH_MAX_ROWS} courses per upload"}), 400
+    
+    rows = []
+    invalid = []
+    for row_no, record in enumerate(records, start=1):
+        try:
+            if not isinstance(record, dict):
+                raise ValueError("Not an object")
+            rows.append({"row": row_no, **parse_course_form({
+                key: "" if value is None else str(value) for key, value in record.items()
+            })})
+        except KeyError as e:
+            invalid.append({"row": row_no, "status": "invalid", "error": f"Missing field {e}"})
+        except Exception as e:
+            invalid.append({"row": row_no, "status": "invalid", "error": str(e)})
+    
+    if not rows:
+        return jsonify({"error": "No valid course in the upload", "invalid": invalid}), 400
+    
+    job = job_queue.enqueue("course_batch", {
+        "rows": rows,
+        "max_concurrency": current_app.config.get("COURSE_PLAN_CONCURRENCY", 4)
+    })
+    
+    return jsonify({
+        "status": f"Creation of {len(rows)} courses queued",
+        "job_id": job.id,
+        "status_url": f"/api/jobs/{job.id}",
+        "invalid": invalid
+    }), 202
+
+def read_course_batch(file) -> list[Any]:
+    """
+    Reads the rows of an uploaded CSV or JSON file
+    """
+    if file is None:
+        raise ValueError("No file was uploaded")
+    
+    filename = (file.filename or "").lower()
+    try:
+        if filename.endswith(".csv") or file.mimetype == "text/csv":
+            return list(csv.DictReader(io.TextIOWrapper(file.stream, encoding="utf-8-sig")))
+        
+        data = json.load(file.stream)
+    except (UnicodeDecodeError, csv.Error, ValueError) as e:
+        raise ValueError(f"Could not read {file.filename}: {e}")
+    
+    if isinstance(data, dict):
+        data = data.get('courses')
+    if not isinstance(data, list):
+        raise ValueError("Expected a JSON list of courses, or {\"courses\": [...]}")
+    return data
+
+@job_queue.handler("course_batch")
+def run_course_batch_job(payload: dict, report_progress) -> dict:
+    app = current_app._get_current_object()
+    rows = payload['rows']
+    
+    progress = {
+        "total": len(rows),
+        "created": 0,
+        "exists": 0,
+        "failed": 0,
+        "rows": {
+            str(row['row']): {"code": row['courseCode'], "status": "pending"} for row in rows
+        }
+    }
+    
+    def finish_row(row_no: int, status: str, **details):
+        progress["rows"][str(row_no)].update(status=status, **details)
+        progress[status] += 1
+    
+    # Courses that already exist (or appear twice in the file) don't need a GenAI call
+    codes = [row['courseCode'] for row in rows]
+    existing_codes = set(db.session.execute(
+        db.select(Course.code).where(Course.code.in_(codes))
+    ).scalars())
+    
+    pending = []
+    seen_codes = {}
+    for row in rows:
+        if row['courseCode'] in existing_codes:
+            finish_row(row['row'], "exists")
+        elif row['courseCode'] in seen_codes:
+            finish_row(row['row'], "failed", error=f"Same course code as row {seen_codes[row['courseCode']]}")
+        else:
+            seen_codes[row['courseCode']] = row['row']
+            pending.append(row)
+    report_progress(progress)
+    
+    def generate_structure(item: BatchItem) -> dict[str, Any]:
+        row = item.payload
+        with app.app_context():
+            prompt = render_course_prompt(
+                row['courseName'], row['content'], row['objectives'], row['prerequisites'],
+                row['duration'], row['sessions_per_week'], row['homework']
+            )
+            return ask_genai(prompt.text, ResponseShape("week", row['duration']), use_cache=row['use_cache'], priority=PRIORITY_BULK)
+    
+    def generate_structures(batch: list[BatchItem]) -> dict[int, dict[str, Any]]:
+        # Only complete courses are taken, the rest is asked again in smaller batches
+        batch_rows = [item.payload for item in batch]
+        with app.app_context():
+            prompt = render_course_batch_prompt(batch_rows)
+            response = ask_genai(
+                prompt.text,
+                ResponseShape("course", len(batch_rows), nested=tuple(ResponseShape("week", row['duration']) for row in batch_rows)),
+                use_cache=all(row['use_cache'] for row in batch_rows),
+                priority=PRIORITY_BULK,
+                complete_missing=False
+            )
+        return {
+            row['row']: response[f"course {no}"]
+            for no, row in enumerate(batch_rows, start=1) if f"course {no}" in response
+        }
+    
+    # The slow part, GenAI, runs concurrently and outside of any transaction, several small courses per prompt
+    responses = {}
+    if pending:
+        items = [
+            BatchItem(
+                key=row['row'],
+                tokens=estimate_tokens(json.dumps(course_batch_entry(1, row), ensure_ascii=False)) + row['duration'] * WEEK_ANSWER_TOKENS,
+                payload=row
+            ) for row in pending
+        ]
+        batches = batch_scheduler.pack(items, render_course_batch_prompt([]).estimated_tokens)
+        progress["prompts"] = len(batches)
+        report_progress(progress)
+        
+        for item, response, error in batch_scheduler.run(batches, generate_structures, generate_structure, payload['max_concurrency']):
+            row_no = item.payload['row']
+            if error is None:
+                responses[row_no] = response
+                progress["rows"][str(row_no)]["status"] = "generated"
+            else:
+                finish_row(row_no, "failed", error=str(error))
+            report_progress(progress)
+    
+    # Then every course goes in with a single commit, a savepoint per row keeps a bad row from taking the others down
+    created = []
+    try:
+        begin_immediate(db.session)
+        for row in pending:
+            if row['row'] not in responses:
+                continue
+            try:
+                with db.session.begin_nested():
+                    course = store_course(row['teacherEmail'], row['courseCode'], row['courseName'], row['content'], {
+                        "objectives": row['objectives'],
+                        "prerequisites": row['prerequisites'],
+                        "duration": row['duration'],
+                        "sessions_per_week": row['sessions_per_week'],
+                        "homework_hours": row['homework']
+                    }, responses[row['row']])
+            except Exception as e:
+                logging.exception(f"Failed to store row {row['row']}")
+                finish_row(row['row'], "failed", error=str(e))
+                continue
+            
+            if course:
+                created.append((row['row'], course.id))
+            else:
+                finish_row(row['row'], "exists")
+        timed_commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    
+    for row_no, course_id in created:
+        finish_row(row_no, "created", course_id=course_id)
+        invalidate_cached_reads(course_id=course_id)
+    
+    return progress
+
+@api_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = db.session.get(Job, job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict()), 200
     
 def create_new_course(
     teacherEmail: str,
@@ -78,6 +441,7 @@ def create_new_course(
     duration: int | None,
     sessions_per_week: int | None,
     homework: int | None,
+    use_cache: bool = True,
 ) -> None:
     """
     Used for inserting a new course into the database
@@ -90,72 +454,118 @@ def create_new_course(
     duration = int(duration) if duration else 0
     
     
-    prompt = None
-    with open("prompt.txt", "r", encoding="utf-8") as file:
-        prompt = file.read()
-    if prompt is None:
-        raise ValueError("In create_new_course: prompt is not found.")
-    
-    prompt += f"""
-        Structure a syllabus for the course '{courseName}', that spans {duration} weeks, each week will have {sessions_per_week} lectures.
-        You will create a weekly syllabus, that **ONLY** contains the topic and the summary of each week, starting from "week 1" to "week {duration}".
-        The course aims for students that satisfies the following prerequisites:
-            {prerequisites}
-        And at the end of the course, the students will be expected to meet these objectives:
-            {objectives}
-        The given content of the class is as follows:
-            {content}
-        And each week, the students are expected to spend an average of {homework} hours on homework.
-        
-        You should structure the syllabus so that every week covers all topics that are relevant and / or covering all of the specified content.
-        To repeat, you only create a weekly syllabus that **ONLY** contains the toipc and the content's summary of the week, not in detailed what each session / lecture would be like.
-        
-        RESPOND IN **JSON FORMAT** ONLY, Starting with {{ and ending in }}. Do not add other characters that will make json.loads() break
-        Valid JSON format is as follows: {{
-            "week 1": {{
-                "topic": "Introduction to Machine Learning",
-                "summary": "The students will learn about ML history, how the maths behind it came to life, and the basics of Linear Regression"
-            }},
-            ...
-            "week {duration}": {{
-                "topic": "Project demo",
-                "summary": "The students will spend their last week completing their project on fine tuning a model to predict Lung Cancer"  
-            }}
-        }}
-    
-    """
-    
-    print("Prompt is structured. Sending prompt to GenAI...")
-    res = None
-    response = None
-    if use_actual_ai_response:
-        try:
-            res = client.models.generate_content(
-                model="gemini-2.5-flash-lite",
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    temperature=0.1
-                )
-            )
-        except Exception as e:
-            raise TimeoutError(f"Error while getting data from GenAI: {e}")
-        
-        try:
-            response = clean_json(res.text)
-        except Exception as e:
-            raise TypeError(f"AI failed to return valid JSON {e}")
+    prompt = render_course_prompt(courseName, content, objectives, prerequisites, duration, sessions_per_week, homework)
     
-    # Okay I am poor so I must use this to not exceed rate limites
-    else :
-        with open("weekly.json", "r", encoding='utf-8') as file:
-            response = file.read()
-        response = clean_json(response)
-    # Please unpoor me
+    print(f"Prompt is structured (~{prompt.estimated_tokens} tokens). Sending prompt to GenAI...")
+    # Okay I am poor so I must use weekly.json to not exceed rate limites
+    response = ask_genai(prompt.text, ResponseShape("week", duration), use_cache=use_cache)
     
     
     print(f"AI response: ", response)
     
     
+    try:
+        course = store_course(teacherEmail, courseCode, courseName, content, {
+            "objectives": objectives,
+            "prerequisites": prerequisites,
+            "duration": duration,
+            "sessions_per_week": sessions_per_week,
+            "homework_hours": homework
+        }, response)
+        # Teacher, course and weeks land together, or not at all
+        timed_commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    
+    if course:
+        invalidate_cached_reads(course_id=course.id)
+    else:
+        print(f"Course {courseCode} already exists. Skipping creation")
+    
+    return    
+
+def render_course_prompt(
+    courseName: str,
+    content: str | None,
+    objectives: str,
+    prerequisites: str,
+    duration: int,
+    sessions_per_week: int | None,
+    homework: int | None,
+):
+    return prompt_registry.render(
+        "course_structure",
+        course_name=courseName,
+        duration=duration,
+        sessions_per_week=sessions_per_week,
+        prerequisites=prerequisites,
+        objectives=objectives,
+        content=content,
+        homework=homework
+    )
+
+def render_course_batch_prompt(rows: list[dict[str, Any]]) -> RenderedPrompt:
+    """
+    One prompt for the structure of every course of a batch upload's rows, answered as "course 1" to "course <len(rows)>"
+    """
+    courses = [course_batch_entry(no, row) for no, row in enumerate(rows, start=1)]
+    return prompt_registry.render(
+        "course_structure_batch",
+        courses_json=json.dumps(courses, indent=2, ensure_ascii=False),
+        keys=", ".join(f'"course {no}"' for no in range(1, len(rows) + 1))
+    )
+
+def course_batch_entry(no: int, row: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "course": no,
+        "course_name": row['courseName'],
+        "duration": row['duration'],
+        "sessions_per_week": row['sessions_per_week'],
+        "prerequisites": row['prerequisites'],
+        "objectives": row['objectives'],
+        "content": row['content'],
+        "homework": row['homework']
+    }
+
+def store_course(
+    teacherEmail: str,
+    courseCode: str,
+    courseName: str,
+    content: str | None,
+    meta_data: dict[str, Any],
+    response: dict[str, Any],
+) -> Course | None:
+    """
+    Inserts the course and all of its weeks from the GenAI response, without committing.
+    Returns None when a course with the same code already exists.
+    """
+    course = insert_course(teacherEmail, courseCode, courseName, content, meta_data)
+    if not course:
+        return None
+    
+    duration = meta_data['duration']
+    print(f"Generating {duration} weeks for Course ID {course.id}...")
+    
+    # One executemany for all the weeks instead of an INSERT per Week object
+    db.session.execute(db.insert(Week), [
+        week_values(course.id, week_no, response.get(f"week {week_no}", {"topic": "WIP", "summary": "WIP"}))
+        for week_no in range(1, duration + 1)
+    ])
+    return course
+
+def insert_course(
+    teacherEmail: str,
+    courseCode: str,
+    courseName: str,
+    content: str | None,
+    meta_data: dict[str, Any],
+) -> Course | None:
+    """
+    Inserts the course (and its teacher if needed) without any weeks, and without committing.
+    The ids come from a flush, the caller owns the transaction.
+    Returns None when a course with the same code already exists.
+    """
     teacher = db.session.execute(
         db.select(Teacher).where(Teacher.email == teacherEmail)
     ).scalar_one_or_none()
@@ -166,7 +576,7 @@ def create_new_course(
         teacher = Teacher(email=teacherEmail, handle=new_handle)
         
         db.session.add(teacher)
-        db.session.commit()
+        db.session.flush()
         
     teacher_id = teacher.id
     
@@ -174,147 +584,543 @@ def create_new_course(
         db.select(Course).where(Course.code == courseCode)
     ).scalar_one_or_none()
     
-    if not course:
-        print(f"Course {courseCode} not found. Creating new course")
-        
-        meta_data = {
-            "objectives": objectives,
-            "prerequisites": prerequisites,
-            "duration": duration,
-            "sessions_per_week": sessions_per_week,
-            "homework_hours": homework
-        }
-        
-        course = Course(
-            teacher_id=teacher_id,
-            code=courseCode,
-            name=courseName,
-            content=content if content else "No description provided",
-            meta_data=meta_data
-        )
-        
-        db.session.add(course)
-        db.session.commit() # To get course ID
-        
-        print(f"Generating {duration} weeks for Course ID {course.id}...")
-        
-        new_weeks = []
-        
-        for week_no in range(1, duration + 1):
-            week_key = f"week {week_no}"
-            week_data = response.get(week_key, {"topic": "WIP", "summary": "WIP"})
-            
-            new_week = Week(
-                week_number = week_no,
-                course_id = course.id,
-                topic=week_data['topic'],
-                summary=week_data['summary'],
-                planned=False
-            )
-            new_weeks.append(new_week)
-            
-        db.session.add_all(new_weeks)
-        db.session.commit()
+    if course:
+        return None
+    
+    print(f"Course {courseCode} not found. Creating new course")
+    
+    course = Course(
+        teacher_id=teacher_id,
+        code=courseCode,
+        name=courseName,
+        content=content if content else "No description provided",
+        meta_data=meta_data
+    )
+    
+    db.session.add(course)
+    db.session.flush() # To get course ID
+    return course
+
+def week_values(course_id: int, week_no: int, week_data: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "week_number": week_no,
+        "course_id": course_id,
+        "topic": week_data.get('topic', "WIP"),
+        "summary": week_data.get('summary', "WIP"),
+        "planned": False
+    }
+
+def make_week(course_id: int, week_no: int, week_data: dict[str, Any]) -> Week:
+    return Week(**week_values(course_id, week_no, week_data))
+
+def ask_genai(
+    prompt: str,
+    shape: ResponseShape,
+    use_cache: bool = True,
+    priority: int = PRIORITY_INTERACTIVE,
+    complete_missing: bool = True,
+) -> dict[str, Any]:
+    """
+    Sends the prompt to the LLM backend and returns the members of shape it answered with.
+    shape says what the prompt asks for, the canned and fake backends answer from it.
+    A broken answer is repaired, and the members that could not be used are asked for
+    again in one smaller prompt (complete_missing), the ones still missing are left out.
+    Identical prompts are answered from llm_cache, use_cache=False forces a fresh generation.
+    Gemini calls wait for their turn in rate_limiter, background jobs should pass PRIORITY_BULK.
+    """
+    backend = llm.backend
+    
+    cache_key = make_key(backend.model, backend.config, prompt)
+    if backend.cacheable:
+        if use_cache:
+            with metrics.stage("llm_cache_lookup"):
+                cached = llm_cache.get(cache_key)
+            if cached is not None:
+                print("Got response from cache")
+                with metrics.stage("parse_json"):
+                    return extract_members(cached, shape).members
+        else:
+            llm_cache.count_bypass()
+    
+    def send():
+        # Timed per attempt, the queue and the retry backoff are stages of their own
+        with metrics.stage("llm_call"):
+            answer = backend.generate(prompt, shape)
+        return answer, answer.used_tokens
+    
+    estimated_tokens = estimate_tokens(prompt)
+    if backend.rate_limited:
+        # Raises GenAIUnavailableError once the retries are exhausted
+        answer = rate_limiter.call(send, estimated_tokens, priority)
     else:
-        print(f"Course {courseCode} already exists. Skipping creation")
+        answer, _ = send()
+    metrics.record_llm_call(backend.name, "generate", estimated_tokens, answer.used_tokens)
     
-    return    
+    try:
+        with metrics.stage("parse_json"):
+            extracted = extract_members(answer.text, shape)
+    except ValueError as e:
+        raise TypeError(f"AI failed to return valid JSON {e}")
+    
+    response = extracted.members
+    if extracted.missing and complete_missing:
+        response.update(ask_missing_members(prompt, shape, extracted.missing, use_cache, priority))
+    
+    # Only cache complete answers, repaired ones in their clean form
+    if backend.cacheable and len(response) == len(shape.members()):
+        repaired = extracted.repaired or extracted.missing
+        llm_cache.set(cache_key, backend.model, json.dumps(response, ensure_ascii=False) if repaired else answer.text)
+    return response
 
-def validate_email(email: str) -> bool:
-    parts = email.split('@')
-    return parts[1] == "metropolia.fi"
+def ask_missing_members(
+    prompt: str,
+    shape: ResponseShape,
+    missing: list[int],
+    use_cache: bool = True,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> dict[str, Any]:
+    """
+    Asks again for the members of shape missing from the answer to prompt, instead of generating
+    the whole answer again. Returns the ones that came back usable, nothing when the call failed.
+    """
+    missing_keys = ", ".join(f'"{shape.prefix} {n}"' for n in missing)
+    print(f"Answer is missing {missing_keys}. Asking GenAI for them again...")
+    follow_up = prompt_registry.render("missing_members", original_prompt=prompt, missing_keys=missing_keys)
+    try:
+        return ask_genai(
+            follow_up.text,
+            ResponseShape(shape.prefix, shape.count, numbers=tuple(missing)),
+            use_cache=use_cache,
+            priority=priority,
+            complete_missing=False
+        )
+    except (GenAIUnavailableError, TypeError):
+        logging.exception(f"Could not get {missing_keys} again")
+        return {}
 
-def clean_json(ai_text: str) -> dict[str, Any]:
+def ask_genai_stream(
+    prompt: str,
+    shape: ResponseShape,
+    use_cache: bool = True,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> Iterator[str]:
     """
-    Parses JSON output from AI, handling raw JSON and markdown'ed JSON
+    Same as ask_genai(), but yields the raw text as the backend generates it.
+    Parsing is left to the caller, see json_stream.TopLevelMemberParser.
     """
-    text = ai_text.strip()
-    if text.startswith("```json"):
-        text = text[7:]
-    elif text.startswith("```"):
-        text = text[3:]
-        
-    if text.endswith("```"):
-        text = text[:-3]
+    backend = llm.backend
+    
+    cache_key = make_key(backend.model, backend.config, prompt)
+    if backend.cacheable:
+        if use_cache:
+            with metrics.stage("llm_cache_lookup"):
+                cached = llm_cache.get(cache_key)
+            if cached is not None:
+                print("Got response from cache")
+                yield cached
+                return
+        else:
+            llm_cache.count_bypass()
     
-    text = text.strip()
+    # Only the time spent waiting on the backend, not what the caller does between chunks
+    llm_seconds = 0.0
+    
+    def open_stream():
+        nonlocal llm_seconds
+        started = time.perf_counter()
+        try:
+            stream = iter(backend.stream(prompt, shape))
+            # Errors (429s included) show up with the first chunk, and until it is
+            # out nothing was sent to our caller, so the call can still be retried
+            first = next(stream, None)
+        finally:
+            llm_seconds += time.perf_counter() - started
+        return (first, stream), None
+    
+    estimated_tokens = estimate_tokens(prompt)
+    if backend.rate_limited:
+        first, stream = rate_limiter.call(open_stream, estimated_tokens, priority)
+    else:
+        (first, stream), _ = open_stream()
+    
+    chunks = []
+    last = None
+    remaining = itertools.chain([first] if first else [], stream)
+    try:
+        while True:
+            started = time.perf_counter()
+            chunk = next(remaining, None)
+            llm_seconds += time.perf_counter() - started
+            if chunk is None:
+                break
+            
+            last = chunk
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+    except Exception as e:
+        raise GenAIUnavailableError(f"GenAI stream was cut off: {e}", status_code=502)
+    
+    metrics.record_stage("llm_call", llm_seconds)
+    metrics.record_llm_call(backend.name, "stream", estimated_tokens, last.used_tokens if last else None)
+    
+    # The usage comes with the last chunk
+    if backend.rate_limited and last is not None and last.used_tokens is not None:
+        rate_limiter.settle(estimated_tokens, last.used_tokens)
+    
+    # Only cache complete answers, repaired ones in their clean form
+    text = "".join(chunks)
+    try:
+        with metrics.stage("parse_json"):
+            extracted = extract_members(text, shape)
+    except ValueError:
+        return
+    if backend.cacheable and not extracted.missing:
+        llm_cache.set(
+            cache_key, backend.model, json.dumps(extracted.members, ensure_ascii=False) if extracted.repaired else text
+        )
+
+def stream_leftovers(
+    prompt: str,
+    shape: ResponseShape,
+    streamed_text: str,
+    stored: set[int],
+    use_cache: bool = True,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> dict[str, Any]:
+    """
+    After a stream, the members of shape that were not stored yet: salvaged from the streamed text
+    when the parser could not take them on their own, otherwise asked for again
+    """
+    try:
+        with metrics.stage("parse_json"):
+            members = extract_members(streamed_text, shape).members
+    except ValueError:
+        members = {}
     
-    return json.loads(text)
+    leftovers = {key: value for key, value in members.items() if key_number(key, shape.prefix) not in stored}
+    missing = [n for n in shape.members() if n not in stored and f"{shape.prefix} {n}" not in leftovers]
+    if missing:
+        leftovers.update(ask_missing_members(prompt, shape, missing, use_cache, priority))
+    return leftovers
+
+def timed_commit() -> None:
+    with metrics.stage("db_commit"):
+        db.session.commit()
+
+def genai_unavailable(e: GenAIUnavailableError):
+    """
+    Error response for a GenAI call that failed, with Retry-After when waiting helps
+    """
+    response = jsonify({"error": str(e), "retry_after": e.retry_after})
+    response.status_code = e.status_code
+    if e.retry_after:
+        response.headers["Retry-After"] = str(int(e.retry_after) + 1)
+    return response
+
+def sse(event: str, data: Any) -> str:
+    """
+    Formats one Server-Sent Event
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def invalidate_cached_reads(course_id: int | None = None, week_id: int | None = None) -> None:
+    """
+    Marks the cached read payloads (and the embedded chunks) a committed write touched as stale.
+    Pass course_id when the course or its week list (topics, planned flags) changed,
+    week_id when the sessions of the week changed.
+    """
+    scopes = []
+    if course_id is not None:
+        scopes += ["courses", f"course:{course_id}"]
+    if week_id is not None:
+        scopes.append(f"week:{week_id}")
+    response_cache.bump(*scopes)
+    embedding_index.invalidate(course_id=course_id, week_id=week_id)
 
-# TODO: Separate get-all-course-names and get-all-course-info
-#       Since we don't want to send all backend data to the user at once
+def related_material(week: Week, query: str, exclude_course: bool = False) -> list[dict[str, str]]:
+    """
+    The parts of the other weeks of the course (and of the course itself, unless the prompt
+    already has its content) closest to query: the prompt keeps the course coherent
+    without carrying all of it. See embeddings.py.
+    """
+    excluded = [week.week_number, COURSE_WEEK_NO] if exclude_course else [week.week_number]
+    return [
+        {"from": hit.key, "text": hit.text[:RELATED_TEXT_CHARS]}
+        for hit in embedding_index.search(week.course_id, query, exclude_weeks=excluded)
+    ]
+
+def validate_email(email: str) -> bool:
+    parts = email.split('@')
+    return len(parts) == 2 and parts[1] == "metropolia.fi"
 
 @api_bp.route('/get-all-courses', methods=['GET', 'POST'])
 def get_all_courses():
+    def build():
+        # The weeks of every course are loaded with one extra query, instead of one per course
+        courses = db.session.execute(
+            db.select(Course).options(selectinload(Course.weeks)).order_by(Course.id)
+        ).scalars().all()
+        
+        output = [course_to_dict(course) for course in courses]
+        return output, 200
+    
     try:
-        courses = db.session.execute(db.select(Course)).scalars().all()
+        return response_cache.json_response("all-courses", ["courses"], build)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api_bp.route('/courses', methods=['GET'])
+def get_course_index():
+    """
+    Lightweight list of courses: only id, code, name and the week titles.
+    Paginated with ?limit=N&cursor=<next_cursor of the previous page>.
+    """
+    limit = min(max(request.args.get('limit', COURSE_INDEX_PAGE_SIZE, type=int), 1), COURSE_INDEX_MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor', 0, type=int)
+    
+    def build():
+        # One row more than asked for tells whether there is a next page
+        courses = db.session.execute(
+            db.select(Course.id, Course.code, Course.name)
+            .where(Course.id > cursor)
+            .order_by(Course.id)
+            .limit(limit + 1)
+        ).all()
+        has_more = len(courses) > limit
+        courses = courses[:limit]
         
-        output = []
-        for course in courses:
-            sorted_weeks = sorted(course.weeks, key=lambda w: w.week_number)
-            
-            course_data = {
-                "id": course.id,
-                "name": course.name,
-                "code": course.code,
-                "content": course.content,
-                "duration": course.meta_data.get('duration'),
-                "sessionsPerWeek": course.meta_data.get('sessions_per_week'),
-                "objectives": course.meta_data.get('objectives'),
-                "prerequisites": course.meta_data.get("prerequisites"),
-                "weeks": [
-                    {
-                        "id": w.id,
-                        "week_number": w.week_number,
-                        "topic": w.topic,
-                        "summary": w.summary,
-                        "planned": w.planned
-                    } for w in sorted_weeks
-                ] 
-            }
-            output.append(course_data)
+        weeks_by_course = {c.id: [] for c in courses}
+        if courses:
+            weeks = db.session.execute(
+                db.select(Week.course_id, Week.id, Week.week_number, Week.topic, Week.planned)
+                .where(Week.course_id.in_(weeks_by_course.keys()))
+                .order_by(Week.course_id, Week.week_number)
+            ).all()
+            for w in weeks:
+                weeks_by_course[w.course_id].append({
+                    "id": w.id,
+                    "week_number": w.week_number,
+                    "topic": w.topic,
+                    "planned": w.planned
+                })
+        
+        return {
+            "courses": [
+                {
+                    "id": c.id,
+                    "code": c.code,
+                    "name": c.name,
+                    "weeks": weeks_by_course[c.id]
+                } for c in courses
+            ],
+            "next_cursor": courses[-1].id if has_more else None
+        }, 200
+    
+    try:
+        return response_cache.json_response(f"course-index:{cursor}:{limit}", ["courses"], build)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api_bp.route('/courses/<int:course_id>', methods=['GET'])
+def get_course(course_id):
+    def build():
+        course = db.session.execute(
+            db.select(Course).options(selectinload(Course.weeks)).where(Course.id == course_id)
+        ).scalar_one_or_none()
         
-        return jsonify(output)
+        if not course:
+            return {"error": "Course not found"}, 404
+        
+        return course_to_dict(course), 200
+    
+    try:
+        return response_cache.json_response(f"course:{course_id}", [f"course:{course_id}"], build)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+def course_to_dict(course: Course) -> dict[str, Any]:
+    return {
+        "id": course.id,
+        "name": course.name,
+        "code": course.code,
+        "content": course.content,
+        "duration": course.meta_data.get('duration'),
+        "sessionsPerWeek": course.meta_data.get('sessions_per_week'),
+        "objectives": course.meta_data.get('objectives'),
+        "prerequisites": course.meta_data.get("prerequisites"),
+        "weeks": [
+            {
+                "id": w.id,
+                "week_number": w.week_number,
+                "topic": w.topic,
+                "summary": w.summary,
+                "planned": w.planned
+            } for w in course.weeks  # Already ordered by week_number
+        ] 
+    }
     
 @api_bp.route('/get-week-sessions', methods=['GET', 'POST'])
 def get_week_sessions():
-    data = request.get_json()
-    week_id = data.get('week_id')
+    # GET ?week_id=N can be revalidated with the ETag, POST {"week_id": N} is kept for older clients
+    if request.method == 'GET':
+        week_id = request.args.get('week_id', type=int)
+    else:
+        week_id = (request.get_json(silent=True) or {}).get('week_id')
     
     if not week_id:
         return jsonify({'error': "Week ID is required"}), 400
     
-    try:
+    def build():
         week = db.session.execute(
             db.select(Week).where(Week.id == week_id)
         ).scalar_one_or_none()
         
         if not week:
-            return jsonify({"error": "Week not found"}), 404
+            return {"error": "Week not found"}, 404
         
+        # The segments come with the sessions, in the same query
         sessions = db.session.execute(
             db.select(Session).where(Session.week_id == week_id).order_by(Session.id)
-        ).scalars().all()
+            .options(joinedload(Session.segments))
+        ).unique().scalars().all()
         
         sessions_list = []
         for session in sessions:
             sessions_list.append({
                 "id": session.id,
+                "session_no": session.session_no,
                 "minutes_data": session.data
             })
             
-        return jsonify({
+        return {
             "status": "success",
             "planned": week.planned,
             "week_topic": week.topic,
             "week_summary": week.summary,
             "sessions": sessions_list
-        }), 200
+        }, 200
+    
+    try:
+        return response_cache.json_response(f"week:{week_id}", [f"week:{week_id}"], build)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@api_bp.route('/segments', methods=['GET'])
+def get_segments():
+    """
+    Minute blocks of any session, e.g. ?topic=regression for every block about regression in every course.
+    Filters: ?course_id, ?week_id, ?session_id, ?topic (in the block's topic, case-insensitive).
+    ?fields=topic leaves the contents out. Paginated with ?limit=N&cursor=<next_cursor of the previous page>.
+    """
+    limit = min(max(request.args.get('limit', SEGMENTS_PAGE_SIZE, type=int), 1), SEGMENTS_MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor', 0, type=int)
+    with_content = request.args.get('fields') != 'topic'
+    
+    columns = [
+        SessionSegment.id, SessionSegment.label, SessionSegment.start_min, SessionSegment.end_min, SessionSegment.topic,
+        SessionSegment.session_id, Session.session_no, Session.week_id, Week.week_number, Week.course_id
+    ]
+    if with_content:
+        columns.append(SessionSegment.content)
+    query = (
+        db.select(*columns)
+        .join(Session, Session.id == SessionSegment.session_id)
+        .join(Week, Week.id == Session.week_id)
+        .where(SessionSegment.id > cursor)
+        .order_by(SessionSegment.id)
+        .limit(limit + 1)   # One row more than asked for tells whether there is a next page
+    )
+    for name, column in (("course_id", Week.course_id), ("week_id", Session.week_id), ("session_id", SessionSegment.session_id)):
+        value = request.args.get(name, type=int)
+        if value is not None:
+            query = query.where(column == value)
+    topic = request.args.get('topic')
+    if topic:
+        escaped = topic.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.where(SessionSegment.topic.ilike(f"%{escaped}%", escape="\\"))
+    
+    try:
+        rows = db.session.execute(query).all()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify({
+        "segments": [row._asdict() for row in rows],
+        "next_cursor": rows[-1].id if has_more else None
+    }), 200
+
+@api_bp.route('/segments/<int:segment_id>', methods=['PATCH'])
+def update_segment(segment_id):
+    """
+    Edits one minute block with {"topic": ..., "content": ...} (either or both). Only its row is written.
+    """
+    req_data = request.get_json(silent=True) or {}
+    changes = {key: req_data[key] for key in ('topic', 'content') if key in req_data}
+    if not changes:
+        return jsonify({"error": "Needed topic or content"}), 400
+    if not all(isinstance(value, str) and value.strip() for value in changes.values()):
+        return jsonify({"error": "topic and content must be non-empty text"}), 400
+    
+    try:
+        segment = db.session.get(SessionSegment, segment_id)
+        if not segment:
+            return jsonify({"error": "Segment not found"}), 404
+        
+        for key, value in changes.items():
+            setattr(segment, key, value)
+        week_id = segment.session.week_id
+        body = {
+            "id": segment.id,
+            "session_id": segment.session_id,
+            "label": segment.label,
+            "block": segment.block
+        }
+        timed_commit()
+        invalidate_cached_reads(week_id=week_id)
+        return jsonify(body), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+@api_bp.route('/search', methods=['GET'])
+def search_syllabi():
+    """
+    Full-text search of the courses, weeks and session minutes, best matches first, e.g. ?q=linear regr
+    Every word must match, the last one may be unfinished, "quoted words" match as a phrase.
+    Filters: ?kind=course|week|segment (repeatable), ?course_id. Paginated with ?page=N&limit=N.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Needed q"}), 400
+    kinds = request.args.getlist('kind')
+    unknown = [kind for kind in kinds if kind not in SEARCH_KINDS]
+    if unknown:
+        return jsonify({"error": f"Unknown kinds {unknown}, expected some of {list(SEARCH_KINDS)}"}), 400
+    
+    limit = min(max(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), 1), SEARCH_MAX_PAGE_SIZE)
+    page = max(request.args.get('page', 1, type=int), 1)
+    
+    try:
+        with metrics.stage("search"):
+            hits, has_more = search(
+                db.session.connection(), query, kinds=kinds,
+                course_id=request.args.get('course_id', type=int), limit=limit, offset=(page - 1) * limit
+            )
+    except SearchUnavailableError as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    return jsonify({
+        "query": query,
+        "results": hits,
+        "page": page,
+        "next_page": page + 1 if has_more else None
+    }), 200
+
 @api_bp.route('/generate-week-sessions', methods=['GET', 'POST'])
 def create_week_sessions():
     
@@ -331,118 +1137,499 @@ def create_week_sessions():
         if not week:
             return jsonify({"error": "Week not found"}), 404
         
-        if week.planned:
+        if week.planned and not claim_abandoned(week) and not single_flight.in_flight(week_sessions_flight(week.id)):
             return jsonify({"error": "Week is planned"}), 400
         
-        course = week.course
-        week_no = week.week_number
+        # A double click waits for the generation already running and gets its sessions
+        result = plan_week_sessions(week, use_cache=not req_data.get('no_cache'))
+        if result is None:
+            return jsonify({"error": "Week is planned"}), 400
         
-        sessions_count = int(course.meta_data.get('sessionsPerWeek', 2))
-        hours_per_session = int(course.meta_data.get('hours_per_session', 2))
+        return jsonify({"message": "Sessions generated successfully", **result}), 200
 
+    except GenAIUnavailableError as e:
+        db.session.rollback()
+        return genai_unavailable(e)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f"Exception met while trying to generate sessions: {str(e)}"}), 500
 
-        # TODO: Implement AI response
-        context_json = {
-            "name": course.name,
-            "content": course.content,
-            "objectives": course.meta_data.get('objectives'),
-            "week_topic": week.topic,
-            "week_summary": week.summary,
-            "sessions_count": sessions_count,
-            "duration_minutes": hours_per_session * 60
-        }
-        
-        prompt = None
-        with open('prompt.txt', 'r', encoding='utf-8') as file:
-            prompt = file.read()
-        if not prompt:
-            raise ImportError("Prompt cannot be found") 
-        
-        
-        # Will think of some way to encapsulate the context of the whole course in the prompt later
-        #   Embeddings?
-        prompt += f"""
-            Generate {sessions_count} sessions' minutes for week {week_no} of this following course.
-            {json.dumps(context_json, indent=2, ensure_ascii=False)}.
-            Make sure that the content of each lectures satisfy the week's topic and summary, and overall fits
-            into the syllabus and fulfilling the content's of the course.
-            The response format should be a **Valid JSON** containing **ONLY** the minutes of {sessions_count} sessions, each wrapped in its "session i" key.
-            e.g. {{
-              "session 1": {{
-                  "Minute 0-15": {{
-                    "topic": "Introduction to Machine Learning",
-                    "content": "This session we will learn about ...",
-                  }}
-              }}  
-            }}
-        """   
-        
-        print("Prompt is structured. Sending prompt to GenAI...")
-        res = None
-        response = None
-        if use_actual_ai_response:
+def plan_week_sessions(week: Week, use_cache: bool = True, priority: int = PRIORITY_INTERACTIVE) -> dict[str, Any] | None:
+    """
+    Generates and commits the sessions of an unplanned week, and returns them as JSON.
+    Concurrent calls for the same week and prompt share one generation, and the week is
+    claimed in the database first, so None means another request planned it already.
+    """
+    prompt, sessions_count = render_week_sessions_prompt(week)
+    # Read before claiming, committing the claim expires the week
+    week_id = week.id
+    course_id = week.course_id
+    
+    def plan():
+        if not claim_week(week_id):
+            return None
+        try:
+            created_sessions = generate_week_sessions(week_id, prompt, sessions_count, use_cache, priority)
+            timed_commit()
+        except BaseException:
+            db.session.rollback()
+            release_week(week_id)
+            raise
+        invalidate_cached_reads(course_id=course_id, week_id=week_id)
+        return {"week_id": week_id, "sessions": created_sessions}
+    
+    return single_flight.do(week_sessions_flight(week_id), plan)
+
+def week_sessions_flight(week_id: int) -> tuple:
+    """
+    single_flight key of the first generation of the week's sessions, shared by the plain and the streaming endpoint.
+    The week is only planned once, so the prompt does not need to be part of it.
+    """
+    return ("week_sessions", week_id)
+
+def abandoned_claims_before() -> datetime:
+    """
+    A claim taken before this (WEEK_CLAIM_TIMEOUT_SECONDS ago) whose sessions are still not stored
+    was left by a generation whose process died
+    """
+    return naive_utcnow() - timedelta(seconds=current_app.config.get("WEEK_CLAIM_TIMEOUT_SECONDS", 1800))
+
+def week_claimable():
+    """
+    The condition of a week nobody generates: unplanned, or claimed by a generation that died
+    """
+    return or_(Week.planned == False, Week.claimed_at < abandoned_claims_before())
+
+def claim_abandoned(week: Week) -> bool:
+    return week.claimed_at is not None and week.claimed_at < abandoned_claims_before()
+
+def claim_week(week_id: int) -> bool:
+    """
+    Marks the week as planned if nobody did yet, in one UPDATE: of two requests racing
+    (in this process or another one), only one gets True and generates the sessions.
+    A claim whose sessions were not stored within WEEK_CLAIM_TIMEOUT_SECONDS was left by a
+    process that died, and is taken over.
+    The sessions a cut off stream left behind are deleted with the claim, the new ones replace them.
+    """
+    claimed = db.session.execute(
+        db.update(Week).where(Week.id == week_id, week_claimable()).values(planned=True, claimed_at=naive_utcnow())
+    ).rowcount == 1
+    if claimed:
+        delete_week_sessions(week_id)
+    timed_commit()
+    if claimed:
+        invalidate_cached_reads(week_id=week_id)
+    return claimed
+
+def release_week(week_id: int) -> None:
+    """
+    Gives back the claim of a generation that failed, so the week can be generated again
+    """
+    db.session.execute(db.update(Week).where(Week.id == week_id).values(planned=False, claimed_at=None))
+    timed_commit()
+    invalidate_cached_reads(course_id=db.session.get(Week, week_id).course_id, week_id=week_id)
+
+def end_week_claim(week_id: int) -> None:
+    """
+    Marks the generation of the week as done (its sessions are stored with it), without committing
+    """
+    db.session.execute(db.update(Week).where(Week.id == week_id).values(claimed_at=None))
+
+def session_json(session: Session) -> dict[str, Any]:
+    return {
+        "id": session.id,
+        "session_no": session.session_no,
+        "minutes_data": session.data
+    }
+
+def generate_week_sessions(
+    week_id: int,
+    prompt: RenderedPrompt,
+    sessions_count: int,
+    use_cache: bool = True,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> list[dict[str, Any]]:
+    """
+    Asks GenAI for the minutes of every session of the week, adds them to the db session and returns them as JSON.
+    The week must be claimed already (claim_week()), committing is left to the caller.
+    """
+    print(f"Prompt is structured (~{prompt.estimated_tokens} tokens). Sending prompt to GenAI...")
+    # Okay I am poor so I must use session.json to not exceed rate limites
+    response = ask_genai(prompt.text, ResponseShape("session", sessions_count), use_cache=use_cache, priority=priority)
+    
+    print("AI response: ", response)
+    
+    return add_week_sessions(week_id, sessions_count, response)
+
+def add_week_sessions(week_id: int, sessions_count: int, response: dict[str, Any]) -> list[dict[str, Any]]:
+    """
+    Adds the sessions GenAI answered with, and the end of the week's claim, to the db session, and returns them as JSON
+    """
+    end_week_claim(week_id)
+    return insert_sessions(week_id, {
+        i: response[f"session {i}"] for i in range(1, sessions_count + 1) if response.get(f"session {i}")
+    })
+
+def insert_sessions(week_id: int, minutes_by_session: dict[int, dict[str, Any]]) -> list[dict[str, Any]]:
+    """
+    Inserts the sessions (session number -> minutes) and their segments without committing, returns them as JSON.
+    The segments go in one executemany: added as objects, the ORM would insert them one by one for their ids.
+    """
+    sessions = [Session(week_id=week_id, session_no=session_no) for session_no in minutes_by_session]
+    db.session.add_all(sessions)
+    db.session.flush()  # Give the new sessions their ids
+    
+    rows = [
+        row for session in sessions
+        for row in segment_rows(minutes_by_session[session.session_no], session_id=session.id)
+    ]
+    if rows:
+        db.session.execute(db.insert(SessionSegment), rows)
+    
+    return [
+        {
+            "id": session.id,
+            "session_no": session.session_no,
+            "minutes_data": {
+                row["label"]: block_json(row["topic"], row["content"], row["extra"])
+                for row in rows if row["session_id"] == session.id
+            }
+        } for session in sessions
+    ]
+
+def render_week_sessions_prompt(week: Week):
+    """
+    Returns the prompt for planning the week's sessions, and how many sessions it asks for
+    """
+    context_json = week_sessions_context(week)
+    sessions_count = context_json['sessions_count']
+    
+    prompt = prompt_registry.render(
+        "week_sessions",
+        sessions_count=sessions_count,
+        week_no=week.week_number,
+        context_json=json.dumps(context_json, indent=2, ensure_ascii=False)
+    )
+    return prompt, sessions_count
+
+def week_sessions_context(week: Week) -> dict[str, Any]:
+    """
+    What the prompts planning the week's sessions tell GenAI about the week and its course
+    """
+    course = week.course
+    
+    sessions_count = int(course.meta_data.get('sessionsPerWeek', 2))
+    hours_per_session = int(course.meta_data.get('hours_per_session', 2))
+
+
+    # TODO: Implement AI response
+    return {
+        "name": course.name,
+        "content": course.content,
+        "objectives": course.meta_data.get('objectives'),
+        "week_topic": week.topic,
+        "week_summary": week.summary,
+        "sessions_count": sessions_count,
+        "duration_minutes": hours_per_session * 60,
+        "related_material": related_material(week, f"{week.topic} {week.summary}", exclude_course=True)
+    }
+
+# Keys of week_sessions_context() that differ from week to week, a batched prompt sends the others once for the course
+WEEK_CONTEXT_KEYS = ("week_topic", "week_summary", "related_material")
+
+def week_batch_entry(week_no: int, context: dict[str, Any]) -> dict[str, Any]:
+    return {"week": week_no, **{key: context[key] for key in WEEK_CONTEXT_KEYS}}
+
+def render_week_sessions_batch_prompt(course_context: dict[str, Any], weeks: list[dict[str, Any]]) -> RenderedPrompt:
+    """
+    One prompt for the sessions of several weeks (week_batch_entry()) of one course, answered as "week <number>" members
+    """
+    return prompt_registry.render(
+        "week_sessions_batch",
+        sessions_count=course_context['sessions_count'],
+        context_json=json.dumps(course_context, indent=2, ensure_ascii=False),
+        weeks_json=json.dumps(weeks, indent=2, ensure_ascii=False),
+        keys=", ".join(f'"week {week["week"]}"' for week in weeks)
+    )
+
+@api_bp.route('/generate-week-sessions/stream', methods=['GET'])
+def stream_week_sessions():
+    """
+    Streaming version of /generate-week-sessions (Server-Sent Events, so it is a GET for EventSource).
+    Every session is stored and sent as a "session" event as soon as GenAI finished it.
+    """
+    week_id = request.args.get('week_id', type=int)
+    use_cache = request.args.get('no_cache', '').lower() not in ('1', 'true')
+    
+    if not week_id:
+        return jsonify({"error": "Needed weekId"}), 400
+    
+    week = db.session.get(Week, week_id)
+    if not week:
+        return jsonify({"error": "Week not found"}), 404
+    
+    # Planned by a generation still running: join it
+    if week.planned and not claim_abandoned(week) and not single_flight.in_flight(week_sessions_flight(week_id)):
+        return jsonify({"error": "Week is planned"}), 400
+    
+    prompt, sessions_count = render_week_sessions_prompt(week)
+    
+    def generate():
+        flight_key = week_sessions_flight(week_id)
+        flight, leader = single_flight.join(flight_key)
+        if not leader:
+            # The same generation is already running (double click, second tab): replay its sessions
             try:
-                res = client.models.generate_content(
-                    model="gemini-2.5-flash-lite",
-                    contents=prompt,
-                    config=types.GenerateContentConfig(
-                        temperature=0.1
-                    )
-                )
+                result = flight.wait()
             except Exception as e:
-                raise TimeoutError(f"Error while getting data from GenAI: {e}")
+                yield sse("failed", {
+                    "error": f"Exception met while trying to generate sessions: {str(e)}",
+                    "retry_after": getattr(e, "retry_after", None)
+                })
+                return
+            if result is None:
+                yield sse("failed", {"error": "Week is planned"})
+                return
+            for session in result["sessions"]:
+                yield sse("session", session)
+            yield sse("done", {"week_id": week_id, "sessions": len(result["sessions"])})
+            return
+        
+        result = None
+        error = None
+        claimed = False
+        try:
+            claimed = claim_week(week_id)
+            if not claimed:
+                yield sse("failed", {"error": "Week is planned"})
+                return
             
-            try:
-                response = clean_json(res.text)
-            except Exception as e:
-                raise TypeError(f"AI failed to return valid JSON {e}")
+            stored_sessions = {}
+            
+            def store_session(key: str, minutes_data: Any):
+                session_no = key_number(key, "session")
+                if session_no is None or session_no in stored_sessions or not 1 <= session_no <= sessions_count or not valid_member("session", minutes_data):
+                    return None
+                stored_sessions[session_no] = insert_sessions(week_id, {session_no: minutes_data})[0]
+                timed_commit()
+                invalidate_cached_reads(week_id=week_id)
+                return sse("session", stored_sessions[session_no])
+            
+            print(f"Prompt is structured (~{prompt.estimated_tokens} tokens). Streaming prompt to GenAI...")
+            shape = ResponseShape("session", sessions_count)
+            parser = TopLevelMemberParser()
+            for chunk in ask_genai_stream(prompt.text, shape, use_cache=use_cache):
+                for key, minutes_data in parser.feed(chunk):
+                    event = store_session(key, minutes_data)
+                    if event:
+                        yield event
+            
+            # Sessions the parser could not take on their own or GenAI skipped
+            response = stream_leftovers(prompt.text, shape, parser.buffer, set(stored_sessions), use_cache)
+            if not stored_sessions and not response:
+                raise TypeError("AI failed to return valid JSON sessions")
+            for key, minutes_data in response.items():
+                event = store_session(key, minutes_data)
+                if event:
+                    yield event
+            end_week_claim(week_id)
+            timed_commit()
+            
+            invalidate_cached_reads(course_id=db.session.get(Week, week_id).course_id, week_id=week_id)
+            result = {"week_id": week_id, "sessions": [stored_sessions[n] for n in sorted(stored_sessions)]}
+            
+            yield sse("done", {"week_id": week_id, "sessions": len(stored_sessions)})
+        except Exception as e:
+            logging.exception("An error occurred during streaming")
+            error = e
+            db.session.rollback()
+            if claimed:
+                release_week(week_id)
+            yield sse("failed", {
+                "error": f"Exception met while trying to generate sessions: {str(e)}",
+                "retry_after": getattr(e, "retry_after", None)
+            })
+        except GeneratorExit:
+            # The client went away halfway: the week can be generated again
+            if result is None:
+                error = RuntimeError("The generation was cancelled")
+                db.session.rollback()
+                release_week(week_id)
+            raise
+        finally:
+            single_flight.finish(flight_key, flight, result=result, error=error)
+    
+    return event_stream(generate())
+
+@api_bp.route('/generate-course-sessions', methods=['POST'])
+def create_course_sessions():
+    """
+    Plans every unplanned week of a course at once.
+    The weeks are generated concurrently by a background job, poll /api/jobs/<job_id> for the per-week progress.
+    """
+    try:
+        req_data = request.get_json()
+        course_id = req_data.get('course_id')
         
-        # Okay I am poor so I must use this to not exceed rate limites
-        else :
-            with open('session.json', 'r', encoding="utf-8") as file:
-                response = file.read()
-            response = clean_json(response)
-            print("Got response")
+        if not course_id:
+            return jsonify({"error": "Needed courseId"}), 400
         
-        print("AI response: ", response)
+        course = db.session.get(Course, course_id)
+        if not course:
+            return jsonify({"error": "Course not found"}), 404
         
-        created_sessions = []
+        # The request can lower the concurrency, but never raise it above the configured cap
+        max_concurrency = current_app.config.get("COURSE_PLAN_CONCURRENCY", 4)
+        if req_data.get('max_concurrency'):
+            max_concurrency = max(1, min(int(req_data['max_concurrency']), max_concurrency))
         
-        for i in range(1, sessions_count + 1):
-            session_key = f"session {i}"
-            minutes_data = response.get(session_key)
-            
-            if minutes_data:
-                new_session = Session(
-                    week_id = week_id,
-                    session_no = i,
-                    data = minutes_data
-                )
-                db.session.add(new_session)
-                created_sessions.append(new_session)
-                
-        
-        week.planned = True
-        db.session.commit()
+        job = job_queue.enqueue("course_sessions", {
+            "course_id": course.id,
+            "max_concurrency": max_concurrency,
+            "use_cache": not req_data.get('no_cache')
+        })
         
         return jsonify({
-            "message": "Sessions generated successfully",
-            "week_id": week.id,
-            "sessions": [
-                {
-                    "id": s.id,
-                    "session_no": s.session_no,
-                    "minutes_data": s.data
-                } for s in created_sessions
-            ]
-        }), 200
-
+            "status": f"Session generation queued for course: {course.name}",
+            "job_id": job.id,
+            "status_url": f"/api/jobs/{job.id}"
+        }), 202
     except Exception as e:
+        logging.exception("An error occurred during processing")
+        return jsonify({"error": f"{e}"}), 400
+
+@job_queue.handler("course_sessions")
+def run_course_sessions_job(payload: dict, report_progress) -> dict:
+    """
+    Plans every unplanned week of the course (or abandoned by a crashed generation), several weeks per prompt (see batching.py).
+    The weeks are claimed first, like plan_week_sessions() does, and each one is committed as soon as its sessions came back.
+    """
+    app = current_app._get_current_object()
+    use_cache = payload.get('use_cache', True)
+    
+    weeks = db.session.execute(
+        db.select(Week)
+        .where(Week.course_id == payload['course_id'], week_claimable())
+        .order_by(Week.week_number)
+    ).scalars().all()
+    
+    progress = {
+        "course_id": payload['course_id'],
+        "total": len(weeks),
+        "completed": 0,
+        "failed": 0,
+        # Planned, or being planned, by another request: nothing was generated for them here
+        "skipped": 0,
+        "weeks": {
+            str(week.id): {"week_number": week.week_number, "status": "pending"} for week in weeks
+        }
+    }
+    report_progress(progress)
+    
+    if not weeks:
+        return progress
+    
+    def finish_week(week_id: int, status: str, **details):
+        progress["weeks"][str(week_id)].update(status=status, **details)
+        progress["completed" if status == "done" else status] += 1
+    
+    # Read before claiming, committing the claims expires the weeks
+    contexts = {week.id: week_sessions_context(week) for week in weeks}
+    week_numbers = {week.id: week.week_number for week in weeks}
+    course_context = {key: value for key, value in contexts[weeks[0].id].items() if key not in WEEK_CONTEXT_KEYS}
+    sessions_count = course_context['sessions_count']
+    
+    # A week another request is generating, or planned meanwhile, is left to it
+    flights = {}
+    items = []
+    for week_id, week_no in week_numbers.items():
+        flight, leader = single_flight.join(week_sessions_flight(week_id))
+        if not leader:
+            finish_week(week_id, "skipped", sessions=None)
+            continue
+        if not claim_week(week_id):
+            single_flight.finish(week_sessions_flight(week_id), flight, result=None)
+            finish_week(week_id, "skipped", sessions=None)
+            continue
+        flights[week_id] = flight
+        week_part = week_batch_entry(week_no, contexts[week_id])
+        items.append(BatchItem(
+            key=week_id,
+            tokens=estimate_tokens(json.dumps(week_part, ensure_ascii=False)) + sessions_count * SESSION_ANSWER_TOKENS,
+            payload=week_part
+        ))
+    
+    def plan_weeks(batch: list[BatchItem]) -> dict[int, dict[str, Any]]:
+        # Only weeks with all of their sessions are taken, the rest is asked again in smaller batches
+        week_parts = [item.payload for item in batch]
+        with app.app_context():
+            prompt = render_week_sessions_batch_prompt(course_context, week_parts)
+            response = ask_genai(
+                prompt.text,
+                ResponseShape(
+                    "week", max(part['week'] for part in week_parts),
+                    numbers=tuple(part['week'] for part in week_parts),
+                    nested=tuple(ResponseShape("session", sessions_count) for _ in week_parts)
+                ),
+                use_cache=use_cache,
+                priority=PRIORITY_BULK,
+                complete_missing=False
+            )
+        return {
+            item.key: response[f"week {item.payload['week']}"]
+            for item in batch if f"week {item.payload['week']}" in response
+        }
+    
+    def plan_week(item: BatchItem) -> dict[str, Any]:
+        # Each thread gets its own app context, and with it its own db session
+        with app.app_context():
+            prompt, _ = render_week_sessions_prompt(db.session.get(Week, item.key))
+            return ask_genai(prompt.text, ResponseShape("session", sessions_count), use_cache=use_cache, priority=PRIORITY_BULK)
+    
+    report_progress(progress)
+    try:
+        batches = batch_scheduler.pack(items, render_week_sessions_batch_prompt(course_context, []).estimated_tokens)
+        progress["prompts"] = len(batches)
+        
+        # GenAI runs in the scheduler's threads, the weeks are stored here one by one as their batch completes
+        for item, response, error in batch_scheduler.run(batches, plan_weeks, plan_week, payload['max_concurrency']):
+            week_id = item.key
+            if error is None:
+                try:
+                    created_sessions = add_week_sessions(week_id, sessions_count, response)
+                    timed_commit()
+                except Exception as e:
+                    logging.exception(f"Failed to store the sessions of week {week_id}")
+                    db.session.rollback()
+                    error = e
+            
+            flight = flights.pop(week_id)
+            if error is not None:
+                release_week(week_id)
+                single_flight.finish(week_sessions_flight(week_id), flight, error=error)
+                finish_week(week_id, "failed", error=str(error))
+            else:
+                invalidate_cached_reads(course_id=payload['course_id'], week_id=week_id)
+                single_flight.finish(week_sessions_flight(week_id), flight, result={"week_id": week_id, "sessions": created_sessions})
+                finish_week(week_id, "done", sessions=len(created_sessions))
+            report_progress(progress)
+    except BaseException as e:
+        # Nothing may stay claimed, or followed, by a job that stopped
         db.session.rollback()
-        return jsonify({'error': f"Exception met while trying to generate sessions: {str(e)}"}), 500
+        for week_id, flight in flights.items():
+            release_week(week_id)
+            single_flight.finish(week_sessions_flight(week_id), flight, error=e)
+        raise
+    
+    return progress
 
 @api_bp.route('/regenerate-week-sessions', methods=['GET', 'POST'])
 def redo_week_sessions():
+    """
+    Regenerates the sessions of a planned week following the teacher's prompt.
+    With "session_no" only that session is regenerated, and with "minutes" too
+    (a key of its data, e.g. "Minutes 00 - 15") only that block of it.
+    """
     
     # ONGOING: Get week's ID
     # TODO: Add the Update With AI feature
@@ -463,136 +1650,260 @@ def redo_week_sessions():
         if not week.planned:
             return jsonify({"error": "Week is not planned"}), 400
         
-        course = week.course
-        week_no = week.week_number
+        if req_data.get('session_no'):
+            return redo_one_session(week, int(req_data['session_no']), req_data.get('minutes'), user_prompt, not req_data.get('no_cache'))
         
-        sessions_count = int(course.meta_data.get('sessionsPerWeek', 2))
-        hours_per_session = int(course.meta_data.get('hours_per_session', 2))
+        prompt, sessions_count = render_regenerate_sessions_prompt(week, user_prompt)
+        
+        print(f"Prompt is structured (~{prompt.estimated_tokens} tokens). Sending prompt to GenAI...")
+        print(f"Regenerating Week {week_id} with prompt: {user_prompt[:50]}...")
+        
+        def regenerate():
+            # Okay I am poor so I must use session.json to not exceed rate limites
+            response = ask_genai(prompt.text, ResponseShape("session", sessions_count), use_cache=not req_data.get('no_cache'))
+            print("Got response")
+            
+            print("Response: ", response)
+            return replace_week_sessions(week_id, sessions_count, response)
+        
+        # The same instructions sent twice for the week share one generation and one write
+        result = single_flight.do(regenerate_sessions_flight(week_id, prompt.text), regenerate)
+        
+        return jsonify({"message": "Sessions generated successfully", **result}), 200
 
-        existing_sessions_objs = Session.query.filter_by(week_id=week_id).order_by(Session.session_no).all()
-        current_sessions_json = {
-            f"session {s.session_no}": s.data for s in existing_sessions_objs
-        }
+    except GenAIUnavailableError as e:
+        db.session.rollback()
+        return genai_unavailable(e)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f"Exception met while trying to generate sessions: {str(e)}"}), 500
 
-        # TODO: Implement AI response
-        context_json = {
-            "name": course.name,
-            "content": course.content,
-            "objectives": course.meta_data.get('objectives'),
-            "week_topic": week.topic,
-            "week_summary": week.summary,
-            "sessions_count": sessions_count,
-            "duration_minutes": hours_per_session * 60,
-            "current_plan": current_sessions_json,
-            "user_instructions": user_prompt
-        }
+
+def render_regenerate_sessions_prompt(week: Week, user_prompt: str) -> tuple[RenderedPrompt, int]:
+    """
+    Returns the prompt rewriting the week's sessions after the teacher's instructions, and how many sessions it asks for
+    """
+    course = week.course
+    week_no = week.week_number
+    
+    sessions_count = int(course.meta_data.get('sessionsPerWeek', 2))
+    hours_per_session = int(course.meta_data.get('hours_per_session', 2))
+
+    existing_sessions_objs = db.session.execute(
+        db.select(Session).where(Session.week_id == week.id).order_by(Session.session_no)
+        .options(joinedload(Session.segments))
+    ).unique().scalars().all()
+    current_sessions_json = {
+        f"session {s.session_no}": s.data for s in existing_sessions_objs
+    }
+
+    # TODO: Implement AI response
+    context_json = {
+        "name": course.name,
+        "content": course.content,
+        "objectives": course.meta_data.get('objectives'),
+        "week_topic": week.topic,
+        "week_summary": week.summary,
+        "sessions_count": sessions_count,
+        "duration_minutes": hours_per_session * 60,
+        "current_plan": current_sessions_json,
+        "related_material": related_material(week, f"{week.topic} {user_prompt}", exclude_course=True),
+        "user_instructions": user_prompt
+    }
+
+    prompt = prompt_registry.render(
+        "regenerate_sessions",
+        sessions_count=sessions_count,
+        week_no=week_no,
+        course_name=course.name,
+        context_json=json.dumps(context_json, indent=2, ensure_ascii=False)
+    )
+    return prompt, sessions_count
+
+def regenerate_sessions_flight(week_id: int, prompt: str) -> tuple:
+    return ("regenerate_sessions", week_id, make_key(llm.backend.model, llm.backend.config, prompt))
+
+def replace_week_sessions(week_id: int, sessions_count: int, response: dict[str, Any]) -> dict[str, Any]:
+    """
+    Replaces the sessions of the week with the ones GenAI answered with, commits, and returns them as JSON
+    """
+    delete_week_sessions(week_id)
+    
+    created_sessions = add_week_sessions(week_id, sessions_count, response)
     
+    timed_commit()
+    invalidate_cached_reads(week_id=week_id)
+    return {"week_id": week_id, "sessions": created_sessions}
+
+def delete_week_sessions(week_id: int) -> None:
+    """
+    Deletes the sessions of the week and their segments, without committing
+    """
+    db.session.execute(db.delete(SessionSegment).where(
+        SessionSegment.session_id.in_(db.select(Session.id).where(Session.week_id == week_id))
+    ))
+    db.session.execute(db.delete(Session).where(Session.week_id == week_id))
+
+def redo_one_session(week: Week, session_no: int, minutes: str | None, user_prompt: str, use_cache: bool = True):
+    """
+    Regenerates one session of the week, or one minute block of it, and updates only its segment rows.
+    The prompt carries the session (or block) and the topics of the others, not the whole week.
+    """
+    course = week.course
+    sessions_count = int(course.meta_data.get('sessionsPerWeek', 2))
+    hours_per_session = int(course.meta_data.get('hours_per_session', 2))
     
-        prompt = None
-        with open('prompt.txt', 'r', encoding='utf-8') as file:
-            prompt = file.read()
-        if not prompt:
-            raise ImportError("Prompt cannot be found")     
-        # Will think of some way to encapsulate the context of the whole course in the prompt later
-        #   Embeddings?
+    if not 1 <= session_no <= sessions_count:
+        return jsonify({"error": f"session_no must be between 1 and {sessions_count}"}), 400
     
-        prompt = f"""
-            You are an expert curriculum developer. 
-            I have an existing plan for {sessions_count} sessions for "Week {week_no}" of the course "{course.name}".
-            
-            Here is the context and the CURRENT plan:
-            {json.dumps(context_json, indent=2, ensure_ascii=False)}
-
-            **TASK:**
-            Regenerate the session minutes entirely based on the "user_refinement_instruction" provided above.
-            Modify the content, tone, or structure as requested. The modified sessions **MUST FOLLOW** all of the metadata,
-            which means that the objectives, topic, summary, sessions count and sessions' durations **DOES NOT CHANGE**.
-            The durations can **ONLY BE shorten**, **NOT** extended. (e.g. 90 sessions can only be shortened to 60 minutes, 
-            not extended to 120 minutes)
-            
-            **OUTPUT FORMAT:**
-            The response format should be a **Valid JSON** containing **ONLY** the minutes of {sessions_count} sessions, each wrapped in its "session i" key.
-            e.g. {{
-              "session 1": {{
-                  "Minute 0-15": {{
-                     "topic": "Introduction to...",
-                     "content": "This session begins with a small physical activity..."
-                  }}
-              }},
-              "session 2": ...
-            }} 
+    session = db.session.execute(
+        db.select(Session).where(Session.week_id == week.id, Session.session_no == session_no)
+        .options(joinedload(Session.segments))
+    ).unique().scalar_one_or_none()
+    segment = next((s for s in session.segments if s.label == minutes), None) if minutes and session else None
+    if minutes and segment is None:
+        return jsonify({"error": f"Session {session_no} has no block '{minutes}'"}), 404
+    
+    # Only the block topics of the other sessions, to keep them consistent without paying for their content
+    other_topics: dict[str, list[str]] = {}
+    for other_no, topic in db.session.execute(
+        db.select(Session.session_no, SessionSegment.topic)
+        .join(SessionSegment, SessionSegment.session_id == Session.id)
+        .where(Session.week_id == week.id, Session.session_no != session_no)
+        .order_by(Session.session_no, SessionSegment.position)
+    ):
+        other_topics.setdefault(f"session {other_no}", []).append(topic)
+    
+    current = session.data if session else {}
+    context_json = {
+        "name": course.name,
+        "objectives": course.meta_data.get('objectives'),
+        "week_topic": week.topic,
+        "week_summary": week.summary,
+        "duration_minutes": hours_per_session * 60,
+        "other_sessions": other_topics,
+        "current": {minutes: current[minutes]} if minutes else current,
+        "related_material": related_material(week, f"{week.topic} {user_prompt} {json.dumps(current, ensure_ascii=False)}"),
+        "user_instructions": user_prompt
+    }
+    
+    prompt = prompt_registry.render(
+        "regenerate_session",
+        session_no=session_no,
+        week_no=week.week_number,
+        course_name=course.name,
+        target=f'the minute block "{minutes}"' if minutes else "the minutes",
+        answer_keys=f'its single minute block "{minutes}"' if minutes else "all of its minute blocks",
+        context_json=json.dumps(context_json, indent=2, ensure_ascii=False)
+    )
+    
+    print(f"Prompt is structured (~{prompt.estimated_tokens} tokens). Regenerating session {session_no} of week {week.id}...")
+    
+    def regenerate():
         """
-        # Will think of some way to encapsulate the context of the whole course in the prompt later
-        #   Embeddings?
-        
-        print("Prompt is structured. Sending prompt to GenAI...")
-        print(f"Regenerating Week {week_id} with prompt: {user_prompt[:50]}...")
-        res = None
-        response = None
-        if use_actual_ai_response:
-            try:
-                res = client.models.generate_content(
-                    model="gemini-2.5-flash-lite",
-                    contents=prompt,
-                    config=types.GenerateContentConfig(
-                        temperature=0.1
-                    )
-                )
-            except Exception as e:
-                raise TimeoutError(f"Error while getting data from GenAI: {e}")
-            
-            try:
-                response = clean_json(res.text)
-            except Exception as e:
-                raise TypeError(f"AI failed to return valid JSON {e}")
-            
-            print("Got response")
+        The response body and status, shared with the identical requests that came in meanwhile
+        """
+        nonlocal session
+        response = ask_genai(
+            prompt.text, ResponseShape("session", sessions_count, numbers=(session_no,)), use_cache=use_cache
+        )
         
-        # Okay I am poor so I must use this to not exceed rate limites
-        else :
-            with open('session.json', 'r', encoding="utf-8") as file:
-                response = file.read()
-            response = clean_json(response)
-            print("Got response")
+        minutes_data = response.get(f"session {session_no}")
+        # Minute blocks with a topic and a content, like every other answer stored
+        if not minutes_data or not valid_member("session", minutes_data):
+            return {"error": "AI failed to return the session"}, 502
         
-        print("Response: ", response)
+        if minutes:
+            # GenAI is told to answer with the same key, take its only block if it renamed it
+            # Only the row of that segment is updated, the other blocks stay as they are
+            segment.block = minutes_data.get(minutes) or next(iter(minutes_data.values()))
+        elif session:
+            session.data = minutes_data
+        else:
+            # GenAI skipped it when the week was planned
+            session = Session(week_id=week.id, session_no=session_no, data=minutes_data)
+            db.session.add(session)
         
-        Session.query.filter_by(week_id=week_id).delete()
         db.session.flush()
-        
-        created_sessions = []
-        
-        for i in range(1, sessions_count + 1):
-            session_key = f"session {i}"
-            minutes_data = response.get(session_key)
-            
-            if minutes_data:
-                new_session = Session(
-                    week_id = week_id,
-                    session_no = i,
-                    data = minutes_data
-                )
-                db.session.add(new_session)
-                created_sessions.append(new_session)
-                
-        
-        db.session.commit()
-        
-        return jsonify({
-            "message": "Sessions generated successfully",
+        body = {
+            "message": "Session regenerated successfully",
             "week_id": week.id,
-            "sessions": [
-                {
-                    "id": s.id,
-                    "session_no": s.session_no,
-                    "minutes_data": s.data
-                } for s in created_sessions
-            ]
-        }), 200
+            "minutes": minutes,
+            "session": session_json(session)
+        }
+        timed_commit()
+        invalidate_cached_reads(week_id=week.id)
+        return body, 200
+    
+    flight_key = ("regenerate_session", week.id, make_key(llm.backend.model, llm.backend.config, prompt.text))
+    try:
+        body, status = single_flight.do(flight_key, regenerate)
+    except GenAIUnavailableError as e:
+        return genai_unavailable(e)
+    return jsonify(body), status
 
+@api_bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Request latency, generation stages, LLM tokens, cache and database counters in the Prometheus text format.
+    Under serve.py the counters and histograms add up every worker (up to SNAPSHOT_SECONDS old for the
+    other workers), the cache and rate limiter gauges are the ones of the worker answering.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@api_bp.route('/llm-quota', methods=['GET'])
+def llm_quota():
+    """
+    Live GenAI quota usage of the rate limiter: limits, what is left, queued calls per priority and retries.
+    """
+    return jsonify(rate_limiter.stats()), 200
+
+@api_bp.route('/llm-cache', methods=['GET', 'DELETE'])
+def llm_cache_stats():
+    """
+    GET returns the hit/miss counters and size of the LLM response cache, DELETE empties it.
+    """
+    try:
+        if request.method == 'DELETE':
+            llm_cache.clear()
+        return jsonify(llm_cache.stats()), 200
     except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': f"Exception met while trying to generate sessions: {str(e)}"}), 500
+        return jsonify({"error": str(e)}), 500
+
+
+@api_bp.route('/llm-batches', methods=['GET'])
+def llm_batch_stats():
+    """
+    How the weeks / courses were packed into shared prompts, and how often a batch had to be split
+    """
+    return jsonify(batch_scheduler.stats()), 200
+
+@api_bp.route('/embeddings', methods=['GET'])
+def embeddings_stats():
+    """
+    Size of the embedding index, or with ?course_id=N&q=text the chunks of the course closest to the text
+    """
+    course_id = request.args.get('course_id', type=int)
+    query = request.args.get('q', '')
+    if course_id and query:
+        hits = embedding_index.search(course_id, query, k=request.args.get('k', type=int))
+        return jsonify([{"key": hit.key, "score": round(hit.score, 4), "text": hit.text} for hit in hits]), 200
+    return jsonify(embedding_index.stats()), 200
+
+@api_bp.route('/response-cache', methods=['GET'])
+def response_cache_stats():
+    return jsonify(response_cache.stats()), 200
+
+
+@api_bp.route('/prompts', methods=['GET'])
+def prompt_stats():
+    """
+    Size and estimated token count of every prompt template and of the last prompt rendered from it.
+    """
+    try:
+        return jsonify(prompt_registry.stats()), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 
 @api_bp.route('/', methods=['POST', 'GET'])
@@ -605,14 +1916,15 @@ def api_index():
 def debug_database_dump():
     """
     Returns a JSON representation of the entire database.
-    Useful for debugging.
+    Useful for debugging. It is built in memory, use /db-export for large databases.
     """
     db_content = {}
     
     try:
         # 1. Inspect table names
         inspector = inspect(db.engine)
-        table_names = inspector.get_table_names()
+        # The search index is derived from the other tables
+        table_names = [t for t in inspector.get_table_names() if not is_search_table(t)]
         
         if not table_names:
             return jsonify({"status": "Database is empty", "tables": []}), 200
@@ -643,4 +1955,51 @@ def debug_database_dump():
         }), 200
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+
+@api_bp.route('/db-export', methods=['GET'])
+def database_export():
+    """
+    Streams the database as NDJSON, one {"table", "rowid", "row"} object per line.
+    Optional filters: ?table=courses&table=weeks, ?start=<rowid>&end=<rowid>
+    """
+    try:
+        all_tables = list(table_columns(db.engine))
+        tables = request.args.getlist('table') or all_tables
+        unknown = [t for t in tables if t not in all_tables]
+        if unknown:
+            return jsonify({"error": f"Unknown tables: {unknown}"}), 400
+        
+        start = request.args.get('start', type=int)
+        end = request.args.get('end', type=int)
+        
+        return Response(
+            export_rows(db.engine, tables, start=start, end=end),
+            mimetype="application/x-ndjson"
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api_bp.route('/db-import', methods=['POST'])
+def database_import():
+    """
+    Loads an NDJSON body made by /db-export, in batched transactions.
+    ?on_conflict=abort (default) | ignore | replace decides what happens with rows whose key already exists.
+    """
+    try:
+        on_conflict = request.args.get('on_conflict', 'abort')
+        batch_size = request.args.get('batch_size', IMPORT_BATCH_SIZE, type=int)
+        
+        summary = import_rows(db.engine, request.stream, on_conflict=on_conflict, batch_size=max(batch_size, 1))
+        
+        # Anything may have changed, so no cached read can be trusted anymore
+        if summary["rows"]:
+            response_cache.invalidate_all()
+            embedding_index.invalidate_all()
+        
+        if "error" in summary:
+            return jsonify(summary), 400
+        return jsonify(summary), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -1,35 +1,149 @@
-from flask import Flask, render_template, jsonify, request
+"""
+The app begins here.
+
+create_app() builds the Flask app without side effects: it reads the settings,
+binds the extensions and registers the routes, but does not touch the database
+and does not import the GenAI SDK (the client is only made on the first call).
+Creating and migrating the tables is done once, explicitly, with init_db():
+    flask --app app init-db
+python app.py does it before serving.
+"""
+from flask import Flask, render_template, jsonify
 from flask_cors import CORS
+from dotenv import load_dotenv
 
-from db import db, Teacher, Course, Session
+from db import db
 from api import api_bp
+from jobs import job_queue
+from llm_cache import llm_cache
+from prompts import prompt_registry
+from response_cache import response_cache
+from rate_limit import rate_limiter
+from llm import llm
+from metrics import metrics
+from embeddings import embedding_index
+from singleflight import single_flight
+from batching import batch_scheduler
+from db_profile import engine_options, apply_profile
+import migrations
 
 import os
 import sys
 
-app = Flask(__name__)
-# Enable CORS for all routes
-CORS(app)
-
-# Configure the database path to be in the same directory as app.py
+# The database is in the same directory as app.py by default
 basedir = os.path.abspath(os.path.dirname(__file__))
 db_path = os.path.join(basedir, "syllabus_ai.db")
 
-# Configure the SQLite database
-app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
-# Connect the database to this specific App
-db.init_app(app)
+def load_config(app: Flask) -> None:
+    """
+    Settings from the environment (and .env)
+    """
+    # Configure the SQLite database
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL", f"sqlite:///{db_path}")
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # Journal mode, busy timeout and pool sizes, see db_profile.py
+    app.config["DB_PROFILE"] = os.getenv("DB_PROFILE", "default")
+    # Number of background workers running AI generation jobs
+    app.config["JOB_WORKERS"] = int(os.getenv("JOB_WORKERS", 2))
+    # A week claimed for this long without its sessions being stored was left by a crashed process, another generation may take it over
+    app.config["WEEK_CLAIM_TIMEOUT_SECONDS"] = int(os.getenv("WEEK_CLAIM_TIMEOUT_SECONDS", 1800))
+    # Max prompts of one course (/api/generate-course-sessions) or batch upload (/api/courses/batch) generated at the same time
+    app.config["COURSE_PLAN_CONCURRENCY"] = int(os.getenv("COURSE_PLAN_CONCURRENCY", 4))
+    # LLM response cache: how long answers are kept (seconds) and how much memory / disk they may use (bytes)
+    app.config["LLM_CACHE_ENABLED"] = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+    app.config["LLM_CACHE_TTL"] = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+    app.config["LLM_CACHE_MEMORY_BYTES"] = int(os.getenv("LLM_CACHE_MEMORY_BYTES", 32 * 1024 * 1024))
+    app.config["LLM_CACHE_DISK_BYTES"] = int(os.getenv("LLM_CACHE_DISK_BYTES", 256 * 1024 * 1024))
+    # Log a warning when a rendered prompt is estimated above this many tokens
+    app.config["PROMPT_TOKEN_WARNING"] = int(os.getenv("PROMPT_TOKEN_WARNING", 8000))
+    # Weeks of a course / rows of a batch upload sent in one prompt: its estimated tokens (prompt + answer) and max items (1 = no batching)
+    app.config["LLM_BATCH_TOKEN_BUDGET"] = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", 12000))
+    app.config["LLM_BATCH_MAX_ITEMS"] = int(os.getenv("LLM_BATCH_MAX_ITEMS", 6))
+    # Server-side cache of the read endpoints' JSON (answered with ETag / 304)
+    app.config["RESPONSE_CACHE_ENABLED"] = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    app.config["RESPONSE_CACHE_MAX_ENTRIES"] = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 512))
+    # Local embedding index: the top-k related chunks of a course put in the session prompts
+    app.config["EMBEDDINGS_ENABLED"] = os.getenv("EMBEDDINGS_ENABLED", "true").lower() == "true"
+    app.config["EMBEDDINGS_DIM"] = int(os.getenv("EMBEDDINGS_DIM", 1024))
+    app.config["EMBEDDINGS_TOP_K"] = int(os.getenv("EMBEDDINGS_TOP_K", 5))
+    app.config["EMBEDDINGS_MAX_COURSES"] = int(os.getenv("EMBEDDINGS_MAX_COURSES", 128))
+    # Prometheus metrics at /api/metrics, and a warning with the stage breakdown for requests slower than this (0 = off)
+    app.config["METRICS_ENABLED"] = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    app.config["METRICS_SLOW_REQUEST_SECONDS"] = float(os.getenv("METRICS_SLOW_REQUEST_SECONDS", 0))
+    # Who answers the prompts: gemini, canned (weekly.json / session.json) or fake (generated, for load tests)
+    app.config["LLM_BACKEND"] = os.getenv("LLM_BACKEND", "gemini")
+    app.config["GENAI_API_KEY"] = os.getenv("GENAI_API_KEY")
+    app.config["GENAI_MODEL"] = os.getenv("GENAI_MODEL", "gemini-2.5-flash-lite")
+    app.config["GENAI_BASE_URL"] = os.getenv("GENAI_BASE_URL")
+    # Fake backend: characters per generated text, minute blocks per session, latency distribution, seed
+    app.config["LLM_FAKE_TEXT_CHARS"] = int(os.getenv("LLM_FAKE_TEXT_CHARS", 400))
+    app.config["LLM_FAKE_SESSION_BLOCKS"] = int(os.getenv("LLM_FAKE_SESSION_BLOCKS", 6))
+    app.config["LLM_FAKE_LATENCY"] = os.getenv("LLM_FAKE_LATENCY", "fixed:0")
+    app.config["LLM_FAKE_SEED"] = int(os.environ["LLM_FAKE_SEED"]) if os.getenv("LLM_FAKE_SEED") else None
+    # GenAI quota shared by every call (0 = no limit), and how failed calls are retried
+    app.config["GENAI_RPM"] = int(os.getenv("GENAI_RPM", 15))
+    app.config["GENAI_TPM"] = int(os.getenv("GENAI_TPM", 250000))
+    app.config["GENAI_MAX_RETRIES"] = int(os.getenv("GENAI_MAX_RETRIES", 4))
+    app.config["GENAI_BACKOFF_BASE"] = float(os.getenv("GENAI_BACKOFF_BASE", 1.0))
+    app.config["GENAI_BACKOFF_MAX"] = float(os.getenv("GENAI_BACKOFF_MAX", 30.0))
+    app.config["GENAI_MAX_WAIT"] = float(os.getenv("GENAI_MAX_WAIT", 120.0))
+
+
+def create_app(config: dict | None = None) -> Flask:
+    """
+    The app with every extension bound. config overrides the settings read from the environment.
+    """
+    load_dotenv()
+
+    app = Flask(__name__)
+    # Enable CORS for all routes
+    CORS(app)
+
+    load_config(app)
+    app.config.update(config or {})
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["DB_PROFILE"], app.config["SQLALCHEMY_DATABASE_URI"])
+
+    # Connect the database to this specific App
+    db.init_app(app)
+    apply_profile(app)
+    metrics.init_app(app)
+
+    # Background jobs need the app (and its database) to run
+    job_queue.init_app(app)
+    llm_cache.init_app(app)
+    prompt_registry.init_app(app)
+    response_cache.init_app(app)
+    embedding_index.init_app(app)
+    single_flight.init_app(app)
+    batch_scheduler.init_app(app)
+    rate_limiter.init_app(app)
+    llm.init_app(app)
+
+    app.add_url_rule('/', view_func=index)
+    app.add_url_rule('/view-syllabus', view_func=view_syllabus)
+    # Host every api endpoints at /api
+    app.register_blueprint(api_bp, url_prefix='/api')
+
+    @app.cli.command("init-db")
+    def init_db_command():
+        """Create the tables and migrate the existing ones."""
+        init_db(app)
+
+    return app
+
+
+def init_db(app: Flask) -> None:
+    """
+    Creates the missing tables and brings the existing ones up to date. Run it once per database, not per worker.
+    """
+    with app.app_context():
+        db.create_all()
+        print("Database tables created successfully")
+        # Bring tables created by older versions up to date (indexes, constraints)
+        migrations.upgrade(db.engine)
 
-with app.app_context():
-    db.create_all();
-    print("Database tables created successfully")
 
-"""
-The app begins here
-"""
-@app.route('/')
 def index():
     '''Landing page for the app'''
     try:
@@ -38,21 +152,22 @@ def index():
         return jsonify({"Error": str(e)}), 500
     
     
-@app.route('/view-syllabus')
 def view_syllabus():
     try:
         return render_template('view-syllabus.html')
     except Exception as e:
         return jsonify({"Error": str(e)}), 500
 
-# Host every api endpoints at /api
-app.register_blueprint(api_bp, url_prefix='/api')
 
 if __name__ == '__main__':
+    app = create_app()
+    init_db(app)
     print("App is running")
     if len(sys.argv) > 1:
         port = int(sys.argv[1]) # Convert string to int
         print(f"Starting on port {port}")
     else:
         print("No port provided, using default.")
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+        port = 5000
+    # Development server with the reloader, serve.py is the production one
+    app.run(debug=True, host='0.0.0.0', port=port)
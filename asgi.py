@@ -0,0 +1,137 @@
+"""
+ASGI entry point, for uvicorn:
+
+    python serve.py --server uvicorn
+    uvicorn asgi:create_asgi_app --factory --port 5000
+
+The endpoints of async_api.ROUTES (the generations that mostly wait on GenAI)
+are answered by coroutines on the event loop, hundreds of them at once in one
+process. Every other request goes to the Flask app as it is, run in a thread
+pool by a2wsgi.
+"""
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import Flask
+from werkzeug.wrappers import Request
+
+import asyncio
+import io
+import logging
+import time
+
+import async_api
+from async_api import AsyncResponse, json_response
+from metrics import metrics
+
+
+def create_asgi_app(app: Flask | None = None, wsgi_threads: int = 8):
+    """
+    The ASGI app serving app. Without one, it is made (and its tables created) here.
+    """
+    if app is None:
+        from app import create_app, init_db
+        app = create_app()
+        init_db(app)
+
+    async_api.init_app(app)
+    wsgi = WSGIMiddleware(app, workers=wsgi_threads)
+
+    async def asgi(scope, receive, send):
+        handler = async_api.ROUTES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if handler is None:
+            await wsgi(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        body = await read_body(receive)
+        request = Request(build_environ(scope, io.BytesIO(body)))
+        try:
+            response = await handler(app, request)
+        except Exception as e:
+            logging.exception("An error occurred in an async handler")
+            response = json_response({"error": str(e)}, 500)
+
+        if response is None:
+            # Left to the Flask view, which reads the body again
+            await wsgi(scope, replay(body, receive), send)
+            return
+
+        # Same as CORS(app): any origin, echoed back
+        origin = request.headers.get("Origin")
+        if origin:
+            response.headers.update({"Access-Control-Allow-Origin": origin, "Vary": "Origin"})
+        try:
+            await send_response(response, send, receive)
+        finally:
+            if metrics.enabled:
+                seconds = time.perf_counter() - started
+                metrics.request_duration.observe(seconds, method=request.method, route=request.path, status=response.status)
+
+    return asgi
+
+
+async def read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    return body
+
+
+def replay(body: bytes, receive):
+    """
+    receive() answering with the body read already, then with the client's messages again
+    """
+    replayed = False
+
+    async def replaying():
+        nonlocal replayed
+        if replayed:
+            return await receive()
+        replayed = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return replaying
+
+
+async def send_response(response: AsyncResponse, send, receive) -> None:
+    if isinstance(response.body, bytes):
+        response.headers["Content-Length"] = str(len(response.body))
+    await send({
+        "type": "http.response.start",
+        "status": response.status,
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in response.headers.items()]
+    })
+    if isinstance(response.body, bytes):
+        await send({"type": "http.response.body", "body": response.body})
+        return
+
+    events = response.body
+
+    async def pump():
+        async for event in events:
+            await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def disconnected():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    # The server drops what is sent after the client went away, so the stream is stopped
+    # (at the await it is waiting on) as soon as it is gone, like a WSGI stream on its next write
+    pumping = asyncio.ensure_future(pump())
+    watching = asyncio.ensure_future(disconnected())
+    try:
+        await asyncio.wait({pumping, watching}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watching.cancel()
+        if not pumping.done():
+            pumping.cancel()
+            await asyncio.gather(pumping, return_exceptions=True)
+        await events.aclose()
+    if not pumping.cancelled():
+        pumping.result()
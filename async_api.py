@@ -0,0 +1,513 @@
+"""
+Coroutine versions of the endpoints that spend most of their time waiting on GenAI, served by asgi.py.
+
+Under the WSGI servers a generation holds a thread for all of its seconds (or
+minutes), so a process runs as many generations at once as it has threads.
+Here the GenAI calls go through the SDK's async client (llm.backend.agenerate /
+astream), and one waiting costs a coroutine instead of a thread and its stack.
+Whatever touches the database (the reads, the claims, the writes, llm_cache)
+stays synchronous and runs in run_db(): a thread pool sized like the database
+pool, each call in an app context of its own, so SQLite never blocks the event loop.
+
+The prompts, the checks and the rows written are the ones of api.py, only the
+waiting differs.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable
+from flask import Flask
+from werkzeug.wrappers import Request
+
+import asyncio
+import json
+import logging
+import time
+
+from api import (
+    parse_course_form, render_course_prompt, insert_course, make_week, timed_commit, invalidate_cached_reads, sse,
+    render_week_sessions_prompt, week_sessions_flight, claim_week, claim_abandoned, release_week, add_week_sessions,
+    render_regenerate_sessions_prompt, regenerate_sessions_flight, replace_week_sessions, add_placeholder_weeks
+)
+from db import db, Week
+from json_repair import extract_members, key_number, valid_member
+from json_stream import TopLevelMemberParser
+from llm import llm, ResponseShape
+from llm_cache import llm_cache, make_key
+from metrics import metrics
+from prompts import prompt_registry, estimate_tokens
+from rate_limit import rate_limiter, GenAIUnavailableError, PRIORITY_INTERACTIVE
+from singleflight import single_flight
+
+
+@dataclass
+class AsyncResponse:
+    """
+    What the handlers answer with: a JSON body, or the events of a stream
+    """
+    body: bytes | AsyncIterator[str]
+    status: int = 200
+    headers: dict[str, str] = field(default_factory=dict)
+
+
+class Rejected(Exception):
+    """
+    Raised by the checks run in run_db(), answered with {"error": message} and status
+    """
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+Handler = Callable[[Flask, Request], Awaitable[AsyncResponse | None]]
+
+# (method, path) -> handler. A handler answering None leaves the request to the Flask view.
+ROUTES: dict[tuple[str, str], Handler] = {}
+
+
+def route(method: str, path: str) -> Callable[[Handler], Handler]:
+    def register(handler: Handler) -> Handler:
+        ROUTES[(method, path)] = handler
+        return handler
+    return register
+
+
+def init_app(app: Flask) -> None:
+    """
+    Makes the thread pool of run_db(), one thread per pooled database connection
+    """
+    with app.app_context():
+        pool = db.engine.pool
+    size = pool.size() if hasattr(pool, "size") else 1
+    app.extensions["async_db_executor"] = ThreadPoolExecutor(max_workers=size, thread_name_prefix="async-db")
+
+
+async def run_db(app: Flask, fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    Runs fn(*args) in the database thread pool, in an app context of its own: its db.session is
+    removed (and anything left uncommitted rolled back) when it returns
+    """
+    def run():
+        with app.app_context():
+            return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(app.extensions["async_db_executor"], run)
+
+
+def json_response(payload: Any, status: int = 200, headers: dict[str, str] | None = None) -> AsyncResponse:
+    return AsyncResponse(
+        json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+        status,
+        {"Content-Type": "application/json", **(headers or {})}
+    )
+
+
+def event_stream(events: AsyncIterator[str]) -> AsyncResponse:
+    return AsyncResponse(events, 200, {
+        "Content-Type": "text/event-stream; charset=utf-8",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"   # Don't let a reverse proxy buffer the events
+    })
+
+
+def genai_unavailable(e: GenAIUnavailableError) -> AsyncResponse:
+    """
+    Same as api.genai_unavailable()
+    """
+    headers = {"Retry-After": str(int(e.retry_after) + 1)} if e.retry_after else {}
+    return json_response({"error": str(e), "retry_after": e.retry_after}, e.status_code, headers)
+
+
+async def ask_genai_async(
+    app: Flask,
+    prompt: str,
+    shape: ResponseShape,
+    use_cache: bool = True,
+    priority: int = PRIORITY_INTERACTIVE,
+    complete_missing: bool = True,
+) -> dict[str, Any]:
+    """
+    api.ask_genai() awaiting the backend, the quota and the backoff instead of blocking a thread
+    """
+    backend = llm.backend
+
+    cache_key = make_key(backend.model, backend.config, prompt)
+    if backend.cacheable:
+        if use_cache:
+            with metrics.stage("llm_cache_lookup"):
+                cached = await run_db(app, llm_cache.get, cache_key)
+            if cached is not None:
+                print("Got response from cache")
+                with metrics.stage("parse_json"):
+                    return extract_members(cached, shape).members
+        else:
+            llm_cache.count_bypass()
+
+    async def send():
+        # Timed per attempt, the queue and the retry backoff are stages of their own
+        with metrics.stage("llm_call"):
+            answer = await backend.agenerate(prompt, shape)
+        return answer, answer.used_tokens
+
+    estimated_tokens = estimate_tokens(prompt)
+    if backend.rate_limited:
+        # Raises GenAIUnavailableError once the retries are exhausted
+        answer = await rate_limiter.acall(send, estimated_tokens, priority)
+    else:
+        answer, _ = await send()
+    metrics.record_llm_call(backend.name, "generate", estimated_tokens, answer.used_tokens)
+
+    try:
+        with metrics.stage("parse_json"):
+            extracted = extract_members(answer.text, shape)
+    except ValueError as e:
+        raise TypeError(f"AI failed to return valid JSON {e}")
+
+    response = extracted.members
+    if extracted.missing and complete_missing:
+        response.update(await ask_missing_members_async(app, prompt, shape, extracted.missing, use_cache, priority))
+
+    # Only cache complete answers, repaired ones in their clean form
+    if backend.cacheable and len(response) == len(shape.members()):
+        repaired = extracted.repaired or extracted.missing
+        await run_db(app, llm_cache.set, cache_key, backend.model, json.dumps(response, ensure_ascii=False) if repaired else answer.text)
+    return response
+
+
+async def ask_missing_members_async(
+    app: Flask,
+    prompt: str,
+    shape: ResponseShape,
+    missing: list[int],
+    use_cache: bool = True,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> dict[str, Any]:
+    """
+    Same as api.ask_missing_members()
+    """
+    missing_keys = ", ".join(f'"{shape.prefix} {n}"' for n in missing)
+    print(f"Answer is missing {missing_keys}. Asking GenAI for them again...")
+    follow_up = prompt_registry.render("missing_members", original_prompt=prompt, missing_keys=missing_keys)
+    try:
+        return await ask_genai_async(
+            app,
+            follow_up.text,
+            ResponseShape(shape.prefix, shape.count, numbers=tuple(missing)),
+            use_cache=use_cache,
+            priority=priority,
+            complete_missing=False
+        )
+    except (GenAIUnavailableError, TypeError):
+        logging.exception(f"Could not get {missing_keys} again")
+        return {}
+
+
+async def ask_genai_stream_async(
+    app: Flask,
+    prompt: str,
+    shape: ResponseShape,
+    use_cache: bool = True,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> AsyncIterator[str]:
+    """
+    api.ask_genai_stream() over the backend's async stream
+    """
+    backend = llm.backend
+
+    cache_key = make_key(backend.model, backend.config, prompt)
+    if backend.cacheable:
+        if use_cache:
+            with metrics.stage("llm_cache_lookup"):
+                cached = await run_db(app, llm_cache.get, cache_key)
+            if cached is not None:
+                print("Got response from cache")
+                yield cached
+                return
+        else:
+            llm_cache.count_bypass()
+
+    # Only the time spent waiting on the backend, not what the caller does between chunks
+    llm_seconds = 0.0
+
+    async def open_stream():
+        nonlocal llm_seconds
+        started = time.perf_counter()
+        try:
+            stream = aiter(backend.astream(prompt, shape))
+            # Errors (429s included) show up with the first chunk, and until it is
+            # out nothing was sent to our caller, so the call can still be retried
+            first = await anext(stream, None)
+        finally:
+            llm_seconds += time.perf_counter() - started
+        return (first, stream), None
+
+    estimated_tokens = estimate_tokens(prompt)
+    if backend.rate_limited:
+        first, stream = await rate_limiter.acall(open_stream, estimated_tokens, priority)
+    else:
+        (first, stream), _ = await open_stream()
+
+    chunks = []
+    last = None
+    chunk = first
+    try:
+        while chunk is not None:
+            last = chunk
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+
+            started = time.perf_counter()
+            chunk = await anext(stream, None)
+            llm_seconds += time.perf_counter() - started
+    except Exception as e:
+        raise GenAIUnavailableError(f"GenAI stream was cut off: {e}", status_code=502)
+
+    metrics.record_stage("llm_call", llm_seconds)
+    metrics.record_llm_call(backend.name, "stream", estimated_tokens, last.used_tokens if last else None)
+
+    # The usage comes with the last chunk
+    if backend.rate_limited and last is not None and last.used_tokens is not None:
+        rate_limiter.settle(estimated_tokens, last.used_tokens)
+
+    # Only cache complete answers, repaired ones in their clean form
+    text = "".join(chunks)
+    try:
+        with metrics.stage("parse_json"):
+            extracted = extract_members(text, shape)
+    except ValueError:
+        return
+    if backend.cacheable and not extracted.missing:
+        await run_db(
+            app, llm_cache.set,
+            cache_key, backend.model, json.dumps(extracted.members, ensure_ascii=False) if extracted.repaired else text
+        )
+
+
+async def stream_leftovers_async(
+    app: Flask,
+    prompt: str,
+    shape: ResponseShape,
+    streamed_text: str,
+    stored: set[int],
+    use_cache: bool = True,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> dict[str, Any]:
+    """
+    Same as api.stream_leftovers()
+    """
+    try:
+        with metrics.stage("parse_json"):
+            members = extract_members(streamed_text, shape).members
+    except ValueError:
+        members = {}
+
+    leftovers = {key: value for key, value in members.items() if key_number(key, shape.prefix) not in stored}
+    missing = [n for n in shape.members() if n not in stored and f"{shape.prefix} {n}" not in leftovers]
+    if missing:
+        leftovers.update(await ask_missing_members_async(app, prompt, shape, missing, use_cache, priority))
+    return leftovers
+
+
+@route('POST', '/api/generate-course-structure/stream')
+async def stream_course_structure(app: Flask, request: Request) -> AsyncResponse:
+    """
+    api.stream_course_structure(): the course, then every week as soon as GenAI finished it
+    """
+    data = request.form
+
+    if not data:
+        return json_response({"error": "No data was provided"}, 400)
+
+    try:
+        course_data = parse_course_form(data)
+    except Exception as e:
+        return json_response({"error": f"{e}"}, 400)
+
+    duration = course_data['duration']
+    prompt = render_course_prompt(
+        course_data['courseName'], course_data['content'], course_data['objectives'],
+        course_data['prerequisites'], duration, course_data['sessions_per_week'], course_data['homework']
+    )
+
+    def add_course() -> dict[str, Any] | None:
+        course = insert_course(
+            course_data['teacherEmail'], course_data['courseCode'], course_data['courseName'], course_data['content'], {
+                "objectives": course_data['objectives'],
+                "prerequisites": course_data['prerequisites'],
+                "duration": duration,
+                "sessions_per_week": course_data['sessions_per_week'],
+                "homework_hours": course_data['homework']
+            }
+        )
+        if not course:
+            return None
+        # Committed on its own so the course shows up while its weeks are still streaming
+        timed_commit()
+        invalidate_cached_reads(course_id=course.id)
+        return {"id": course.id, "code": course.code, "name": course.name}
+
+    def add_week(course_id: int, week_no: int, week_data: Any) -> dict[str, Any]:
+        week = make_week(course_id, week_no, week_data)
+        db.session.add(week)
+        timed_commit()
+        invalidate_cached_reads(course_id=course_id)
+        return {
+            "id": week.id,
+            "week_number": week.week_number,
+            "topic": week.topic,
+            "summary": week.summary,
+            "planned": week.planned
+        }
+
+    async def generate():
+        course = None
+        try:
+            course = await run_db(app, add_course)
+            if not course:
+                yield sse("failed", {"error": f"Course {course_data['courseCode']} already exists"})
+                return
+            yield sse("course", course)
+
+            stored_weeks = set()
+
+            async def store_week(key: str, week_data: Any):
+                week_no = key_number(key, "week")
+                if week_no is None or week_no in stored_weeks or not 1 <= week_no <= duration or not valid_member("week", week_data):
+                    return None
+                week = await run_db(app, add_week, course["id"], week_no, week_data)
+                stored_weeks.add(week_no)
+                return sse("week", week)
+
+            shape = ResponseShape("week", duration)
+            parser = TopLevelMemberParser()
+            async for chunk in ask_genai_stream_async(app, prompt.text, shape, use_cache=course_data['use_cache']):
+                for key, week_data in parser.feed(chunk):
+                    event = await store_week(key, week_data)
+                    if event:
+                        yield event
+
+            # Weeks the parser could not take on their own or GenAI skipped, then placeholders for the ones still missing
+            response = await stream_leftovers_async(app, prompt.text, shape, parser.buffer, stored_weeks, course_data['use_cache'])
+            for week_no in range(1, duration + 1):
+                event = await store_week(f"week {week_no}", response.get(f"week {week_no}", {"topic": "WIP", "summary": "WIP"}))
+                if event:
+                    yield event
+
+            yield sse("done", {"id": course["id"], "weeks": len(stored_weeks)})
+        except Exception as e:
+            logging.exception("An error occurred during streaming")
+            if course:
+                await run_db(app, add_placeholder_weeks, course["id"], duration)
+            yield sse("failed", {"error": str(e), "retry_after": getattr(e, "retry_after", None)})
+        except (GeneratorExit, asyncio.CancelledError):
+            # The client went away halfway: the course keeps all of its weeks, the ones not streamed yet as WIP
+            if course:
+                await run_db(app, add_placeholder_weeks, course["id"], duration)
+            raise
+
+    return event_stream(generate())
+
+
+@route('POST', '/api/generate-week-sessions')
+async def create_week_sessions(app: Flask, request: Request) -> AsyncResponse:
+    """
+    api.create_week_sessions(): the week is claimed and the sessions stored in run_db(), GenAI is awaited
+    """
+    try:
+        req_data = request.get_json()
+        week_id = req_data.get('week_id')
+
+        if not week_id:
+            return json_response({"error": "Needed weekId"}, 400)
+
+        def prepare():
+            week = db.session.get(Week, week_id)
+            if not week:
+                raise Rejected("Week not found", 404)
+            if week.planned and not claim_abandoned(week) and not single_flight.in_flight(week_sessions_flight(week.id)):
+                raise Rejected("Week is planned")
+            prompt, sessions_count = render_week_sessions_prompt(week)
+            return week.id, week.course_id, prompt, sessions_count
+
+        week_id, course_id, prompt, sessions_count = await run_db(app, prepare)
+        use_cache = not req_data.get('no_cache')
+
+        def store(response: dict[str, Any]) -> dict[str, Any]:
+            created_sessions = add_week_sessions(week_id, sessions_count, response)
+            timed_commit()
+            invalidate_cached_reads(course_id=course_id, week_id=week_id)
+            return {"week_id": week_id, "sessions": created_sessions}
+
+        async def plan():
+            # Same claim as api.plan_week_sessions(), so the threads and the coroutines never both generate
+            if not await run_db(app, claim_week, week_id):
+                return None
+            try:
+                print(f"Prompt is structured (~{prompt.estimated_tokens} tokens). Sending prompt to GenAI...")
+                response = await ask_genai_async(app, prompt.text, ResponseShape("session", sessions_count), use_cache=use_cache)
+                return await run_db(app, store, response)
+            except BaseException:
+                await run_db(app, release_week, week_id)
+                raise
+
+        # A double click waits for the generation already running and gets its sessions
+        result = await single_flight.ado(week_sessions_flight(week_id), plan)
+        if result is None:
+            return json_response({"error": "Week is planned"}, 400)
+
+        return json_response({"message": "Sessions generated successfully", **result})
+
+    except Rejected as e:
+        return json_response({"error": str(e)}, e.status)
+    except GenAIUnavailableError as e:
+        return genai_unavailable(e)
+    except Exception as e:
+        return json_response({'error': f"Exception met while trying to generate sessions: {str(e)}"}, 500)
+
+
+@route('POST', '/api/regenerate-week-sessions')
+async def redo_week_sessions(app: Flask, request: Request) -> AsyncResponse | None:
+    """
+    api.redo_week_sessions() for the whole week. A single session (session_no) is left to the Flask view.
+    """
+    try:
+        req_data = request.get_json()
+        if req_data.get('session_no'):
+            return None
+
+        week_id = req_data.get('week_id')
+        user_prompt = req_data.get('prompt')
+
+        if not week_id:
+            return json_response({"error": "Needed weekId"}, 400)
+        if not user_prompt:
+            return json_response({"error": "Need a prompt to regenerate session"})
+
+        def prepare():
+            week = db.session.get(Week, week_id)
+            if not week:
+                raise Rejected("Week not found", 404)
+            if not week.planned:
+                raise Rejected("Week is not planned")
+            return render_regenerate_sessions_prompt(week, user_prompt)
+
+        prompt, sessions_count = await run_db(app, prepare)
+
+        print(f"Prompt is structured (~{prompt.estimated_tokens} tokens). Sending prompt to GenAI...")
+        print(f"Regenerating Week {week_id} with prompt: {user_prompt[:50]}...")
+
+        async def regenerate():
+            response = await ask_genai_async(app, prompt.text, ResponseShape("session", sessions_count), use_cache=not req_data.get('no_cache'))
+            return await run_db(app, replace_week_sessions, week_id, sessions_count, response)
+
+        # The same instructions sent twice for the week share one generation and one write
+        result = await single_flight.ado(regenerate_sessions_flight(week_id, prompt.text), regenerate)
+
+        return json_response({"message": "Sessions generated successfully", **result})
+
+    except Rejected as e:
+        return json_response({"error": str(e)}, e.status)
+    except GenAIUnavailableError as e:
+        return genai_unavailable(e)
+    except Exception as e:
+        return json_response({'error': f"Exception met while trying to generate sessions: {str(e)}"}, 500)
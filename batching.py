@@ -0,0 +1,143 @@
+"""
+Packs pending generations into shared prompts.
+
+Every prompt sent to GenAI starts with prompt.txt (~2.3k tokens) and, for the
+sessions of a week, the context of its course: planning a course week by week
+pays for them once per week, creating courses from a batch file once per
+course. Here the pending items (the unplanned weeks of a course, the rows of a
+batch) are packed in order into batches, as many as fit under a token budget
+(LLM_BATCH_TOKEN_BUDGET, the shared part + the prompt and the expected answer
+of every item) and LLM_BATCH_MAX_ITEMS, and every batch is sent as one prompt
+whose JSON answer has a member per item.
+
+Whatever a batch did not answer usably (a broken answer, or members missing
+or incomplete) is sent again in two halves, down to single items, which go
+through the caller's one-item prompt. A batch that ran out of GenAI quota is
+not split (that would only spend more of it): its items fail.
+
+LLM_BATCH_MAX_ITEMS=1 sends every item on its own, as before batching.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Iterator
+from flask import Flask
+
+import logging
+import threading
+
+from rate_limit import GenAIUnavailableError
+
+
+@dataclass
+class BatchItem:
+    key: Hashable       # What the answer is for, e.g. a week id
+    tokens: int         # Its part of the prompt and its expected answer
+    payload: Any = None
+
+
+# Answers of a batch: item key -> answer, the items left out were not answered usably
+AskBatch = Callable[[list[BatchItem]], dict[Hashable, Any]]
+AskOne = Callable[[BatchItem], Any]
+
+
+class BatchScheduler:
+    """
+    Same pattern as `db`: instantiate once, bind to the app later with init_app()
+    """
+
+    def __init__(self, token_budget: int = 12000, max_items: int = 6):
+        self.token_budget = token_budget
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._counters = {
+            "batches": 0,
+            "batched_items": 0,
+            "splits": 0,
+            "single_items": 0,
+        }
+
+    def init_app(self, app: Flask) -> None:
+        self.token_budget = app.config.get("LLM_BATCH_TOKEN_BUDGET", self.token_budget)
+        self.max_items = max(1, app.config.get("LLM_BATCH_MAX_ITEMS", self.max_items))
+        app.extensions["batch_scheduler"] = self
+
+    def pack(self, items: list[BatchItem], shared_tokens: int) -> list[list[BatchItem]]:
+        """
+        The items in order, cut into batches of at most max_items whose shared_tokens + tokens stay
+        within the budget. An item over the budget on its own gets a batch of its own.
+        """
+        batches = []
+        batch, batch_tokens = [], shared_tokens
+        for item in items:
+            if batch and (len(batch) >= self.max_items or batch_tokens + item.tokens > self.token_budget):
+                batches.append(batch)
+                batch, batch_tokens = [], shared_tokens
+            batch.append(item)
+            batch_tokens += item.tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def run(
+        self,
+        batches: list[list[BatchItem]],
+        ask_batch: AskBatch,
+        ask_one: AskOne,
+        max_workers: int,
+    ) -> Iterator[tuple[BatchItem, Any, BaseException | None]]:
+        """
+        Sends the batches concurrently (ask_batch, or ask_one for a single item) and yields every item
+        with its answer, or the exception it failed with, as its batch completes.
+        Both callbacks run in worker threads, the items are yielded in the caller's.
+        """
+        if not batches:
+            return
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+            futures = [executor.submit(self._answer, batch, ask_batch, ask_one) for batch in batches]
+            for future in as_completed(futures):
+                yield from future.result()
+
+    def _answer(self, batch: list[BatchItem], ask_batch: AskBatch, ask_one: AskOne) -> list[tuple[BatchItem, Any, BaseException | None]]:
+        if len(batch) == 1:
+            self._count("single_items")
+            try:
+                return [(batch[0], ask_one(batch[0]), None)]
+            except Exception as e:
+                logging.exception(f"Failed to generate {batch[0].key}")
+                return [(batch[0], None, e)]
+
+        self._count("batches")
+        self._count("batched_items", len(batch))
+        try:
+            answers = ask_batch(batch)
+        except GenAIUnavailableError as e:
+            return [(item, None, e) for item in batch]
+        except Exception:
+            logging.exception(f"Batch of {len(batch)} failed, sending it again in halves")
+            answers = {}
+
+        results = [(item, answers[item.key], None) for item in batch if item.key in answers]
+        unanswered = [item for item in batch if item.key not in answers]
+        if unanswered:
+            print(f"Batch left {len(unanswered)} of {len(batch)} unanswered. Sending them again in halves...")
+            self._count("splits")
+            half = (len(unanswered) + 1) // 2
+            for part in (unanswered[:half], unanswered[half:]):
+                if part:
+                    results += self._answer(part, ask_batch, ask_one)
+        return results
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += n
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "token_budget": self.token_budget,
+                "max_items": self.max_items,
+                **self._counters
+            }
+
+
+batch_scheduler = BatchScheduler()
@@ -0,0 +1,5 @@
+"""
+Endpoint benchmarks, run from the repository root:
+    python -m benchmarks.run
+See benchmarks/run.py for the options.
+"""
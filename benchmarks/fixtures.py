@@ -0,0 +1,154 @@
+"""
+Fills a database with synthetic teachers, courses, weeks and sessions for the benchmarks.
+
+The texts come from the fake LLM backend, sized like real GenAI answers
+(~600 characters per week, ~4.7 KB of JSON per session), and the same
+arguments always produce the same database.
+    python -m benchmarks.fixtures --database benchmarks/data/bench.db --courses 1000
+"""
+from sqlalchemy import create_engine, event, text
+
+import argparse
+import json
+import os
+import random
+import time
+
+from db import db, Teacher, Course, Week, Session, SessionSegment, segment_rows
+from llm import FakeBackend, ResponseShape
+import migrations
+
+WEEKS_PER_COURSE = 12
+SESSIONS_PER_WEEK = 2
+COURSES_PER_TEACHER = 5
+# Unplanned weeks are left for the session generation benchmark
+PLANNED_SHARE = 0.5
+INSERT_BATCH_SIZE = 2000
+
+
+def populate(
+    database_path: str,
+    courses: int,
+    weeks_per_course: int = WEEKS_PER_COURSE,
+    sessions_per_week: int = SESSIONS_PER_WEEK,
+    planned_share: float = PLANNED_SHARE,
+    seed: int = 0,
+) -> dict[str, int]:
+    """
+    Creates a fresh database at database_path and returns how many rows went into each table
+    """
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(database_path + suffix):
+            os.remove(database_path + suffix)
+    os.makedirs(os.path.dirname(os.path.abspath(database_path)), exist_ok=True)
+
+    engine = create_engine(f"sqlite:///{database_path}")
+
+    @event.listens_for(engine, "connect")
+    def fast_pragmas(dbapi_connection, connection_record):
+        # Only for the bulk load, the app opens the file with its own profile
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+        dbapi_connection.execute("PRAGMA synchronous=OFF")
+
+    db.metadata.create_all(engine)
+    migrations.upgrade(engine)
+
+    rng = random.Random(seed)
+    week_texts = FakeBackend(text_chars=550)
+    session_texts = FakeBackend(text_chars=700)
+
+    teachers = max(1, courses // COURSES_PER_TEACHER)
+    counts = {"teachers": teachers, "courses": courses, "weeks": 0, "sessions": 0}
+
+    with engine.begin() as conn:
+        conn.execute(Teacher.__table__.insert(), [
+            {"id": t, "email": f"teacher.{t}@metropolia.fi", "handle": f"teacher.{t}"}
+            for t in range(1, teachers + 1)
+        ])
+
+    week_id = 0
+    session_id = 0
+    week_rows, session_rows, block_rows = [], [], []
+
+    def flush(conn):
+        if week_rows:
+            conn.execute(Week.__table__.insert(), week_rows)
+        if session_rows:
+            conn.execute(Session.__table__.insert(), session_rows)
+        if block_rows:
+            conn.execute(SessionSegment.__table__.insert(), block_rows)
+        week_rows.clear()
+        session_rows.clear()
+        block_rows.clear()
+
+    with engine.begin() as conn:
+        for c in range(1, courses + 1):
+            conn.execute(Course.__table__.insert(), [{
+                "id": c,
+                "teacher_id": rng.randint(1, teachers),
+                "code": f"BENCH{c:06d}",
+                "name": f"Benchmark course {c}",
+                "content": f"Synthetic course {c} generated for the benchmarks",
+                "meta_data": {
+                    "objectives": "Measure the endpoints",
+                    "prerequisites": "None",
+                    "duration": weeks_per_course,
+                    "sessions_per_week": sessions_per_week,
+                    "homework_hours": 4
+                }
+            }])
+
+            weeks = json.loads(week_texts.synthesize(f"course {c}", ResponseShape("week", weeks_per_course)))
+            for week_no in range(1, weeks_per_course + 1):
+                week_id += 1
+                planned = rng.random() < planned_share
+                week_rows.append({
+                    "id": week_id,
+                    "course_id": c,
+                    "week_number": week_no,
+                    "topic": weeks[f"week {week_no}"]["topic"],
+                    "summary": weeks[f"week {week_no}"]["summary"],
+                    "planned": planned
+                })
+                if not planned:
+                    continue
+
+                sessions = json.loads(session_texts.synthesize(
+                    f"course {c} week {week_no}", ResponseShape("session", sessions_per_week)
+                ))
+                for session_no in range(1, sessions_per_week + 1):
+                    session_id += 1
+                    session_rows.append({
+                        "id": session_id,
+                        "week_id": week_id,
+                        "session_no": session_no
+                    })
+                    block_rows += segment_rows(sessions[f"session {session_no}"], session_id=session_id)
+
+            if len(week_rows) + len(session_rows) >= INSERT_BATCH_SIZE:
+                flush(conn)
+        flush(conn)
+
+    with engine.connect() as conn:
+        conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+    engine.dispose()
+
+    counts["weeks"] = week_id
+    counts["sessions"] = session_id
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default="benchmarks/data/bench.db", help="SQLite file to (re)create")
+    parser.add_argument("--courses", type=int, default=100)
+    parser.add_argument("--weeks", type=int, default=WEEKS_PER_COURSE, help="Weeks per course")
+    parser.add_argument("--sessions", type=int, default=SESSIONS_PER_WEEK, help="Sessions per planned week")
+    parser.add_argument("--planned-share", type=float, default=PLANNED_SHARE)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    counts = populate(args.database, args.courses, args.weeks, args.sessions, args.planned_share, args.seed)
+    size_mib = os.path.getsize(args.database) / 1024 / 1024
+    print(f"{args.database}: {counts} ({size_mib:.1f} MiB) in {time.perf_counter() - started:.1f}s")
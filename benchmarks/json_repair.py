@@ -0,0 +1,124 @@
+"""
+Benchmarks json_repair on a corpus of broken GenAI answers.
+
+The corpus is made from fake backend answers (weeks and sessions, sized like
+real ones) with the defects we see from GenAI: fences and prose around the
+JSON, trailing commas, smart quotes, raw newlines, missing commas, unescaped
+quotes and answers cut off halfway. For every defect it reports how many
+answers the old strip-the-fences-and-json.loads parser could read, how many
+members json_repair recovers, and the time per answer with json and orjson.
+
+    python -m benchmarks.json_repair
+    python -m benchmarks.json_repair --answers 200
+"""
+from typing import Any, Callable
+
+import argparse
+import json
+import random
+import time
+
+import json_repair
+from json_repair import extract_members
+from llm import FakeBackend, ResponseShape
+
+DEFAULT_ANSWERS = 50
+
+
+def old_clean_json(ai_text: str) -> dict[str, Any]:
+    """
+    What api.py parsed the answers with before json_repair
+    """
+    text = ai_text.strip()
+    if text.startswith("```json"):
+        text = text[7:]
+    elif text.startswith("```"):
+        text = text[3:]
+    if text.endswith("```"):
+        text = text[:-3]
+    return json.loads(text.strip())
+
+
+def cut(rng: random.Random, text: str) -> str:
+    return text[:int(len(text) * rng.uniform(0.5, 0.95))]
+
+
+DEFECTS: dict[str, Callable[[random.Random, str], str]] = {
+    "valid": lambda rng, text: text,
+    "fenced": lambda rng, text: f"```json\n{text}\n```",
+    "prose_around": lambda rng, text: f"Here is the syllabus you asked for:\n{text}\nLet me know if {{anything}} should change.",
+    "trailing_commas": lambda rng, text: text.replace('"\n    }', '",\n    }').replace("}\n}", "},\n}"),
+    "smart_quotes": lambda rng, text: text.replace('"', "“", 1).replace('": {', "”: {", 1),
+    "raw_newlines": lambda rng, text: text.replace('"summary": "', '"summary": "Overview:\n').replace('"content": "', '"content": "Plan:\n'),
+    "missing_commas": lambda rng, text: text.replace("},\n    \"", "}\n    \""),
+    "unescaped_quote": lambda rng, text: text.replace('"topic": "', '"topic": "The "best" ', 1),
+    "truncated": cut,
+    "truncated_fenced": lambda rng, text: "```json\n" + cut(rng, text),
+}
+
+
+def corpus(answers: int, seed: int = 0) -> dict[str, list[tuple[str, ResponseShape]]]:
+    rng = random.Random(seed)
+    backend = FakeBackend(text_chars=600)
+    samples = []
+    for i in range(answers):
+        shape = ResponseShape("week", 12) if i % 2 else ResponseShape("session", 2)
+        samples.append((backend.synthesize(f"answer {i}", shape), shape))
+    return {name: [(defect(rng, text), shape) for text, shape in samples] for name, defect in DEFECTS.items()}
+
+
+def measure(samples: list[tuple[str, ResponseShape]], loads: Callable[[str], Any]) -> dict[str, Any]:
+    json_repair.fast_loads = loads
+    old_ok = 0
+    members = wanted = 0
+    started = time.perf_counter()
+    for text, shape in samples:
+        try:
+            members += len(extract_members(text, shape).members)
+        except ValueError:
+            pass
+        wanted += shape.count
+    repair_us = (time.perf_counter() - started) / len(samples) * 1e6
+
+    started = time.perf_counter()
+    for text, shape in samples:
+        try:
+            old_clean_json(text)
+            old_ok += 1
+        except ValueError:
+            pass
+    old_us = (time.perf_counter() - started) / len(samples) * 1e6
+
+    return {
+        "old_ok": old_ok / len(samples),
+        "members": members / wanted,
+        "old_us": old_us,
+        "repair_us": repair_us,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--answers", type=int, default=DEFAULT_ANSWERS, help="Answers per defect")
+    args = parser.parse_args()
+
+    backends = {"json": json.loads}
+    if json_repair.orjson:
+        backends["orjson"] = json_repair.orjson.loads
+    default_loads = json_repair.fast_loads
+
+    print(f"{'defect':<18}{'old parser ok':>15}{'members kept':>14}{'old us':>9}" + "".join(f"{name + ' us':>12}" for name in backends))
+    for name, samples in corpus(args.answers).items():
+        results = {backend: measure(samples, loads) for backend, loads in backends.items()}
+        first = results["json"]
+        print(
+            f"{name:<18}{first['old_ok']:>15.0%}{first['members']:>14.0%}{first['old_us']:>9.0f}"
+            + "".join(f"{r['repair_us']:>12.0f}" for r in results.values())
+        )
+    json_repair.fast_loads = default_loads
+    if not json_repair.orjson:
+        print("\norjson is not installed, only the json backend was measured")
+
+
+if __name__ == '__main__':
+    main()
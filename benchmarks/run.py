@@ -0,0 +1,286 @@
+"""
+Benchmarks the API endpoints through the Flask test client, on synthetic databases of growing size.
+
+For every scale (number of courses) a fresh database is generated with
+benchmarks/fixtures.py, then a separate process runs every endpoint with
+1..N concurrent clients and reports p50 / p95 / p99 latency, SQL queries
+per request and the peak memory (tracemalloc) of one request.
+GenAI is replaced by the fake backend without latency, and the response cache
+is off, so the numbers are those of our own code and the database.
+
+    python -m benchmarks.run                              # compare with benchmarks/baselines.json
+    python -m benchmarks.run --save                       # record new baselines
+    python -m benchmarks.run --scales 10,100 --clients 1,8 --iterations 100
+
+Exits with 1 when a result is worse than its baseline (see --latency-tolerance).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+DATA_DIR = os.path.join(basedir, "data")
+BASELINES_FILE = os.path.join(basedir, "baselines.json")
+
+DEFAULT_SCALES = "10,100,1000"
+DEFAULT_CLIENTS = "1,4"
+DEFAULT_ITERATIONS = 40
+
+# Slower than the baseline by more than this share (and LATENCY_NOISE_MS) is a regression
+LATENCY_TOLERANCE = 1.0
+LATENCY_NOISE_MS = 5.0
+MEMORY_TOLERANCE = 0.25
+
+
+def percentile(values: list[float], share: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(share * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def endpoint_requests(week_ids: list[int], unplanned_week_ids: list[int]) -> dict[str, tuple[Callable, float]]:
+    """
+    Endpoint name -> (function sending one request with a test client, share of the iterations it runs)
+    """
+    from llm import WORDS
+
+    rng = random.Random(0)
+    rng_lock = threading.Lock()
+    # Generating sessions plans the week, every request needs a week of its own
+    unplanned = iter(unplanned_week_ids)
+    unplanned_lock = threading.Lock()
+
+    def random_week():
+        with rng_lock:
+            return rng.choice(week_ids)
+
+    def next_unplanned_week():
+        with unplanned_lock:
+            return next(unplanned)
+
+    def random_query():
+        # Two words of the fake backend's texts, the last one unfinished as while typing
+        with rng_lock:
+            first, last = rng.sample(WORDS, 2)
+        return f"{first} {last[:4]}"
+
+    return {
+        "get_all_courses": (lambda client: client.get("/api/get-all-courses"), 0.25),
+        "course_index": (lambda client: client.get("/api/courses?limit=50"), 1.0),
+        "get_week_sessions": (lambda client: client.get(f"/api/get-week-sessions?week_id={random_week()}"), 1.0),
+        "create_week_sessions": (
+            lambda client: client.post("/api/generate-week-sessions", json={"week_id": next_unplanned_week(), "no_cache": True}),
+            0.5
+        ),
+        "search": (lambda client: client.get("/api/search", query_string={"q": random_query()}), 1.0),
+        "debug_database_dump": (lambda client: client.get("/api/db-dump"), 0.1),
+        "db_export": (lambda client: client.get("/api/db-export"), 0.1),
+    }
+
+
+def run_worker(database_path: str, clients_levels: list[int], iterations: int) -> dict[str, Any]:
+    """
+    Runs in its own process: create_app() reads DATABASE_URL from the environment
+    """
+    os.environ["DATABASE_URL"] = f"sqlite:///{database_path}"
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["LLM_FAKE_LATENCY"] = "fixed:0"
+    os.environ["LLM_CACHE_ENABLED"] = "false"
+    os.environ["RESPONSE_CACHE_ENABLED"] = "false"
+
+    # The app prints every request it handles, keep stdout for the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        from app import create_app
+        app = create_app()
+        from db import db, Week
+        from sqlalchemy import event
+
+        with app.app_context():
+            week_ids = db.session.execute(db.select(Week.id).where(Week.planned == True)).scalars().all()
+            unplanned_week_ids = db.session.execute(db.select(Week.id).where(Week.planned == False)).scalars().all()
+            engine = db.engine
+
+    queries = {"count": 0}
+    queries_lock = threading.Lock()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        with queries_lock:
+            queries["count"] += 1
+
+    def query_count() -> int:
+        with queries_lock:
+            return queries["count"]
+
+    results = {}
+    for name, (send, share) in endpoint_requests(week_ids, unplanned_week_ids).items():
+        for clients in clients_levels:
+            count = max(clients, int(iterations * share))
+            client_pool = [app.test_client() for _ in range(clients)]
+
+            def timed(i: int) -> tuple[float, int]:
+                started = time.perf_counter()
+                response = send(client_pool[i % clients])
+                # Streamed bodies are only produced while they are read, without
+                # keeping them: the memory measured is the server's, not the client's
+                for _ in response.iter_encoded():
+                    pass
+                elapsed = time.perf_counter() - started
+                response.close()
+                return elapsed, response.status_code
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                try:
+                    # Warm up, then one request under tracemalloc for the peak memory
+                    timed(0)
+                    tracemalloc.start()
+                    timed(0)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+
+                    before = query_count()
+                    with ThreadPoolExecutor(max_workers=clients) as executor:
+                        samples = list(executor.map(timed, range(count)))
+                    after = query_count()
+                except StopIteration:
+                    results[f"{name}@{clients}"] = {"skipped": "not enough unplanned weeks"}
+                    continue
+
+            latencies = [elapsed * 1000 for elapsed, _ in samples]
+            results[f"{name}@{clients}"] = {
+                "requests": count,
+                "errors": sum(1 for _, status in samples if status >= 400),
+                "p50_ms": round(percentile(latencies, 0.50), 2),
+                "p95_ms": round(percentile(latencies, 0.95), 2),
+                "p99_ms": round(percentile(latencies, 0.99), 2),
+                "queries_per_request": round((after - before) / count, 2),
+                "peak_kib": round(peak / 1024, 1)
+            }
+    return results
+
+
+def compare(results: dict[str, Any], baselines: dict[str, Any], latency_tolerance: float) -> list[str]:
+    regressions = []
+    for key, result in results.items():
+        base = baselines.get(key)
+        if not base or "skipped" in result or "skipped" in base:
+            continue
+        if result["errors"] > base.get("errors", 0):
+            regressions.append(f"{key}: {result['errors']} failed requests (baseline {base.get('errors', 0)})")
+        if result["queries_per_request"] > base["queries_per_request"]:
+            regressions.append(f"{key}: {result['queries_per_request']} queries per request (baseline {base['queries_per_request']})")
+        limit = max(base["p95_ms"] * (1 + latency_tolerance), base["p95_ms"] + LATENCY_NOISE_MS)
+        if result["p95_ms"] > limit:
+            regressions.append(f"{key}: p95 {result['p95_ms']} ms (baseline {base['p95_ms']} ms)")
+        if result["peak_kib"] > base["peak_kib"] * (1 + MEMORY_TOLERANCE) + 64:
+            regressions.append(f"{key}: peak memory {result['peak_kib']} KiB (baseline {base['peak_kib']} KiB)")
+    return regressions
+
+
+def print_table(scale: int, counts: dict[str, int], results: dict[str, Any]) -> None:
+    print(f"\n== {scale} courses: {counts}")
+    print(f"{'endpoint@clients':<28}{'reqs':>6}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}{'peak KiB':>11}")
+    for key, r in results.items():
+        if "skipped" in r:
+            print(f"{key:<28}  skipped: {r['skipped']}")
+            continue
+        print(
+            f"{key:<28}{r['requests']:>6}{r['errors']:>5}{r['p50_ms']:>10}{r['p95_ms']:>10}"
+            f"{r['p99_ms']:>10}{r['queries_per_request']:>9}{r['peak_kib']:>11}"
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help="Comma separated numbers of courses")
+    parser.add_argument("--clients", default=DEFAULT_CLIENTS, help="Comma separated numbers of concurrent clients")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="Requests per endpoint and client level")
+    parser.add_argument("--save", action="store_true", help=f"Write the results to {os.path.relpath(BASELINES_FILE)}")
+    parser.add_argument("--baselines", default=BASELINES_FILE)
+    parser.add_argument("--latency-tolerance", type=float, default=LATENCY_TOLERANCE,
+                        help="Allowed p95 slowdown as a share of the baseline (1.0 = twice as slow)")
+    parser.add_argument("--reuse", action="store_true", help="Keep databases generated by an earlier run")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    clients_levels = [int(c) for c in args.clients.split(",")]
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, clients_levels, args.iterations)))
+        return 0
+
+    from benchmarks.fixtures import populate
+
+    all_results = {}
+    for scale in [int(s) for s in args.scales.split(",")]:
+        database_path = os.path.join(DATA_DIR, f"bench-{scale}.db")
+        counts_path = database_path + ".json"
+        if args.reuse and os.path.exists(database_path) and os.path.exists(counts_path):
+            with open(counts_path, "r", encoding="utf-8") as file:
+                counts = json.load(file)
+        else:
+            counts = populate(database_path, scale)
+            with open(counts_path, "w", encoding="utf-8") as file:
+                json.dump(counts, file)
+
+        # The benchmarks write (session generation), they get a copy so every run starts from the same data
+        work_path = os.path.join(DATA_DIR, f"bench-{scale}-run.db")
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(work_path + suffix):
+                os.remove(work_path + suffix)
+        shutil.copyfile(database_path, work_path)
+
+        worker = subprocess.run(
+            [sys.executable, "-m", "benchmarks.run", "--worker", work_path,
+             "--clients", args.clients, "--iterations", str(args.iterations)],
+            capture_output=True, text=True
+        )
+        if worker.returncode != 0:
+            print(worker.stderr, file=sys.stderr)
+            return worker.returncode
+
+        results = json.loads(worker.stdout.strip().splitlines()[-1])
+        print_table(scale, counts, results)
+        all_results.update({f"{key}@{scale}": value for key, value in results.items()})
+
+    if args.save:
+        with open(args.baselines, "w", encoding="utf-8") as file:
+            json.dump({
+                "machine": f"{platform.system()} {platform.machine()}, Python {platform.python_version()}",
+                "created": time.strftime("%Y-%m-%d"),
+                "results": all_results
+            }, file, indent=2, sort_keys=True)
+        print(f"\nBaselines saved to {args.baselines}")
+        return 0
+
+    if not os.path.exists(args.baselines):
+        print("\nNo baselines yet, record them with --save")
+        return 0
+
+    with open(args.baselines, "r", encoding="utf-8") as file:
+        baselines = json.load(file)["results"]
+    regressions = compare(all_results, baselines, args.latency_tolerance)
+    if regressions:
+        print("\nREGRESSIONS against the baselines:")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+    print("\nNo regressions against the baselines")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Measures the cold start of the app: what a new worker, CLI command or test run pays before it can serve.
+
+Every phase runs in a fresh interpreter, several times, and the median is reported:
+    import      python -c "import app"
+    create_app  building the app (settings, extensions, routes), without touching the database
+    init_db     creating the tables of an empty database and migrating it, done once per database
+    genai       importing the google-genai SDK, paid by the first Gemini call only
+The slowest modules of `import app` (cumulative, from python -X importtime) are listed after.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 10 --max-import-ms 800
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+DEFAULT_RUNS = 5
+TOP_MODULES = 15
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PHASES = {
+    "import": "import app",
+    "create_app": "import app; started = time.perf_counter(); app.create_app()",
+    "init_db": "import app; application = app.create_app(); started = time.perf_counter(); app.init_db(application)",
+    "genai": "from google import genai",
+}
+
+
+def time_phase(setup: str, database_path: str) -> float:
+    """
+    Milliseconds from `started` (the start of the interpreter's code if setup does not reset it) to the end of setup
+    """
+    code = (
+        "import time, io, contextlib; started = time.perf_counter()\n"
+        f"with contextlib.redirect_stdout(io.StringIO()):\n    {setup}\n"
+        "print((time.perf_counter() - started) * 1000)"
+    )
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{database_path}", "LLM_BACKEND": "fake"}
+    result = subprocess.run([sys.executable, "-c", code], cwd=root, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(top: int) -> list[tuple[str, float]]:
+    """
+    (module, cumulative ms) of the slowest modules imported by app.py itself
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=root, env={**os.environ, "LLM_BACKEND": "fake"}, capture_output=True, text=True
+    )
+    children = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Printed once imported, so a module comes after its own imports. One space of
+        # indent for the top level, two more per level.
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((name.strip(), int(cumulative) / 1000))
+        elif depth == 0:
+            if name.strip() == "app":
+                return sorted(children, key=lambda m: -m[1])[:top]
+            children = []
+    return []
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="Interpreters started per phase")
+    parser.add_argument("--max-import-ms", type=float, help="Exit with 1 when the median `import app` is slower")
+    args = parser.parse_args()
+
+    print(f"{'phase':<12}{'median ms':>11}{'min ms':>9}{'max ms':>9}")
+    medians = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for phase, setup in PHASES.items():
+            samples = []
+            for run in range(args.runs):
+                # A new empty database every time, init_db is timed on its first run
+                samples.append(time_phase(setup, os.path.join(directory, f"{phase}-{run}.db")))
+            medians[phase] = statistics.median(samples)
+            print(f"{phase:<12}{medians[phase]:>11.1f}{min(samples):>9.1f}{max(samples):>9.1f}")
+
+    print(f"\nSlowest imports of app.py (cumulative ms):")
+    for name, ms in slowest_imports(TOP_MODULES):
+        print(f"  {name:<40}{ms:>8.1f}")
+
+    if args.max_import_ms and medians["import"] > args.max_import_ms:
+        print(f"\n`import app` takes {medians['import']:.1f} ms, over the {args.max_import_ms:g} ms budget")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
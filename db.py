@@ -1,6 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import Integer, String, Text, ForeignKey, Boolean, JSON, UniqueConstraint
+from sqlalchemy import Integer, String, Text, ForeignKey, Boolean, JSON, UniqueConstraint, Index, DateTime, Float
+from datetime import datetime, timezone
+from typing import Any
+
+import re
 
 # 1. Define the Base class (standard for modern SQLAlchemy)
 class Base(DeclarativeBase):
@@ -34,14 +38,14 @@ class Course(db.Model):
     # Foreign Key pointing to Teacher
     teacher_id: Mapped[int] = mapped_column(ForeignKey("teachers.id"))
     
-    code: Mapped[str] = mapped_column(String(20), nullable=False)  # e.g. "CS101"
+    code: Mapped[str] = mapped_column(String(20), nullable=False, unique=True, index=True)  # e.g. "CS101"
     name: Mapped[str] = mapped_column(String(200), nullable=False) # e.g. "Intro to CS"
     content: Mapped[str] = mapped_column(Text, nullable=False)
     meta_data: Mapped[dict] = mapped_column(JSON, nullable=False) # Stores JSON data
 
     # Relationships
     teacher: Mapped["Teacher"] = relationship(back_populates="courses")
-    weeks: Mapped[list["Week"]] = relationship(back_populates="course", cascade="all, delete-orphan")
+    weeks: Mapped[list["Week"]] = relationship(back_populates="course", cascade="all, delete-orphan", order_by="Week.week_number")
 
 # ---------------------------------------------------------
 # 3. WEEKS
@@ -60,6 +64,8 @@ class Week(db.Model):
     topic: Mapped[str] = mapped_column(String(200), nullable=False)
     summary: Mapped[str] = mapped_column(Text, nullable=False)
     planned: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    # When the generation of its sessions claimed the week, None once they are stored (see api.claim_week())
+    claimed_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
 
     # Relationships
     course: Mapped["Course"] = relationship(back_populates="weeks")
@@ -70,19 +76,176 @@ class Week(db.Model):
 # ---------------------------------------------------------
 class Session(db.Model):
     __tablename__ = "sessions"
+    
+    # Ensure a week cannot have two "session 1"s, even when two generations race
+    __table_args__ = (
+        Index('unique_week_session', 'week_id', 'session_no', unique=True),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    week_id: Mapped[int] = mapped_column(ForeignKey("weeks.id"))
+    week_id: Mapped[int] = mapped_column(ForeignKey("weeks.id"), index=True)
     session_no: Mapped[int] = mapped_column(Integer, nullable=False)
-    data: Mapped[dict | None] = mapped_column(JSON) # Session-specific JSON
 
     # Relationships
     week: Mapped["Week"] = relationship(back_populates="sessions")
+    # The minute blocks, one row each (see SessionSegment)
+    segments: Mapped[list["SessionSegment"]] = relationship(
+        back_populates="session", cascade="all, delete-orphan", order_by="SessionSegment.position"
+    )
     
     # Optional: A shortcut to get the Course directly from a Session
     # This reads through the relationships without storing the ID in this table
     @property
     def course(self):
         return self.week.course
-    
-  
\ No newline at end of file
+
+    @property
+    def data(self) -> dict[str, Any]:
+        """
+        The minutes as GenAI answered them and the API serves them: {"Minutes 00 - 15": {"topic", "content"}, ...}
+        """
+        return segments_json(self.segments)
+
+    @data.setter
+    def data(self, minutes_data: dict[str, Any] | None) -> None:
+        # Replaces every block, set the fields of one segment to change only its row
+        self.segments = [SessionSegment(**row) for row in segment_rows(minutes_data)]
+
+# ---------------------------------------------------------
+# 4b. SESSION SEGMENTS
+# ---------------------------------------------------------
+class SessionSegment(db.Model):
+    """
+    One minute block of a session. Sessions used to keep all of them in one JSON column,
+    in rows they can be read, searched and edited one by one.
+    """
+    __tablename__ = "session_segments"
+
+    __table_args__ = (
+        Index('ix_session_segments_session', 'session_id', 'position'),
+        Index('ix_session_segments_topic', 'topic'),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    session_id: Mapped[int] = mapped_column(ForeignKey("sessions.id"), nullable=False)
+    position: Mapped[int] = mapped_column(Integer, nullable=False)     # Order of the block in the session
+    label: Mapped[str] = mapped_column(String(100), nullable=False)   # Its key in the minutes, e.g. "Minutes 00 - 15"
+    start_min: Mapped[int | None] = mapped_column(Integer)            # Read from the label, when it has numbers
+    end_min: Mapped[int | None] = mapped_column(Integer)
+    topic: Mapped[str] = mapped_column(Text, nullable=False)
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    extra: Mapped[dict | None] = mapped_column(JSON)                  # Any other member of the block, as it came
+
+    # Relationships
+    session: Mapped["Session"] = relationship(back_populates="segments")
+
+    @property
+    def block(self) -> dict[str, Any]:
+        return block_json(self.topic, self.content, self.extra)
+
+    @block.setter
+    def block(self, block: dict[str, Any]) -> None:
+        row = block_columns(block)
+        self.topic, self.content, self.extra = row["topic"], row["content"], row["extra"]
+
+
+MINUTE_RANGE = re.compile(r"(\d+)\s*(?:-|–|to)\s*(\d+)")
+MINUTE = re.compile(r"\d+")
+
+
+def minute_range(label: str) -> tuple[int | None, int | None]:
+    """
+    ("Minutes 00 - 15") -> (0, 15), ("Minute 45") -> (45, None), no numbers -> (None, None)
+    """
+    match = MINUTE_RANGE.search(label)
+    if match:
+        return int(match.group(1)), int(match.group(2))
+    match = MINUTE.search(label)
+    return (int(match.group()), None) if match else (None, None)
+
+
+def block_columns(block: Any) -> dict[str, Any]:
+    if not isinstance(block, dict):
+        # Older answers could have a bare text as the block
+        return {"topic": "", "content": "" if block is None else str(block), "extra": None}
+    extra = {key: value for key, value in block.items() if key not in ("topic", "content")}
+    return {
+        "topic": str(block.get("topic") or ""),
+        "content": str(block.get("content") or ""),
+        "extra": extra or None
+    }
+
+
+def segment_rows(minutes_data: dict[str, Any] | None, session_id: int | None = None) -> list[dict[str, Any]]:
+    """
+    The session_segments columns of every block of the minutes, in their order
+    """
+    rows = []
+    for position, (label, block) in enumerate((minutes_data or {}).items()):
+        start_min, end_min = minute_range(label)
+        row = {"position": position, "label": label, "start_min": start_min, "end_min": end_min, **block_columns(block)}
+        if session_id is not None:
+            row["session_id"] = session_id
+        rows.append(row)
+    return rows
+
+
+def block_json(topic: str, content: str, extra: dict[str, Any] | None) -> dict[str, Any]:
+    return {"topic": topic, "content": content, **(extra or {})}
+
+
+def segments_json(segments: list["SessionSegment"]) -> dict[str, Any]:
+    """
+    The minutes rebuilt from the segments, in the shape they were stored in
+    """
+    return {segment.label: segment.block for segment in segments}
+
+
+# ---------------------------------------------------------
+# 5. JOBS
+# ---------------------------------------------------------
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+def naive_utcnow() -> datetime:
+    # SQLite hands the DateTime columns back without their timezone, compare them with this
+    return utcnow().replace(tzinfo=None)
+
+class Job(db.Model):
+    __tablename__ = "jobs"
+
+    # Job ids are handed out to the client, so use a random hex string instead of a counter
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    kind: Mapped[str] = mapped_column(String(50), nullable=False)       # e.g. "course_structure"
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="queued", index=True)
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False)         # Arguments for the job handler
+    result: Mapped[dict | None] = mapped_column(JSON)                   # What the handler returned
+    error: Mapped[str | None] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow, onupdate=utcnow)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat()
+        }
+
+# ---------------------------------------------------------
+# 6. LLM RESPONSE CACHE
+# ---------------------------------------------------------
+class LLMCacheEntry(db.Model):
+    __tablename__ = "llm_cache"
+
+    # sha256 of model + config + prompt, see llm_cache.make_key()
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    model: Mapped[str] = mapped_column(String(100), nullable=False)
+    response: Mapped[str] = mapped_column(Text, nullable=False)         # Raw text GenAI answered with
+    size: Mapped[int] = mapped_column(Integer, nullable=False)          # len(response) in bytes
+    # Unix timestamps, they only need to be compared against time.time()
+    created_at: Mapped[float] = mapped_column(Float, nullable=False)
+    last_used_at: Mapped[float] = mapped_column(Float, nullable=False, index=True)
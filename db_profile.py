@@ -0,0 +1,132 @@
+"""
+SQLite tuning profiles.
+
+A profile decides the journal mode, sync level, busy timeout and connection
+pool of the database. Pick one with the DB_PROFILE environment variable:
+    - default:    WAL journal, readers never wait for the writer
+    - production: same as default, longer busy timeout, bigger pool and page cache
+    - compat:     classic rollback journal, for file systems where WAL does not work (network drives)
+"""
+from typing import Any
+from flask import Flask
+from sqlalchemy import event
+
+from db import db
+
+DB_PROFILES: dict[str, dict[str, Any]] = {
+    "default": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",    # Safe with WAL, only the last commits can be lost on power loss
+        "busy_timeout_ms": 10000,
+        "cache_size_kib": 16 * 1024,
+        "mmap_size": 0,
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_timeout": 30,
+    },
+    "production": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout_ms": 30000,
+        "cache_size_kib": 64 * 1024,
+        "mmap_size": 256 * 1024 * 1024,
+        "pool_size": 10,
+        "max_overflow": 20,
+        "pool_timeout": 30,
+    },
+    "compat": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "busy_timeout_ms": 5000,
+        "cache_size_kib": 2 * 1024,
+        "mmap_size": 0,
+        "pool_size": 5,
+        "max_overflow": 5,
+        "pool_timeout": 30,
+    },
+}
+
+
+def engine_options(profile_name: str, database_uri: str) -> dict[str, Any]:
+    """
+    SQLALCHEMY_ENGINE_OPTIONS for the profile. Set it before db.init_app()
+    """
+    if profile_name not in DB_PROFILES:
+        raise ValueError(f"Unknown DB_PROFILE '{profile_name}', expected one of {list(DB_PROFILES)}")
+    profile = DB_PROFILES[profile_name]
+
+    options: dict[str, Any] = {
+        "connect_args": {
+            # Seconds the driver waits on a locked database before raising "database is locked"
+            "timeout": profile["busy_timeout_ms"] / 1000,
+            # Connections are handed between threads by the pool (jobs, streams)
+            "check_same_thread": False,
+        },
+        "pool_pre_ping": True,
+    }
+
+    # In-memory databases live in a single connection, a pool would lose them
+    if database_uri.startswith("sqlite") and ":memory:" not in database_uri:
+        options.update({
+            "pool_size": profile["pool_size"],
+            "max_overflow": profile["max_overflow"],
+            "pool_timeout": profile["pool_timeout"],
+        })
+    return options
+
+
+def apply_profile(app: Flask) -> None:
+    """
+    Runs the profile's PRAGMAs on every new connection. Call it after db.init_app()
+    """
+    profile_name = app.config["DB_PROFILE"]
+    profile = DB_PROFILES[profile_name]
+
+    with app.app_context():
+        engine = db.engine
+
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={profile['journal_mode']}")
+        cursor.execute(f"PRAGMA synchronous={profile['synchronous']}")
+        cursor.execute(f"PRAGMA busy_timeout={int(profile['busy_timeout_ms'])}")
+        # Negative cache_size means KiB instead of pages
+        cursor.execute(f"PRAGMA cache_size=-{int(profile['cache_size_kib'])}")
+        cursor.execute(f"PRAGMA mmap_size={int(profile['mmap_size'])}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    print(f"Database profile: {profile_name} ({profile['journal_mode']} journal, synchronous={profile['synchronous']})")
+
+
+def begin_immediate(session) -> None:
+    """
+    Opens the session's transaction right away, taking SQLite's write lock.
+    Call it before the first begin_nested(): pysqlite only sends BEGIN in front
+    of the first INSERT/UPDATE, so a SAVEPOINT made before that runs outside of
+    any transaction and commits everything as soon as it is released.
+    """
+    connection = session.connection()
+    if connection.dialect.name == "sqlite" and not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def warm_pool(app: Flask) -> int:
+    """
+    Opens the pool's connections (running the PRAGMAs above) before the first requests need them.
+    Returns how many were opened.
+    """
+    with app.app_context():
+        engine = db.engine
+
+    size = engine.pool.size() if hasattr(engine.pool, "size") else 1
+    # Checked out together, or the pool would hand the same connection back every time
+    connections = [engine.connect() for _ in range(size)]
+    for connection in connections:
+        connection.exec_driver_sql("SELECT 1")
+        connection.close()
+    return size
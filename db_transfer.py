@@ -0,0 +1,175 @@
+"""
+NDJSON export / import of the database tables.
+
+Every line is one row: {"table": "courses", "rowid": 3, "row": {...}}
+Rows are read in rowid order, one chunk at a time, so an export never holds
+more than a chunk in memory and never keeps a read transaction open while the
+client is slow. Imports are written in batched transactions.
+"""
+from typing import Any, Iterable, Iterator
+from sqlalchemy import Engine, inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+
+import json
+
+from db import segment_rows
+from search import is_search_table
+
+EXPORT_CHUNK_SIZE = 500
+IMPORT_BATCH_SIZE = 1000
+
+CONFLICT_CLAUSES = {
+    "abort": "INSERT",
+    "ignore": "INSERT OR IGNORE",
+    "replace": "INSERT OR REPLACE",
+}
+
+
+def table_columns(engine: Engine) -> dict[str, list[str]]:
+    """
+    Table name -> column names, for every table the app owns.
+    The search index is left out: it is built from the other tables, by their triggers.
+    """
+    inspector = inspect(engine)
+    return {
+        table: [c["name"] for c in inspector.get_columns(table)]
+        for table in inspector.get_table_names()
+        if not is_search_table(table)
+    }
+
+
+def quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def export_rows(
+    engine: Engine,
+    tables: list[str],
+    start: int | None = None,
+    end: int | None = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> Iterator[str]:
+    """
+    Yields one NDJSON line per row of the given tables, limited to start <= rowid <= end
+    """
+    for table in tables:
+        last_rowid = (start - 1) if start is not None else None
+
+        while True:
+            conditions = []
+            params: dict[str, Any] = {"limit": chunk_size}
+            if last_rowid is not None:
+                conditions.append("rowid > :last_rowid")
+                params["last_rowid"] = last_rowid
+            if end is not None:
+                conditions.append("rowid <= :end")
+                params["end"] = end
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+            # Table names are checked against the inspector by the caller
+            with engine.connect() as conn:
+                result = conn.execute(
+                    text(f"SELECT rowid AS __rowid__, * FROM {quote(table)} {where} ORDER BY rowid LIMIT :limit"),
+                    params
+                )
+                columns = list(result.keys())[1:]
+                rows = result.fetchall()
+
+            for row in rows:
+                yield json.dumps({
+                    "table": table,
+                    "rowid": row[0],
+                    "row": dict(zip(columns, row[1:]))
+                }, ensure_ascii=False, default=str) + "\n"
+
+            if len(rows) < chunk_size:
+                break
+            last_rowid = rows[-1][0]
+
+
+def import_rows(
+    engine: Engine,
+    lines: Iterable[bytes | str],
+    on_conflict: str = "abort",
+    batch_size: int = IMPORT_BATCH_SIZE,
+) -> dict[str, Any]:
+    """
+    Inserts the NDJSON rows produced by export_rows(), one transaction per batch.
+    A bad line or failing batch stops the import and is reported under "error",
+    the batches before it stay committed.
+    """
+    if on_conflict not in CONFLICT_CLAUSES:
+        raise ValueError(f"on_conflict must be one of {list(CONFLICT_CLAUSES)}")
+    columns_by_table = table_columns(engine)
+    # A batch is written parents first: the search triggers of a row read its parents (the course of a segment)
+    order = {table: i for i, (table, _) in enumerate(inspect(engine).get_sorted_table_and_fkc_names()) if table}
+
+    summary: dict[str, Any] = {"rows": 0, "batches": 0, "tables": {}}
+    batch: dict[str, list[dict[str, Any]]] = {}
+    batch_rows = 0
+
+    def flush():
+        nonlocal batch, batch_rows
+        if not batch_rows:
+            return
+        with engine.begin() as conn:
+            for table, rows in sorted(batch.items(), key=lambda item: order.get(item[0], len(order))):
+                # Rows of one table can carry different columns, group them by their column set
+                by_columns: dict[tuple[str, ...], list[dict[str, Any]]] = {}
+                for row in rows:
+                    by_columns.setdefault(tuple(row.keys()), []).append(row)
+
+                for columns, same_rows in by_columns.items():
+                    conn.execute(
+                        text(
+                            f"{CONFLICT_CLAUSES[on_conflict]} INTO {quote(table)} "
+                            f"({', '.join(quote(c) for c in columns)}) "
+                            f"VALUES ({', '.join(':' + f'c{i}' for i in range(len(columns)))})"
+                        ),
+                        [{f"c{i}": row[c] for i, c in enumerate(columns)} for row in same_rows]
+                    )
+                summary["tables"][table] = summary["tables"].get(table, 0) + len(rows)
+
+        summary["rows"] += batch_rows
+        summary["batches"] += 1
+        batch = {}
+        batch_rows = 0
+
+    try:
+        for line_no, line in enumerate(lines, start=1):
+            if isinstance(line, bytes):
+                line = line.decode("utf-8")
+            if not line.strip():
+                continue
+
+            try:
+                record = json.loads(line)
+                table = record["table"]
+                row = record["row"]
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f"Line {line_no} is not a valid export row: {e}")
+
+            if table not in columns_by_table:
+                raise ValueError(f"Line {line_no}: unknown table '{table}'")
+            if table == "sessions" and "data" in row and "data" not in columns_by_table[table]:
+                # Exported before the minutes moved to session_segments
+                data = row.pop("data")
+                minutes_data = json.loads(data) if isinstance(data, str) else data
+                segments = segment_rows(minutes_data if isinstance(minutes_data, dict) else {}, session_id=row["id"])
+                for segment in segments:
+                    segment["extra"] = json.dumps(segment["extra"]) if segment["extra"] is not None else None
+                batch.setdefault("session_segments", []).extend(segments)
+                batch_rows += len(segments)
+            unknown = set(row) - set(columns_by_table[table])
+            if unknown:
+                raise ValueError(f"Line {line_no}: unknown columns {sorted(unknown)} for table '{table}'")
+
+            batch.setdefault(table, []).append(row)
+            batch_rows += 1
+            if batch_rows >= batch_size:
+                flush()
+
+        flush()
+    except (ValueError, SQLAlchemyError) as e:
+        summary["error"] = str(e)
+    return summary
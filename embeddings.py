@@ -0,0 +1,303 @@
+"""
+Local embedding index of the courses, for retrieval in the prompts.
+
+Every course is cut into chunks (its content and objectives, every week's
+topic and summary, every minute block (segment) of its sessions) embedded with a hashing
+vectorizer: the words and word pairs of a chunk are hashed into EMBEDDINGS_DIM
+buckets, so there is no vocabulary to learn and nothing goes over the network.
+Searches weight the buckets with their IDF within the course and rank the
+chunks by cosine similarity, so a prompt only carries the top-k parts of the
+course related to what is generated.
+
+The index of a course is built from the database the first time it is
+searched, and kept (as NumPy arrays) for the EMBEDDINGS_MAX_COURSES last
+searched courses. Writes call invalidate() after committing, and the weeks they
+touched are embedded again on the next search of their course.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Iterable
+from flask import Flask
+from functools import lru_cache
+
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from db import db, Course, Week, Session, SessionSegment
+
+# Week number of the course's own chunk (content and objectives)
+COURSE_WEEK_NO = 0
+
+TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in into is it its of on or that the their then this to was "
+    "were will with students student week session minutes minute".split()
+)
+
+
+@dataclass
+class Hit:
+    key: str
+    text: str
+    score: float
+
+
+@dataclass
+class CourseIndex:
+    keys: list[str]
+    texts: list[str]
+    week_numbers: np.ndarray            # Of every chunk, COURSE_WEEK_NO for the course's own
+    matrix: np.ndarray                  # One embedding per chunk
+    week_ids: dict[int, int] = field(default_factory=dict)     # week id -> week number
+    # Computed once per index, so a search does not copy the matrix
+    idf: np.ndarray = field(init=False)         # Of every bucket, within the course
+    norms: np.ndarray = field(init=False)       # Of every chunk once IDF weighted
+
+    def __post_init__(self):
+        document_frequency = np.count_nonzero(self.matrix, axis=0)
+        self.idf = (np.log((1 + len(self.keys)) / (1 + document_frequency)) + 1).astype(np.float32)
+        self.norms = np.sqrt(np.square(self.matrix) @ np.square(self.idf))
+
+
+@lru_cache(maxsize=1 << 16)
+def feature_hash(word: str) -> int:
+    # crc32 rather than hash(): the same text must give the same prompt in every process (llm_cache keys)
+    return zlib.crc32(word.encode("utf-8"))
+
+
+def words(text: str) -> list[str]:
+    return [word for word in TOKEN.findall(text.lower()) if len(word) > 1 and word not in STOPWORDS]
+
+
+def feature_hashes(text: str) -> np.ndarray:
+    """
+    Hashes of the words of the text and of its word pairs, the pairs mixed from the words' hashes
+    """
+    unigrams = np.fromiter(map(feature_hash, words(text)), dtype=np.uint64)
+    bigrams = (unigrams[:-1] * np.uint64(0x9E3779B1) + unigrams[1:]) & np.uint64(0xFFFFFFFF)
+    return np.concatenate([unigrams, bigrams]).astype(np.uint32)
+
+
+def embed(texts: list[str], dim: int) -> np.ndarray:
+    """
+    Hashed, sublinear term counts: one row of dim float32 per text
+    """
+    output = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        hashes = feature_hashes(text)
+        if not hashes.size:
+            continue
+        # The top bit picks the sign, so colliding features tend to cancel out instead of adding up
+        signs = np.where(hashes >> 31, -1.0, 1.0)
+        counts = np.bincount(hashes % dim, weights=signs, minlength=dim)
+        output[row] = np.sign(counts) * np.log1p(np.abs(counts))
+    return output
+
+
+def week_chunks(week_no: int, topic: str, summary: str, sessions: Iterable[tuple[int, Any]]) -> list[tuple[str, str]]:
+    """
+    (key, text) of the chunks of a week and its sessions' minute blocks
+    """
+    chunks = [(f"week {week_no}", f"Week {week_no}: {topic}. {summary}")]
+    for session_no, data in sorted(sessions, key=lambda s: s[0]):
+        for minutes, block in (data or {}).items():
+            if isinstance(block, dict):
+                chunks.append((
+                    f"week {week_no} / session {session_no} / {minutes}",
+                    f"{block.get('topic', '')}: {block.get('content', '')}"
+                ))
+    return chunks
+
+
+class EmbeddingIndex:
+    """
+    Same pattern as `db`: instantiate once, bind to the app later with init_app()
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.dim = 1024
+        self.top_k = 5
+        self.max_courses = 128
+
+        # course id -> index, least recently searched first
+        self._courses: OrderedDict[int, CourseIndex] = OrderedDict()
+        # Written since the index of the course was built: weeks to embed again, or the whole course
+        self._stale_weeks: dict[int, set[int]] = {}
+        self._stale_courses: set[int] = set()
+        self._lock = threading.Lock()
+        self._counters = {
+            "searches": 0,
+            "courses_built": 0,
+            "weeks_refreshed": 0
+        }
+
+    def init_app(self, app: Flask) -> None:
+        self.enabled = app.config.get("EMBEDDINGS_ENABLED", self.enabled)
+        self.dim = app.config.get("EMBEDDINGS_DIM", self.dim)
+        self.top_k = app.config.get("EMBEDDINGS_TOP_K", self.top_k)
+        self.max_courses = app.config.get("EMBEDDINGS_MAX_COURSES", self.max_courses)
+        app.extensions["embedding_index"] = self
+
+    def search(
+        self,
+        course_id: int,
+        query: str,
+        k: int | None = None,
+        exclude_weeks: Iterable[int] = (),
+    ) -> list[Hit]:
+        """
+        The k chunks of the course closest to query, leaving out the chunks of exclude_weeks
+        """
+        if not self.enabled or not query:
+            return []
+
+        index = self._get(course_id)
+        if index is None or not index.keys:
+            return []
+
+        # Cosine of the IDF weighted vectors: (matrix * idf) . (query * idf) = matrix . (query * idf^2)
+        weighted_query = embed([query], self.dim)[0] * index.idf
+        norms = index.norms * np.linalg.norm(weighted_query)
+        scores = (index.matrix @ (weighted_query * index.idf)) / np.where(norms == 0, 1, norms)
+        excluded = list(exclude_weeks)
+        if excluded:
+            scores[np.isin(index.week_numbers, excluded)] = 0
+
+        k = min(k or self.top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        with self._lock:
+            self._counters["searches"] += 1
+        return [Hit(index.keys[i], index.texts[i], float(scores[i])) for i in top if scores[i] > 0]
+
+    def invalidate(self, course_id: int | None = None, week_id: int | None = None) -> None:
+        """
+        Call it after committing a write. With week_id only that week is embedded again.
+        """
+        with self._lock:
+            if week_id is not None:
+                for cid, index in self._courses.items():
+                    if week_id in index.week_ids:
+                        self._stale_weeks.setdefault(cid, set()).add(week_id)
+                        return
+            # A week the index does not know yet (or the course itself) changed
+            if course_id is not None and course_id in self._courses:
+                self._stale_courses.add(course_id)
+
+    def invalidate_all(self) -> None:
+        with self._lock:
+            self._courses.clear()
+            self._stale_weeks.clear()
+            self._stale_courses.clear()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "dim": self.dim,
+                "top_k": self.top_k,
+                **self._counters,
+                "courses": len(self._courses),
+                "chunks": sum(len(index.keys) for index in self._courses.values())
+            }
+
+    def _get(self, course_id: int) -> CourseIndex | None:
+        with self._lock:
+            index = self._courses.get(course_id)
+            rebuild = index is None or course_id in self._stale_courses
+            stale_weeks = self._stale_weeks.pop(course_id, set())
+            self._stale_courses.discard(course_id)
+
+        # Built outside the lock: a write committed meanwhile marks the course stale again
+        if rebuild:
+            index = self._build(course_id)
+            if index is None:
+                return None
+        elif stale_weeks:
+            index = self._refresh(index, stale_weeks)
+
+        with self._lock:
+            self._courses[course_id] = index
+            self._courses.move_to_end(course_id)
+            while len(self._courses) > self.max_courses:
+                evicted, _ = self._courses.popitem(last=False)
+                self._stale_weeks.pop(evicted, None)
+        return index
+
+    def _build(self, course_id: int) -> CourseIndex | None:
+        course = db.session.get(Course, course_id)
+        if course is None:
+            return None
+
+        meta = course.meta_data or {}
+        chunks = [(COURSE_WEEK_NO, "course", f"{course.name}. {course.content}. Objectives: {meta.get('objectives', '')}")]
+        week_ids = {}
+        for week_id, week_no, chunks_of_week in self._load_weeks(Week.course_id == course_id):
+            week_ids[week_id] = week_no
+            chunks += [(week_no, key, text) for key, text in chunks_of_week]
+
+        with self._lock:
+            self._counters["courses_built"] += 1
+        return CourseIndex(
+            keys=[key for _, key, _ in chunks],
+            texts=[text for _, _, text in chunks],
+            week_numbers=np.array([week_no for week_no, _, _ in chunks], dtype=np.int32),
+            matrix=embed([text for _, _, text in chunks], self.dim),
+            week_ids=week_ids
+        )
+
+    def _refresh(self, index: CourseIndex, week_ids: set[int]) -> CourseIndex:
+        """
+        A new index with the chunks of these weeks embedded again, the others are kept as they are
+        """
+        weeks = self._load_weeks(Week.id.in_(week_ids))
+        week_numbers = {week_no for _, week_no, _ in weeks} | {index.week_ids[w] for w in week_ids if w in index.week_ids}
+
+        keep = ~np.isin(index.week_numbers, list(week_numbers))
+        new_chunks = [(week_no, key, text) for _, week_no, chunks in weeks for key, text in chunks]
+
+        with self._lock:
+            self._counters["weeks_refreshed"] += len(week_ids)
+        return CourseIndex(
+            keys=[key for key, k in zip(index.keys, keep) if k] + [key for _, key, _ in new_chunks],
+            texts=[text for text, k in zip(index.texts, keep) if k] + [text for _, _, text in new_chunks],
+            week_numbers=np.concatenate([
+                index.week_numbers[keep], np.array([week_no for week_no, _, _ in new_chunks], dtype=np.int32)
+            ]),
+            matrix=np.vstack([index.matrix[keep], embed([text for _, _, text in new_chunks], self.dim)]),
+            week_ids={**index.week_ids, **{week_id: week_no for week_id, week_no, _ in weeks}}
+        )
+
+    def _load_weeks(self, condition) -> list[tuple[int, int, list[tuple[str, str]]]]:
+        """
+        (week id, week number, chunks) of the weeks matching condition, in one query
+        """
+        rows = db.session.execute(
+            db.select(
+                Week.id, Week.week_number, Week.topic, Week.summary,
+                Session.session_no, SessionSegment.label, SessionSegment.topic, SessionSegment.content
+            )
+            .outerjoin(Session, Session.week_id == Week.id)
+            .outerjoin(SessionSegment, SessionSegment.session_id == Session.id)
+            .where(condition)
+            .order_by(SessionSegment.position)
+        ).all()
+
+        # week id -> (week number, topic, summary, session number -> minute blocks)
+        weeks: dict[int, tuple[int, str, str, dict[int, dict]]] = {}
+        for week_id, week_no, topic, summary, session_no, label, block_topic, block_content in rows:
+            sessions = weeks.setdefault(week_id, (week_no, topic, summary, {}))[3]
+            if label is not None:
+                sessions.setdefault(session_no, {})[label] = {"topic": block_topic, "content": block_content}
+        return [
+            (week_id, week_no, week_chunks(week_no, topic, summary, sessions.items()))
+            for week_id, (week_no, topic, summary, sessions) in weeks.items()
+        ]
+
+
+embedding_index = EmbeddingIndex()
@@ -0,0 +1,156 @@
+"""
+A local stand-in for the Gemini API, to try the rate limiter and retries without spending quota.
+
+It answers generateContent / streamGenerateContent with the canned weekly.json
+or session.json (once per week or course of a batched prompt), and can add
+latency and inject 429 / 503 errors:
+    python fake_llm_server.py --port 8089 --latency 1.5 --error-rate 0.2 --rpm 30
+
+Then start the app against it:
+    GENAI_BASE_URL=http://127.0.0.1:8089 GENAI_API_KEY=fake python -u app.py
+GET /stats shows what the server answered so far.
+"""
+from flask import Flask, Response, jsonify, request
+
+import argparse
+import collections
+import json
+import os
+import random
+import re
+import threading
+import time
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+app = Flask(__name__)
+settings = argparse.Namespace(latency=0.0, error_rate=0.0, server_error_rate=0.0, rpm=0, chunk_size=256)
+
+# The members a batched prompt asks for, e.g. these keys: "week 3", "week 5".
+BATCH_KEYS = re.compile(r'these keys: ((?:"\w+ \d+"(?:, )?)+)')
+
+lock = threading.Lock()
+recent_requests: collections.deque[float] = collections.deque()
+counters = collections.Counter()
+
+
+def canned_response(prompt: str) -> str:
+    # The session prompts ask for the "minutes" of the sessions, the course prompt for weeks
+    filename = "session.json" if "minutes" in prompt else "weekly.json"
+    with open(os.path.join(basedir, filename), "r", encoding="utf-8") as file:
+        text = file.read()
+    # A batched prompt (several weeks or courses) gets the same canned answer for each of them
+    batch = BATCH_KEYS.search(prompt)
+    if batch:
+        answer = json.loads(text)
+        return json.dumps({key: answer for key in re.findall(r'"(\w+ \d+)"', batch.group(1))}, indent=4)
+    return text
+
+
+def error(code: int, status: str, message: str, retry_delay: float | None = None):
+    details = []
+    if retry_delay is not None:
+        details.append({"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{retry_delay:.0f}s"})
+    counters[f"status_{code}"] += 1
+    return jsonify({"error": {"code": code, "message": message, "status": status, "details": details}}), code
+
+
+def check_quota():
+    """
+    Returns an error response when the call should fail, None when it may go through
+    """
+    now = time.time()
+    with lock:
+        counters["requests"] += 1
+        while recent_requests and recent_requests[0] < now - 60:
+            recent_requests.popleft()
+        over_quota = settings.rpm and len(recent_requests) >= settings.rpm
+        if not over_quota:
+            recent_requests.append(now)
+
+    if over_quota:
+        retry_delay = max(1.0, 60 - (now - recent_requests[0]))
+        return error(429, "RESOURCE_EXHAUSTED", "Quota exceeded (requests per minute)", retry_delay)
+    if random.random() < settings.error_rate:
+        return error(429, "RESOURCE_EXHAUSTED", "Injected quota error", retry_delay=1)
+    if random.random() < settings.server_error_rate:
+        return error(503, "UNAVAILABLE", "Injected server error")
+    return None
+
+
+def usage(prompt: str, text: str) -> dict[str, int]:
+    prompt_tokens, output_tokens = len(prompt) // 4, len(text) // 4
+    return {
+        "promptTokenCount": prompt_tokens,
+        "candidatesTokenCount": output_tokens,
+        "totalTokenCount": prompt_tokens + output_tokens
+    }
+
+
+def candidate(text: str, finished: bool) -> dict:
+    result = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finished:
+        result["finishReason"] = "STOP"
+    return result
+
+
+@app.route('/<version>/models/<path:action>', methods=['POST'])
+def generate(version, action):
+    model, _, method = action.partition(":")
+    body = request.get_json(force=True)
+    prompt = "".join(
+        part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", [])
+    )
+
+    failure = check_quota()
+    if failure:
+        return failure
+
+    text = canned_response(prompt)
+
+    if method == "generateContent":
+        time.sleep(settings.latency)
+        counters["status_200"] += 1
+        return jsonify({
+            "candidates": [candidate(text, finished=True)],
+            "usageMetadata": usage(prompt, text),
+            "modelVersion": model
+        })
+
+    if method == "streamGenerateContent":
+        chunks = [text[i:i + settings.chunk_size] for i in range(0, len(text), settings.chunk_size)]
+
+        def events():
+            for i, chunk in enumerate(chunks):
+                # Spread the latency over the chunks, like a model generating tokens
+                time.sleep(settings.latency / len(chunks))
+                last = i == len(chunks) - 1
+                payload = {"candidates": [candidate(chunk, finished=last)], "modelVersion": model}
+                if last:
+                    payload["usageMetadata"] = usage(prompt, text)
+                yield f"data: {json.dumps(payload)}\r\n\r\n"
+            counters["status_200"] += 1
+
+        return Response(events(), mimetype="text/event-stream")
+
+    return error(404, "NOT_FOUND", f"Unknown method {method}")
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    with lock:
+        return jsonify(dict(counters))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every answer takes")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls answered with a 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="Share of calls answered with a 503")
+    parser.add_argument("--rpm", type=int, default=0, help="Real requests per minute quota, 0 for none")
+    parser.add_argument("--chunk-size", type=int, default=256, help="Characters per streamed chunk")
+    settings = parser.parse_args()
+
+    print(f"Fake GenAI server on 127.0.0.1:{settings.port}")
+    app.run(port=settings.port, threaded=True)
@@ -0,0 +1,199 @@
+"""
+Background job queue for long running work (mostly waiting on GenAI).
+
+The HTTP handler only stores a Job row and hands the id back to the client,
+a bounded pool of worker threads then runs the job in its own app context.
+Because the job state lives in the database, jobs that were queued or running
+when the server stopped are picked up again after a restart.
+
+With several server processes (serve.py), the "running" jobs are only put back
+in the queue once, before the workers start: every process picks up the queued
+ones, and the atomic claim in _run() makes sure each job runs once.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable
+from flask import Flask
+
+import logging
+import threading
+import time
+import uuid
+
+from db import db, Job, Week, naive_utcnow
+from metrics import metrics
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    """
+    Same pattern as `db`: instantiate once, bind to the app later with init_app()
+    """
+
+    def __init__(self):
+        self.app: Flask | None = None
+        self.executor: ThreadPoolExecutor | None = None
+        self.handlers: dict[str, Callable[[dict, Callable[[dict], None]], dict | None]] = {}
+        # False when the "running" jobs were already put back in the queue (requeue_interrupted())
+        self.requeue_running = True
+        self._resumed = False
+        # Week claims older than this process belong to a process that no longer exists
+        self._started_at = naive_utcnow()
+        self._resume_lock = threading.Lock()
+        self._futures: set[Future] = set()
+        self._futures_lock = threading.Lock()
+
+    def init_app(self, app: Flask) -> None:
+        self.app = app
+        self.executor = ThreadPoolExecutor(
+            max_workers=app.config.get("JOB_WORKERS", 2),
+            thread_name_prefix="job-worker"
+        )
+        app.extensions["job_queue"] = self
+
+        # Resume interrupted jobs once the app is actually serving.
+        # Doing it here instead of at import time keeps the debug reloader's
+        # parent process from running the same jobs twice.
+        app.before_request(self.resume_pending)
+
+    def handler(self, kind: str):
+        """
+        Decorator registering the function that runs jobs of the given kind.
+        The function receives the job payload and a callback publishing partial
+        results (e.g. progress), and returns a JSON-able result.
+        """
+        def decorator(fn: Callable[[dict, Callable[[dict], None]], dict | None]):
+            self.handlers[kind] = fn
+            return fn
+        return decorator
+
+    def enqueue(self, kind: str, payload: dict[str, Any]) -> Job:
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+
+        job = Job(id=uuid.uuid4().hex, kind=kind, status=QUEUED, payload=payload)
+        db.session.add(job)
+        db.session.commit()
+
+        self._submit(job.id)
+        return job
+
+    def resume_pending(self) -> None:
+        """
+        Re-submits every job that did not finish before the last shutdown
+        """
+        if self._resumed:
+            return
+        with self._resume_lock:
+            if self._resumed:
+                return
+            self._resumed = True
+
+            if self.requeue_running:
+                self.requeue_interrupted()
+
+            with self.app.app_context():
+                job_ids = db.session.execute(
+                    db.select(Job.id).where(Job.status == QUEUED).order_by(Job.created_at)
+                ).scalars().all()
+
+            if job_ids:
+                print(f"Resuming {len(job_ids)} unfinished job(s)")
+            for job_id in job_ids:
+                self._submit(job_id)
+
+    def requeue_interrupted(self) -> int:
+        """
+        Puts the "running" jobs back in the queue: they belonged to a process that no longer exists.
+        The weeks those processes were generating are given back too (see api.claim_week()),
+        otherwise the requeued jobs, which only plan unplanned weeks, would skip them.
+        Only safe while no process of this app is running jobs.
+        """
+        with self.app.app_context():
+            requeued = db.session.execute(
+                db.update(Job).where(Job.status == RUNNING).values(status=QUEUED)
+            ).rowcount
+            released = db.session.execute(
+                db.update(Week).where(Week.claimed_at < self._started_at).values(planned=False, claimed_at=None)
+            ).rowcount
+            db.session.commit()
+        if released:
+            print(f"Released {released} week(s) left claimed by an interrupted generation")
+        return requeued
+
+    def drain(self, timeout: float) -> int:
+        """
+        Stops taking jobs and waits up to timeout seconds for the running ones.
+        Jobs not started stay queued for the next start. Returns how many were still running.
+        """
+        with self._futures_lock:
+            futures = set(self._futures)
+        # Cancels what has not started yet, it is still "queued" in the database
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        running = [future for future in futures if not future.cancelled()]
+        if running:
+            print(f"Waiting up to {timeout:g}s for {len(running)} running job(s)")
+        _, not_done = wait(running, timeout=timeout)
+        return len(not_done)
+
+    def _submit(self, job_id: str) -> None:
+        future = self.executor.submit(self._run, job_id)
+        with self._futures_lock:
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+
+    def _forget(self, future: Future) -> None:
+        with self._futures_lock:
+            self._futures.discard(future)
+
+    def update_result(self, job_id: str, result: dict[str, Any]) -> None:
+        """
+        Lets a running job publish partial results (e.g. progress)
+        """
+        db.session.execute(
+            db.update(Job).where(Job.id == job_id).values(result=result)
+        )
+        db.session.commit()
+
+    def _run(self, job_id: str) -> None:
+        with self.app.app_context():
+            # Atomic claim, so a job is never run by two workers at once
+            claimed = db.session.execute(
+                db.update(Job).where(Job.id == job_id, Job.status == QUEUED).values(status=RUNNING)
+            ).rowcount
+            db.session.commit()
+            if not claimed:
+                return
+
+            job = db.session.get(Job, job_id)
+            kind = job.kind
+            started = time.perf_counter()
+            try:
+                result = self.handlers[job.kind](
+                    job.payload,
+                    lambda partial: self.update_result(job_id, partial)
+                )
+                db.session.rollback()  # Drop anything the handler left half done
+
+                job = db.session.get(Job, job_id)
+                job.status = DONE
+                if result is not None:
+                    job.result = result
+                db.session.commit()
+                metrics.record_job(kind, DONE, time.perf_counter() - started)
+            except Exception as e:
+                logging.exception(f"Job {job_id} ({job.kind}) failed")
+                db.session.rollback()
+
+                job = db.session.get(Job, job_id)
+                job.status = FAILED
+                job.error = str(e)
+                db.session.commit()
+                metrics.record_job(kind, FAILED, time.perf_counter() - started)
+
+
+job_queue = JobQueue()
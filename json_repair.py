@@ -0,0 +1,228 @@
+"""
+Extracts the JSON object out of a GenAI answer, repairing what it can.
+
+A broken answer used to fail the whole request, and generating it again costs
+as much as the first time. Here the outer object is located (fences and prose
+around it are dropped), the usual defects are repaired (trailing or missing
+commas, smart quotes, raw newlines in strings, braces left open by a cut-off
+answer), and when that is not enough the complete "week N" / "session N"
+members are salvaged one by one. The members are checked against the schema we
+asked for, and the caller only asks GenAI again for the ones still missing.
+
+orjson parses when it is installed (pip install orjson), json otherwise.
+"""
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import json
+import re
+
+from json_stream import TopLevelMemberParser
+from llm import ResponseShape
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Both raise a ValueError subclass on invalid JSON
+fast_loads: Callable[[str], Any] = orjson.loads if orjson else json.loads
+JSON_BACKEND = "orjson" if orjson else "json"
+
+SMART_QUOTES = "\u201c\u201d\u201e\u201f"
+CLOSERS = {"{": "}", "[": "]"}
+CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t", "\b": "\\b", "\f": "\\f"}
+
+# Everything the repair has to look at, the text in between is copied as is
+SPECIAL = re.compile(r'["\\{}\[\],\u201c\u201d\u201e\u201f\x00-\x1f]')
+
+
+@dataclass
+class ExtractedMembers:
+    members: dict[str, Any]     # "<prefix> N" -> value, only the members matching the schema
+    missing: list[int]          # Numbers of the members that were asked for but not usable
+    repaired: bool              # The text was not valid JSON as it was
+
+
+def key_number(key: str, prefix: str) -> int | None:
+    """
+    "week 3" -> 3 for prefix "week", None if the key is something else
+    """
+    name, _, number = key.strip().lower().partition(" ")
+    if name != prefix or not number.strip().isdigit():
+        return None
+    return int(number)
+
+
+def is_text(value: Any) -> bool:
+    return isinstance(value, str) and bool(value.strip())
+
+
+def valid_member(prefix: str, value: Any) -> bool:
+    """
+    A week has a topic and a summary, a session is made of minute blocks with a topic and a content
+    """
+    if prefix == "week":
+        return isinstance(value, dict) and is_text(value.get("topic")) and is_text(value.get("summary"))
+    if prefix == "session":
+        return isinstance(value, dict) and bool(value) and all(
+            isinstance(block, dict) and is_text(block.get("topic")) and is_text(block.get("content"))
+            for block in value.values()
+        )
+    return value is not None
+
+
+def extract_json(text: str) -> dict[str, Any]:
+    """
+    The outer object of the answer, repaired or salvaged member by member when needed.
+    Raises ValueError when there is nothing to take from it.
+    """
+    return _extract(text)[0]
+
+
+def extract_members(text: str, shape: ResponseShape) -> ExtractedMembers:
+    """
+    The members of shape found in the answer that match their schema, and the numbers still missing
+    """
+    response, repaired = _extract(text)
+
+    members = pick_members(response, shape)
+    missing = [n for n in shape.members() if f"{shape.prefix} {n}" not in members]
+    return ExtractedMembers(members, missing, repaired)
+
+
+def pick_members(response: dict[str, Any], shape: ResponseShape) -> dict[str, Any]:
+    """
+    The members of shape in response that match their schema.
+    A nested member (a week of a batched prompt) is only kept when all of its own members are there.
+    """
+    members = {}
+    inner_shapes = dict(zip(shape.members(), shape.nested)) if shape.nested else None
+    wanted = set(shape.members())
+    for key, value in response.items():
+        number = key_number(key, shape.prefix)
+        if number not in wanted:
+            continue
+        if inner_shapes is not None:
+            inner = inner_shapes[number]
+            value = pick_members(value, inner) if isinstance(value, dict) else {}
+            if len(value) < len(inner.members()):
+                continue
+        elif not valid_member(shape.prefix, value):
+            continue
+        members.setdefault(f"{shape.prefix} {number}", value)
+    return members
+
+
+def _extract(text: str) -> tuple[dict[str, Any], bool]:
+    start = text.find("{")
+    if start < 0:
+        raise ValueError("No JSON object in the answer")
+
+    # Fast path: valid JSON, give or take fences and prose around it
+    end = text.rfind("}")
+    if end > start:
+        try:
+            value = fast_loads(text[start:end + 1])
+            if isinstance(value, dict):
+                return value, False
+        except ValueError:
+            pass
+
+    repaired = repair(text[start:])
+    try:
+        value = fast_loads(repaired)
+        if isinstance(value, dict):
+            return value, True
+    except ValueError:
+        pass
+
+    # Still broken somewhere in the middle, keep the members that parse on their own
+    members = dict(TopLevelMemberParser().feed(repaired))
+    if not members:
+        raise ValueError("No complete member in the answer")
+    return members, True
+
+
+def repair(text: str) -> str:
+    """
+    Fixes the usual defects of the object starting at text[0]. Text after its
+    closing brace is dropped, and a cut-off object is closed after its last
+    complete member.
+    """
+    out: list[str] = []
+    stack: list[str] = []
+    in_string = False
+    smart_string = False        # Opened with a smart quote, which may close it too
+    after_value = False         # A nested value just closed, the next member needs a comma
+    last_complete: int | None = None
+    pos = 0
+
+    for match in SPECIAL.finditer(text):
+        i = match.start()
+        if i < pos:
+            # Escaped character, already copied
+            continue
+        char = match.group()
+        out.append(text[pos:i])
+        pos = i + 1
+
+        if in_string:
+            if char == "\\":
+                out.append(text[i:i + 2])
+                pos = i + 2
+            elif char == '"' or (smart_string and char in SMART_QUOTES):
+                out.append('"')
+                in_string = False
+            elif char < " ":
+                out.append(CONTROL_ESCAPES.get(char, f"\\u{ord(char):04x}"))
+            else:
+                out.append(char)
+            continue
+
+        if char == '"' or char in SMART_QUOTES:
+            if after_value:
+                out.append(",")
+            in_string = True
+            smart_string = char != '"'
+            after_value = False
+            out.append('"')
+        elif char in "{[":
+            if after_value:
+                out.append(",")
+            after_value = False
+            stack.append(char)
+            out.append(char)
+        elif char in "}]":
+            if not stack:
+                continue
+            _strip_trailing_comma(out)
+            out.append(CLOSERS[stack.pop()])
+            if not stack:
+                return "".join(out)
+            after_value = True
+            if len(stack) == 1:
+                last_complete = len(out)
+        elif char == ",":
+            after_value = False
+            if len(stack) == 1:
+                last_complete = len(out)
+            out.append(char)
+        else:
+            # Newlines and tabs between the tokens
+            out.append(char)
+
+    # Cut off before the end: keep the complete members and close the object
+    if last_complete is None:
+        raise ValueError("The answer was cut off before its first complete member")
+    del out[last_complete:]
+    _strip_trailing_comma(out)
+    out.append("}")
+    return "".join(out)
+
+
+def _strip_trailing_comma(out: list[str]) -> None:
+    while out and not out[-1].strip():
+        out.pop()
+    if out and out[-1].rstrip().endswith(","):
+        out[-1] = out[-1].rstrip()[:-1]
@@ -0,0 +1,83 @@
+"""
+Incremental parser for the JSON objects GenAI streams back.
+
+The responses we ask for are one outer object whose members are the pieces we
+care about ("week 1": {...}, "session 2": {...}, ...). TopLevelMemberParser is
+fed the text as it arrives and hands back every member as soon as its value is
+complete, so the caller can persist and show it without waiting for the rest.
+"""
+from typing import Any
+
+import json
+
+
+class TopLevelMemberParser:
+
+    def __init__(self):
+        self.buffer = ""
+        self.emitted: set[str] = set()
+
+        self._pos = 0                       # Next character of the buffer to scan
+        self._depth = 0                     # 1 means "inside the outer object"
+        self._in_string = False
+        self._escape = False
+        self._member_start: int | None = None
+
+    def feed(self, chunk: str) -> list[tuple[str, Any]]:
+        """
+        Adds a chunk of text and returns the (key, value) members completed by it
+        """
+        self.buffer += chunk
+        members = []
+
+        buf = self.buffer
+        for i in range(self._pos, len(buf)):
+            char = buf[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._member_start is None:
+                    self._member_start = i
+            elif char in "{[":
+                # Anything before the outer "{" (e.g. a ```json fence) is ignored
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 1:
+                    # A nested value just closed, the member is complete
+                    self._emit(i + 1, members)
+                elif self._depth == 0:
+                    # End of the outer object, flush a trailing primitive member
+                    self._emit(i, members)
+            elif char == "," and self._depth == 1:
+                # End of a primitive member ("week 3": "WIP",)
+                self._emit(i, members)
+
+        self._pos = len(buf)
+        return members
+
+    def _emit(self, end: int, members: list[tuple[str, Any]]) -> None:
+        if self._member_start is None:
+            return
+        text = self.buffer[self._member_start:end]
+        self._member_start = None
+
+        try:
+            member = json.loads("{" + text + "}")
+        except ValueError:
+            # Not valid on its own (e.g. a trailing comma), the caller can
+            # still recover it by parsing the whole buffer at the end
+            return
+        for key, value in member.items():
+            if key not in self.emitted:
+                self.emitted.add(key)
+                members.append((key, value))
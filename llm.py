@@ -0,0 +1,354 @@
+"""
+The backends answering our GenAI prompts, picked with LLM_BACKEND:
+    - gemini: the real Gemini API (needs GENAI_API_KEY)
+    - canned: the fixed weekly.json / session.json, for working on the UI without spending quota
+    - fake:   deterministic, schema-valid weeks and sessions of configurable size and latency,
+              for load tests driving the whole Flask / database stack without any network
+
+Every backend answers with the raw text GenAI would send back, from threads
+(generate, stream) or from coroutines (agenerate, astream, for asgi.py). Parsing it
+(and caching, rate limiting, retrying) is left to the callers in api.py.
+
+The google-genai SDK takes longer to import than the rest of the app, so it is
+only imported, and the client made, on the first Gemini call.
+"""
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator
+from flask import Flask
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+GENAI_MODEL = "gemini-2.5-flash-lite"
+GENAI_CONFIG = {"temperature": 0.1}
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+
+@dataclass(frozen=True)
+class ResponseShape:
+    """
+    What a prompt asks for: the members "<prefix> 1" to "<prefix> <count>"
+    """
+    prefix: str     # "week", "session", or "course" in a batched prompt
+    count: int
+    # Only these numbers, when asking again for the members missing from an answer
+    numbers: tuple[int, ...] = ()
+    # Batched prompts (batching.py): every member is itself an object of members, in the order of members()
+    nested: tuple["ResponseShape", ...] = ()
+
+    def members(self) -> list[int]:
+        return list(self.numbers) if self.numbers else list(range(1, self.count + 1))
+
+
+@dataclass
+class Chunk:
+    text: str
+    used_tokens: int | None = None     # Only known once the answer is complete
+
+
+class LLMBackend:
+    name = "base"
+    model = "none"
+    config: dict = {}
+    # Calls go through the rate limiter, and their answers through llm_cache
+    rate_limited = False
+    cacheable = False
+
+    def generate(self, prompt: str, shape: ResponseShape) -> Chunk:
+        chunks = list(self.stream(prompt, shape))
+        return Chunk(text="".join(c.text for c in chunks), used_tokens=chunks[-1].used_tokens if chunks else None)
+
+    def stream(self, prompt: str, shape: ResponseShape) -> Iterator[Chunk]:
+        raise NotImplementedError
+
+    async def agenerate(self, prompt: str, shape: ResponseShape) -> Chunk:
+        # Backends without an async client answer from a thread
+        return await asyncio.to_thread(self.generate, prompt, shape)
+
+    async def astream(self, prompt: str, shape: ResponseShape) -> AsyncIterator[Chunk]:
+        for chunk in await asyncio.to_thread(lambda: list(self.stream(prompt, shape))):
+            yield chunk
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+    rate_limited = True
+    cacheable = True
+
+    def __init__(self, api_key: str | None, model: str, config: dict, base_url: str | None = None):
+        self.model = model
+        self.config = config
+        self.api_key = api_key
+        # base_url points the client at another server, e.g. fake_llm_server.py
+        self.base_url = base_url
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """
+        The genai client, made on first use
+        """
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    if not self.api_key:
+                        raise ValueError("GENAI_API_KEY cannot be found")
+                    from google import genai
+                    from google.genai import types
+
+                    self._client = genai.Client(
+                        api_key=self.api_key,
+                        http_options=types.HttpOptions(base_url=self.base_url) if self.base_url else None
+                    )
+        return self._client
+
+    def request_config(self):
+        from google.genai import types
+        return types.GenerateContentConfig(**self.config)
+
+    def generate(self, prompt: str, shape: ResponseShape) -> Chunk:
+        res = self.client.models.generate_content(
+            model=self.model,
+            contents=prompt,
+            config=self.request_config()
+        )
+        return Chunk(text=res.text or "", used_tokens=used_tokens(res))
+
+    def stream(self, prompt: str, shape: ResponseShape) -> Iterator[Chunk]:
+        stream = self.client.models.generate_content_stream(
+            model=self.model,
+            contents=prompt,
+            config=self.request_config()
+        )
+        for res in stream:
+            yield Chunk(text=res.text or "", used_tokens=used_tokens(res))
+
+    async def agenerate(self, prompt: str, shape: ResponseShape) -> Chunk:
+        res = await self.client.aio.models.generate_content(
+            model=self.model,
+            contents=prompt,
+            config=self.request_config()
+        )
+        return Chunk(text=res.text or "", used_tokens=used_tokens(res))
+
+    async def astream(self, prompt: str, shape: ResponseShape) -> AsyncIterator[Chunk]:
+        stream = await self.client.aio.models.generate_content_stream(
+            model=self.model,
+            contents=prompt,
+            config=self.request_config()
+        )
+        async for res in stream:
+            yield Chunk(text=res.text or "", used_tokens=used_tokens(res))
+
+
+class CannedBackend(LLMBackend):
+    name = "canned"
+    model = "canned"
+    files = {"week": "weekly.json", "session": "session.json"}
+
+    def __init__(self, chunk_chars: int = 256):
+        self.chunk_chars = chunk_chars
+
+    def stream(self, prompt: str, shape: ResponseShape) -> Iterator[Chunk]:
+        if shape.nested:
+            # A batched prompt: the same canned answer for every member
+            text = json.dumps({
+                f"{shape.prefix} {no}": json.loads(self.read(inner.prefix))
+                for no, inner in zip(shape.members(), shape.nested)
+            }, indent=4)
+        else:
+            text = self.read(shape.prefix)
+        for i in range(0, len(text), self.chunk_chars):
+            yield Chunk(text=text[i:i + self.chunk_chars])
+
+    def read(self, prefix: str) -> str:
+        with open(os.path.join(basedir, self.files[prefix]), "r", encoding="utf-8") as file:
+            return file.read()
+
+
+class FakeBackend(LLMBackend):
+    """
+    The same prompt always gets the same answer, only the latency is random
+    (seeded with LLM_FAKE_SEED when set, so whole runs can be replayed).
+    """
+    name = "fake"
+    cacheable = True
+
+    def __init__(
+        self,
+        text_chars: int = 400,
+        session_blocks: int = 6,
+        latency: str = "fixed:0",
+        chunk_chars: int = 256,
+        seed: int | None = None,
+    ):
+        self.text_chars = text_chars
+        self.session_blocks = session_blocks
+        self.chunk_chars = chunk_chars
+        self.latency_kind, self.latency_params = parse_latency(latency)
+        # Sizes change the answers, keep them apart in llm_cache
+        self.model = "fake"
+        self.config = {"text_chars": text_chars, "session_blocks": session_blocks}
+
+        self._latency_random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def stream(self, prompt: str, shape: ResponseShape) -> Iterator[Chunk]:
+        chunks, delay = self._chunks(prompt, shape)
+        for chunk in chunks:
+            time.sleep(delay)
+            yield chunk
+
+    async def agenerate(self, prompt: str, shape: ResponseShape) -> Chunk:
+        text = self.synthesize(prompt, shape)
+        await asyncio.sleep(self.sample_latency())
+        return Chunk(text=text, used_tokens=(len(prompt) + len(text)) // 4)
+
+    async def astream(self, prompt: str, shape: ResponseShape) -> AsyncIterator[Chunk]:
+        chunks, delay = self._chunks(prompt, shape)
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            yield chunk
+
+    def _chunks(self, prompt: str, shape: ResponseShape) -> tuple[list[Chunk], float]:
+        """
+        The answer cut in chunks, and the delay before each of them
+        """
+        text = self.synthesize(prompt, shape)
+        pieces = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)]
+        chunks = [Chunk(text=piece) for piece in pieces]
+        if chunks:
+            chunks[-1].used_tokens = (len(prompt) + len(text)) // 4
+        return chunks, self.sample_latency() / max(len(chunks), 1)
+
+    def synthesize(self, prompt: str, shape: ResponseShape) -> str:
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+        return json.dumps(self._members(rng, shape), indent=4)
+
+    def _members(self, rng: random.Random, shape: ResponseShape) -> dict:
+        response = {}
+        if shape.nested:
+            for no, inner in zip(shape.members(), shape.nested):
+                response[f"{shape.prefix} {no}"] = self._members(rng, inner)
+            return response
+
+        for no in shape.members():
+            if shape.prefix == "week":
+                response[f"week {no}"] = {
+                    "topic": f"Week {no}: {filler(rng, 60)}",
+                    "summary": filler(rng, self.text_chars)
+                }
+            else:
+                block_minutes = max(1, 120 // self.session_blocks)
+                response[f"session {no}"] = {
+                    f"Minutes {b * block_minutes:02d} - {(b + 1) * block_minutes:02d}": {
+                        "topic": filler(rng, 60),
+                        "content": filler(rng, self.text_chars)
+                    } for b in range(self.session_blocks)
+                }
+        return response
+
+    def sample_latency(self) -> float:
+        p = self.latency_params
+        with self._lock:
+            r = self._latency_random
+            if self.latency_kind == "fixed":
+                value = p[0]
+            elif self.latency_kind == "uniform":
+                value = r.uniform(p[0], p[1])
+            elif self.latency_kind == "normal":
+                value = r.gauss(p[0], p[1])
+            elif self.latency_kind == "lognormal":
+                value = r.lognormvariate(p[0], p[1])
+            else:
+                value = r.expovariate(1 / p[0]) if p[0] > 0 else 0.0
+        return max(0.0, value)
+
+
+WORDS = (
+    "students learn apply design analyse build test review project data model system method practice "
+    "concept example exercise lecture lab theory problem solution tool process evaluate discuss"
+).split()
+
+
+def filler(rng: random.Random, chars: int) -> str:
+    words = []
+    length = 0
+    while length < chars:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:chars].capitalize()
+
+
+def parse_latency(spec: str) -> tuple[str, list[float]]:
+    """
+    "uniform:0.5,2" -> ("uniform", [0.5, 2.0]). Parameters in seconds:
+    fixed:s, uniform:low,high, normal:mean,sd, exponential:mean,
+    and lognormal:mu,sigma of the log of the seconds (median = e^mu)
+    """
+    kind, _, params = spec.partition(":")
+    kind = kind.strip().lower()
+    if kind not in LATENCY_DISTRIBUTIONS:
+        raise ValueError(f"Unknown latency distribution '{kind}', expected one of {LATENCY_DISTRIBUTIONS}")
+    values = [float(v) for v in params.split(",") if v.strip()] or [0.0]
+    expected = 2 if kind in ("uniform", "normal", "lognormal") else 1
+    if len(values) != expected:
+        raise ValueError(f"Latency '{kind}' takes {expected} parameter(s), got '{params}'")
+    return kind, values
+
+
+def used_tokens(res) -> int | None:
+    usage = getattr(res, "usage_metadata", None)
+    return usage.total_token_count if usage else None
+
+
+class LLM:
+    """
+    Same pattern as `db`: instantiate once, bind to the app later with init_app()
+    """
+
+    def __init__(self):
+        self.backend: LLMBackend | None = None
+
+    def init_app(self, app: Flask) -> None:
+        name = app.config.get("LLM_BACKEND", "gemini")
+
+        if name == "gemini":
+            api_key = app.config.get("GENAI_API_KEY")
+            if not api_key:
+                # Not fatal here: the app still serves what is in the database, the GenAI calls fail
+                logging.warning("GENAI_API_KEY cannot be found, the GenAI calls will fail")
+            self.backend = GeminiBackend(
+                api_key,
+                app.config.get("GENAI_MODEL", GENAI_MODEL),
+                GENAI_CONFIG,
+                base_url=app.config.get("GENAI_BASE_URL")
+            )
+        elif name == "canned":
+            self.backend = CannedBackend()
+        elif name == "fake":
+            self.backend = FakeBackend(
+                text_chars=app.config.get("LLM_FAKE_TEXT_CHARS", 400),
+                session_blocks=app.config.get("LLM_FAKE_SESSION_BLOCKS", 6),
+                latency=app.config.get("LLM_FAKE_LATENCY", "fixed:0"),
+                seed=app.config.get("LLM_FAKE_SEED")
+            )
+        else:
+            raise ValueError(f"Unknown LLM_BACKEND '{name}', expected gemini, canned or fake")
+
+        app.extensions["llm"] = self
+        print(f"LLM backend: {self.backend.name} ({self.backend.model})")
+
+
+llm = LLM()
@@ -0,0 +1,189 @@
+"""
+Content-addressed cache for GenAI responses.
+
+Responses are keyed on a hash of model + config + prompt, so the same prompt
+never pays for a second generation. There are two tiers:
+    - memory: a small LRU dict, bounded in bytes, local to the process
+    - disk:   the llm_cache table, bounded in bytes, shared by every process
+Both tiers expire entries after LLM_CACHE_TTL seconds.
+"""
+from collections import OrderedDict
+from typing import Any
+from flask import Flask
+
+import hashlib
+import json
+import threading
+import time
+
+from db import db, LLMCacheEntry
+
+
+def make_key(model: str, config: dict[str, Any], prompt: str) -> str:
+    raw = json.dumps({"model": model, "config": config, "prompt": prompt}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Same pattern as `db`: instantiate once, bind to the app later with init_app()
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.ttl = 7 * 24 * 3600
+        self.memory_max_bytes = 32 * 1024 * 1024
+        self.disk_max_bytes = 256 * 1024 * 1024
+
+        # key -> (created_at, response), least recently used first
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "writes": 0,
+            "evictions": 0
+        }
+
+    def init_app(self, app: Flask) -> None:
+        self.enabled = app.config.get("LLM_CACHE_ENABLED", self.enabled)
+        self.ttl = app.config.get("LLM_CACHE_TTL", self.ttl)
+        self.memory_max_bytes = app.config.get("LLM_CACHE_MEMORY_BYTES", self.memory_max_bytes)
+        self.disk_max_bytes = app.config.get("LLM_CACHE_DISK_BYTES", self.disk_max_bytes)
+        app.extensions["llm_cache"] = self
+
+    def get(self, key: str) -> str | None:
+        """
+        Looks the key up in memory first, then on disk. Needs an app context.
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, response = entry
+                if now - created_at < self.ttl:
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return response
+                self._drop_from_memory(key)
+
+        table = LLMCacheEntry.__table__
+        # A connection of its own, so the caller's db.session transaction is left alone
+        with db.engine.begin() as conn:
+            row = conn.execute(
+                db.select(table.c.created_at, table.c.response).where(table.c.key == key)
+            ).first()
+
+            if row is not None and now - row.created_at >= self.ttl:
+                conn.execute(db.delete(table).where(table.c.key == key))
+                row = None
+            if row is not None:
+                conn.execute(db.update(table).where(table.c.key == key).values(last_used_at=now))
+
+        with self._lock:
+            if row is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["disk_hits"] += 1
+            self._put_in_memory(key, row.created_at, row.response)
+        return row.response
+
+    def set(self, key: str, model: str, response: str) -> None:
+        if not self.enabled:
+            return
+        now = time.time()
+        size = len(response.encode("utf-8"))
+
+        with self._lock:
+            self._put_in_memory(key, now, response)
+            self._counters["writes"] += 1
+
+        table = LLMCacheEntry.__table__
+        with db.engine.begin() as conn:
+            conn.execute(db.delete(table).where(table.c.key == key))
+            conn.execute(db.insert(table).values(
+                key=key, model=model, response=response, size=size,
+                created_at=now, last_used_at=now
+            ))
+            self._evict_from_disk(conn, now)
+
+    def count_bypass(self) -> None:
+        with self._lock:
+            self._counters["bypassed"] += 1
+
+    def stats(self) -> dict[str, Any]:
+        table = LLMCacheEntry.__table__
+        with db.engine.connect() as conn:
+            disk_entries, disk_bytes = conn.execute(
+                db.select(db.func.count(), db.func.coalesce(db.func.sum(table.c.size), 0))
+            ).one()
+
+        with self._lock:
+            lookups = self._counters["memory_hits"] + self._counters["disk_hits"] + self._counters["misses"]
+            hits = self._counters["memory_hits"] + self._counters["disk_hits"]
+            return {
+                "enabled": self.enabled,
+                **self._counters,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": disk_entries,
+                "disk_bytes": disk_bytes
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        with db.engine.begin() as conn:
+            conn.execute(db.delete(LLMCacheEntry.__table__))
+
+    def _put_in_memory(self, key: str, created_at: float, response: str) -> None:
+        # Callers hold self._lock
+        self._drop_from_memory(key)
+        size = len(response.encode("utf-8"))
+        if size > self.memory_max_bytes:
+            return
+
+        self._memory[key] = (created_at, response)
+        self._memory_bytes += size
+        while self._memory_bytes > self.memory_max_bytes:
+            old_key, _ = next(iter(self._memory.items()))
+            self._drop_from_memory(old_key)
+            self._counters["evictions"] += 1
+
+    def _drop_from_memory(self, key: str) -> None:
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= len(entry[1].encode("utf-8"))
+
+    def _evict_from_disk(self, conn, now: float) -> None:
+        table = LLMCacheEntry.__table__
+        conn.execute(db.delete(table).where(table.c.created_at <= now - self.ttl))
+
+        total = conn.execute(db.select(db.func.coalesce(db.func.sum(table.c.size), 0))).scalar()
+        if total <= self.disk_max_bytes:
+            return
+
+        # Least recently used first, until the table fits in its budget again
+        evicted = []
+        for key, size in conn.execute(
+            db.select(table.c.key, table.c.size).order_by(table.c.last_used_at)
+        ):
+            if total <= self.disk_max_bytes:
+                break
+            evicted.append(key)
+            total -= size
+
+        conn.execute(db.delete(table).where(table.c.key.in_(evicted)))
+        with self._lock:
+            self._counters["evictions"] += len(evicted)
+
+
+llm_cache = LLMCache()
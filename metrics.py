@@ -0,0 +1,376 @@
+"""
+Request, stage, LLM and database metrics, exported in the Prometheus text format at /api/metrics.
+
+Stages are the steps of a generation (reading a template, rendering the
+prompt, waiting on GenAI, parsing its JSON, committing). Time them with:
+    with metrics.stage("parse_json"):
+        ...
+Each stage feeds a histogram, and the stages of the current request are kept
+so a request slower than METRICS_SLOW_REQUEST_SECONDS is logged with its breakdown.
+
+With several worker processes (serve.py), every worker counts on its own and
+a scrape is answered by any one of them. METRICS_SHARED_DIR then names a
+directory where each worker writes its counters and histograms every
+SNAPSHOT_SECONDS, and /api/metrics adds up the snapshots of all of them, like
+Prometheus' multiprocess mode. The snapshots of workers that exited are kept, so
+the totals never go down. The gauges (caches, rate limiter) are the ones of the
+worker answering the scrape.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Iterator
+from flask import Flask, g, has_app_context, request
+from sqlalchemy import event
+
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from db import db, Job
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# How often a worker writes its snapshot to METRICS_SHARED_DIR
+SNAPSHOT_SECONDS = 1.0
+
+
+def escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple[str, ...], values: tuple[Any, ...], le: str | None = None) -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values: dict[tuple, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    @staticmethod
+    def merge(snapshots: list[list]) -> dict[tuple, float]:
+        values: dict[tuple, float] = defaultdict(float)
+        for snapshot in snapshots:
+            for key, value in snapshot:
+                values[tuple(key)] += value
+        return values
+
+    def collect(self, values: dict[tuple, float] | None = None) -> list[str]:
+        """
+        The series of this process, or of the merged values of every worker
+        """
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> (count per bucket, sum, count)
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(key), [list(buckets), total, count]] for key, (buckets, total, count) in self._values.items()]
+
+    def merge(self, snapshots: list[list]) -> dict[tuple, list]:
+        values: dict[tuple, list] = {}
+        for snapshot in snapshots:
+            for key, (bucket_counts, total, count) in snapshot:
+                if len(bucket_counts) != len(self.buckets):
+                    continue    # Written by a version of the app with other buckets
+                entry = values.setdefault(tuple(key), [[0] * len(self.buckets), 0.0, 0])
+                entry[0] = [a + b for a, b in zip(entry[0], bucket_counts)]
+                entry[1] += total
+                entry[2] += count
+        return values
+
+    def collect(self, values: dict[tuple, list] | None = None) -> list[str]:
+        """
+        The series of this process, or of the merged values of every worker
+        """
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        if values is None:
+            with self._lock:
+                values = {key: [list(buckets), total, count] for key, (buckets, total, count) in self._values.items()}
+        for key, (bucket_counts, total, count) in sorted(values.items()):
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le=f'{bound:g}')} {bucket_count}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le='+Inf')} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {total:g}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Metrics:
+    """
+    Same pattern as `db`: instantiate once, bind to the app later with init_app()
+    """
+
+    def __init__(self):
+        self.enabled = True
+        # 0 turns the slow request log off
+        self.slow_request_seconds = 0.0
+
+        self.request_duration = Histogram(
+            "syllabus_http_request_duration_seconds", "Time to serve a request, streamed bodies included",
+            ("method", "route", "status")
+        )
+        self.stage_duration = Histogram(
+            "syllabus_stage_duration_seconds", "Time spent in each stage of the generations", ("stage",)
+        )
+        self.job_duration = Histogram(
+            "syllabus_job_duration_seconds", "Run time of the background jobs", ("kind", "status")
+        )
+        self.llm_calls = Counter("syllabus_llm_calls_total", "Prompts answered by the LLM backend", ("backend", "mode"))
+        self.llm_tokens = Counter(
+            "syllabus_llm_tokens_total",
+            "Tokens of the LLM calls: estimated for the prompts, reported by the backend for the whole call",
+            ("backend", "kind")
+        )
+        self.db_queries = Counter("syllabus_db_queries_total", "SQL statements executed")
+        self.db_query_seconds = Counter("syllabus_db_query_seconds_total", "Time spent executing SQL statements")
+
+        # Where every worker process writes its snapshot, None with a single process
+        self.shared_dir: str | None = None
+        self._app: Flask | None = None
+        # The process whose snapshot thread is running: a forked worker starts its own
+        self._snapshot_pid: int | None = None
+        self._snapshot_lock = threading.Lock()
+
+    def init_app(self, app: Flask) -> None:
+        self.enabled = app.config.get("METRICS_ENABLED", self.enabled)
+        self.slow_request_seconds = app.config.get("METRICS_SLOW_REQUEST_SECONDS", self.slow_request_seconds)
+        self.shared_dir = app.config.get("METRICS_SHARED_DIR")
+        self._app = app
+        app.extensions["metrics"] = self
+
+        if not self.enabled:
+            return
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+        with app.app_context():
+            engine = db.engine
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def start_query(conn, cursor, statement, parameters, context, executemany):
+            self.db_queries.inc()
+            if context is not None:
+                context.metrics_started = time.perf_counter()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def finish_query(conn, cursor, statement, parameters, context, executemany):
+            started = getattr(context, "metrics_started", None)
+            if started is not None:
+                self.db_query_seconds.inc(time.perf_counter() - started)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.perf_counter() - started)
+
+    def record_stage(self, name: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        self.stage_duration.observe(seconds, stage=name)
+        # Kept for the slow log of the request (or job) running in this app context
+        if has_app_context():
+            g.setdefault("metric_stages", []).append((name, seconds))
+
+    def record_llm_call(self, backend: str, mode: str, estimated_tokens: int, used_tokens: int | None) -> None:
+        self.llm_calls.inc(backend=backend, mode=mode)
+        self.llm_tokens.inc(estimated_tokens, backend=backend, kind="prompt_estimate")
+        if used_tokens is not None:
+            self.llm_tokens.inc(used_tokens, backend=backend, kind="used")
+
+    def record_job(self, kind: str, status: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        # Jobs can run before the worker served any request
+        self._keep_snapshot()
+        self.job_duration.observe(seconds, kind=kind, status=status)
+        self._log_if_slow(f"Job {kind} ({status})", seconds, g.get("metric_stages", []))
+
+    def series(self) -> tuple[Counter | Histogram, ...]:
+        return (
+            self.request_duration, self.stage_duration, self.job_duration,
+            self.llm_calls, self.llm_tokens, self.db_queries, self.db_query_seconds
+        )
+
+    def render(self) -> str:
+        lines = []
+        # Every worker's counts with METRICS_SHARED_DIR, this process' otherwise
+        snapshots = self._read_snapshots() if self.shared_dir else None
+        for metric in self.series():
+            if snapshots is None:
+                lines += metric.collect()
+            else:
+                lines += metric.collect(metric.merge([snapshot.get(metric.name, []) for snapshot in snapshots]))
+
+        lines += self._collect_extensions()
+        lines += self._collect_jobs()
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self) -> None:
+        """
+        Writes the counters and histograms of this process to its file in shared_dir
+        """
+        path = os.path.join(self.shared_dir, f"metrics-{os.getpid()}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump({metric.name: metric.snapshot() for metric in self.series()}, file)
+        # Replaced in one step, a scrape never reads half a file
+        os.replace(path + ".tmp", path)
+
+    def _read_snapshots(self) -> list[dict[str, list]]:
+        self.write_snapshot()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.shared_dir, "metrics-*.json")):
+            try:
+                with open(path, "r", encoding="utf-8") as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                logging.exception(f"Could not read the metrics snapshot {path}")
+        return snapshots
+
+    def _keep_snapshot(self) -> None:
+        """
+        Starts the thread writing this process' snapshot, once per process (the workers are forked after init_app)
+        """
+        if not self.shared_dir or self._snapshot_pid == os.getpid():
+            return
+        with self._snapshot_lock:
+            if self._snapshot_pid == os.getpid():
+                return
+            self._snapshot_pid = os.getpid()
+
+            def write_forever():
+                while True:
+                    time.sleep(SNAPSHOT_SECONDS)
+                    try:
+                        self.write_snapshot()
+                    except OSError:
+                        logging.exception("Could not write the metrics snapshot")
+
+            threading.Thread(target=write_forever, name="metrics-snapshot", daemon=True).start()
+
+    def _start_request(self) -> None:
+        self._keep_snapshot()
+        g.metric_started = time.perf_counter()
+        g.metric_stages = []
+
+    def _finish_request(self, response):
+        started = g.get("metric_started")
+        if started is None:
+            return response
+
+        method = request.method
+        path = request.path
+        # The rule, not the path, or every id would make a new series
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        stages = g.get("metric_stages", [])
+
+        def observe():
+            # Runs when the body is fully sent, so streams are timed to their last event
+            seconds = time.perf_counter() - started
+            self.request_duration.observe(seconds, method=method, route=route, status=response.status_code)
+            self._log_if_slow(f"{method} {path} ({response.status_code})", seconds, stages)
+
+        response.call_on_close(observe)
+        return response
+
+    def _log_if_slow(self, what: str, seconds: float, stages: list[tuple[str, float]]) -> None:
+        if not self.slow_request_seconds or seconds < self.slow_request_seconds:
+            return
+        totals: dict[str, float] = defaultdict(float)
+        for name, stage_seconds in stages:
+            totals[name] += stage_seconds
+        breakdown = ", ".join(f"{name} {stage_seconds:.3f}s" for name, stage_seconds in totals.items())
+        logging.warning(f"Slow: {what} took {seconds:.3f}s [{breakdown or 'no stages recorded'}]")
+
+    def _collect_extensions(self) -> list[str]:
+        """
+        The numeric stats of the caches, the rate limiter and the other components, as gauges
+        """
+        lines = []
+        for extension in ("llm_cache", "response_cache", "rate_limiter", "embedding_index", "single_flight"):
+            component = self._app.extensions.get(extension) if self._app else None
+            if component is None:
+                continue
+            with self._app.app_context():
+                stats = component.stats()
+            for key, value in flatten(stats):
+                name = f"syllabus_{extension}_{key}"
+                lines += [f"# TYPE {name} gauge", f"{name} {float(value):g}"]
+        return lines
+
+    def _collect_jobs(self) -> list[str]:
+        if self._app is None:
+            return []
+        with self._app.app_context():
+            counts = db.session.execute(
+                db.select(Job.status, db.func.count()).group_by(Job.status)
+            ).all()
+        lines = ["# HELP syllabus_jobs Background jobs by status", "# TYPE syllabus_jobs gauge"]
+        lines += [f'syllabus_jobs{{status="{status}"}} {count}' for status, count in counts]
+        return lines
+
+
+def flatten(stats: dict[str, Any], prefix: str = "") -> Iterator[tuple[str, float]]:
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}_")
+        elif isinstance(value, (bool, int, float)):
+            yield f"{prefix}{key}", value
+
+
+metrics = Metrics()
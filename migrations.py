@@ -0,0 +1,136 @@
+"""
+Small schema migrations for databases created by older versions of the app.
+
+db.create_all() creates missing tables, but never touches tables that already
+exist. The steps below bring existing tables up to date. The schema version is
+kept in SQLite's PRAGMA user_version, and each step only runs once.
+Steps must be idempotent: a fresh database gets them too, right after create_all().
+
+A step that cannot finish yet (RuntimeError, e.g. duplicate course codes) is
+tried again on the next start, but does not hold back the steps after it: they
+do not depend on each other, and the app needs them (e.g. the minutes in
+session_segments). The version only moves past steps that all finished, so the
+later ones run again on every start until then, and must be cheap when done.
+"""
+from typing import Callable
+from sqlalchemy import Connection, Engine, inspect, text
+from sqlalchemy.exc import OperationalError
+
+import json
+import logging
+import sqlite3
+
+from db import SessionSegment, segment_rows
+from search import create_search_index, SEARCH_TABLE
+
+# Sessions moved to session_segments per transaction chunk
+SEGMENT_MIGRATION_BATCH = 500
+
+
+def add_lookup_indexes(conn: Connection) -> None:
+    # weeks.course_id is already covered by the unique_course_week (course_id, week_number) index
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_sessions_week_id ON sessions (week_id)"))
+
+    duplicates = conn.execute(text(
+        "SELECT code FROM courses GROUP BY code HAVING COUNT(*) > 1"
+    )).scalars().all()
+    if duplicates:
+        # Refuse to guess which course to keep, a plain index still speeds up the lookups
+        logging.warning(
+            f"Duplicate course codes {duplicates}, courses.code stays non-unique until they are fixed"
+        )
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_courses_code_lookup ON courses (code)"))
+        raise RuntimeError("Duplicate course codes, fix them and restart to finish the migration")
+
+    conn.execute(text("DROP INDEX IF EXISTS ix_courses_code_lookup"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_courses_code ON courses (code)"))
+
+
+def unique_session_numbers(conn: Connection) -> None:
+    # Two generations of the same week used to both insert their sessions, keep the last one of each number
+    removed = conn.execute(text(
+        "DELETE FROM sessions WHERE id NOT IN (SELECT MAX(id) FROM sessions GROUP BY week_id, session_no)"
+    )).rowcount
+    if removed:
+        logging.warning(f"Removed {removed} duplicate sessions (same week and session number)")
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS unique_week_session ON sessions (week_id, session_no)"))
+
+
+def session_segments(conn: Connection) -> None:
+    # The minutes of every session were one JSON column, each block becomes a session_segments row
+    if "data" not in [c["name"] for c in inspect(conn).get_columns("sessions")]:
+        return
+    SessionSegment.__table__.create(conn, checkfirst=True)
+
+    moved = 0
+    last_id = 0
+    while True:
+        sessions = conn.execute(text(
+            "SELECT id, data FROM sessions WHERE id > :last_id AND data IS NOT NULL ORDER BY id LIMIT :limit"
+        ), {"last_id": last_id, "limit": SEGMENT_MIGRATION_BATCH}).all()
+        if not sessions:
+            break
+        rows = []
+        for session_id, data in sessions:
+            minutes_data = json.loads(data) if isinstance(data, str) else data
+            rows += segment_rows(minutes_data if isinstance(minutes_data, dict) else {}, session_id=session_id)
+        if rows:
+            conn.execute(SessionSegment.__table__.insert(), rows)
+        moved += len(sessions)
+        last_id = sessions[-1][0]
+
+    if sqlite3.sqlite_version_info >= (3, 35, 0):
+        conn.execute(text("ALTER TABLE sessions DROP COLUMN data"))
+    else:
+        # Too old to drop a column: left empty, the app does not map it anymore
+        conn.execute(text("UPDATE sessions SET data = NULL"))
+    print(f"Moved the minutes of {moved} sessions to session_segments")
+
+
+def search_index(conn: Connection) -> None:
+    # FTS5 index of the courses, weeks and segments, kept up to date by triggers from now on
+    if inspect(conn).has_table(SEARCH_TABLE):
+        # Built on an earlier start, while a step before this one was unfinished
+        return
+    try:
+        indexed = create_search_index(conn)
+    except OperationalError as e:
+        # e.g. "no such module: fts5", the app runs without /api/search
+        raise RuntimeError(f"Cannot create the search index: {e.orig}")
+    print(f"Indexed {indexed} courses, weeks and segments for full-text search")
+
+
+def week_claims(conn: Connection) -> None:
+    # When a generation claimed the week, so a claim left by a crashed process can be taken over
+    if "claimed_at" not in [c["name"] for c in inspect(conn).get_columns("weeks")]:
+        conn.execute(text("ALTER TABLE weeks ADD COLUMN claimed_at DATETIME"))
+
+
+# Schema version -> step bringing the database to that version, in order
+MIGRATIONS: list[tuple[int, Callable[[Connection], None]]] = [
+    (1, add_lookup_indexes),
+    (2, unique_session_numbers),
+    (3, session_segments),
+    (4, search_index),
+    (5, week_claims),
+]
+
+
+def upgrade(engine: Engine) -> None:
+    unfinished = []
+    for version, step in MIGRATIONS:
+        with engine.begin() as conn:
+            current = conn.execute(text("PRAGMA user_version")).scalar()
+            if current >= version:
+                continue
+
+            print(f"Migrating database to version {version}: {step.__name__}")
+            try:
+                step(conn)
+            except RuntimeError as e:
+                # Leave the version as is, the step runs again on the next start
+                logging.error(f"Migration {step.__name__} not finished: {e}")
+                unfinished.append(step.__name__)
+                continue
+            if not unfinished:
+                conn.execute(text(f"PRAGMA user_version = {version}"))
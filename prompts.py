@@ -0,0 +1,140 @@
+"""
+Prompt template registry.
+
+Every prompt sent to GenAI is made of prompt.txt (the shared instructions) and
+a per-endpoint template from the prompts/ folder. The files are read and
+compiled into string.Template objects once, and only re-read when their mtime
+changes, so editing a prompt does not need a restart.
+Templates use $name placeholders and are rendered with named parameters.
+"""
+from dataclasses import dataclass
+from string import Template
+from typing import Any
+from flask import Flask
+
+import logging
+import os
+import threading
+
+from metrics import metrics
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+# Prompt name -> files it is made of, in order
+PROMPTS = {
+    "course_structure": ["prompt.txt", "prompts/course_structure.txt"],
+    "week_sessions": ["prompt.txt", "prompts/week_sessions.txt"],
+    # Several courses / several weeks of one course in one prompt, see batching.py
+    "course_structure_batch": ["prompt.txt", "prompts/course_structure_batch.txt"],
+    "week_sessions_batch": ["prompt.txt", "prompts/week_sessions_batch.txt"],
+    "regenerate_sessions": ["prompts/regenerate_sessions.txt"],
+    "regenerate_session": ["prompts/regenerate_session.txt"],
+    # Wraps one of the prompts above, to ask again for the members missing from its answer
+    "missing_members": ["prompts/missing_members.txt"],
+}
+
+# Rough average for English text, good enough to spot prompts that grow out of hand
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+@dataclass
+class RenderedPrompt:
+    name: str
+    text: str
+    chars: int
+    estimated_tokens: int
+
+    def __str__(self) -> str:
+        return self.text
+
+
+class PromptRegistry:
+
+    def __init__(self, prompts: dict[str, list[str]], token_warning: int = 8000):
+        self.prompts = prompts
+        self.token_warning = token_warning
+
+        # path -> (mtime, compiled template)
+        self._templates: dict[str, tuple[float, Template]] = {}
+        # prompt name -> size of the last rendered prompt
+        self._last_rendered: dict[str, dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app: Flask) -> None:
+        self.token_warning = app.config.get("PROMPT_TOKEN_WARNING", self.token_warning)
+        app.extensions["prompt_registry"] = self
+
+    def render(self, name: str, **params: Any) -> RenderedPrompt:
+        if name not in self.prompts:
+            raise KeyError(f"Unknown prompt '{name}'")
+
+        with metrics.stage("render_prompt"):
+            # prompt.txt is plain text (it is never substituted), the rest are templates
+            parts = []
+            for path in self.prompts[name]:
+                template = self._get_template(path)
+                parts.append(template.template if path == "prompt.txt" else template.substitute(params))
+            text = "".join(parts)
+
+        rendered = RenderedPrompt(name=name, text=text, chars=len(text), estimated_tokens=estimate_tokens(text))
+        with self._lock:
+            self._last_rendered[name] = {
+                "chars": rendered.chars,
+                "estimated_tokens": rendered.estimated_tokens
+            }
+
+        if rendered.estimated_tokens > self.token_warning:
+            logging.warning(
+                f"Prompt '{name}' is ~{rendered.estimated_tokens} tokens (warning threshold: {self.token_warning})"
+            )
+        return rendered
+
+    def warm(self) -> int:
+        """
+        Reads and compiles every template now, so the first requests do not. Returns how many there are.
+        """
+        paths = {path for paths in self.prompts.values() for path in paths}
+        for path in paths:
+            self._get_template(path)
+        return len(paths)
+
+    def stats(self) -> dict[str, Any]:
+        output = {}
+        for name, paths in self.prompts.items():
+            template_text = "".join(self._get_template(path).template for path in paths)
+            with self._lock:
+                last_rendered = self._last_rendered.get(name)
+            output[name] = {
+                "files": paths,
+                "template_chars": len(template_text),
+                "template_estimated_tokens": estimate_tokens(template_text),
+                "last_rendered": last_rendered
+            }
+        return output
+
+    def _get_template(self, path: str) -> Template:
+        full_path = os.path.join(basedir, path)
+        mtime = os.stat(full_path).st_mtime
+
+        cached = self._templates.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with self._lock, metrics.stage("read_template"):
+            with open(full_path, "r", encoding="utf-8") as file:
+                content = file.read()
+            if not content:
+                raise ImportError(f"Prompt {path} cannot be found")
+
+            if cached is not None:
+                print(f"Prompt {path} changed on disk. Reloading")
+            template = Template(content)
+            self._templates[path] = (mtime, template)
+            return template
+
+
+prompt_registry = PromptRegistry(PROMPTS)
@@ -0,0 +1,380 @@
+"""
+Client-side rate limiting for the GenAI calls.
+
+Before it is sent, every call takes one request and its estimated tokens from
+two shared token buckets (GENAI_RPM requests and GENAI_TPM tokens per minute),
+so a burst queues up here instead of running into 429s. Queued calls are served
+by priority: interactive requests (someone is waiting on the page) go before
+bulk jobs. Retryable failures (429, 5xx, timeouts) are retried with jittered
+exponential backoff, everything else fails right away.
+"""
+from typing import Any, Awaitable, Callable
+from collections import deque
+from flask import Flask
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+
+from metrics import metrics
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BULK: "bulk"}
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# How often a coroutine waiting in the queue checks whether its turn came
+ASYNC_POLL_SECONDS = 0.05
+
+
+class GenAIUnavailableError(Exception):
+    """
+    GenAI could not answer. status_code is what the API should answer with,
+    retry_after (seconds) is set when trying again later can help.
+    """
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: float | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Holds up to per_minute units and refills them continuously.
+    per_minute <= 0 means unlimited. Not thread safe, RateLimiter locks around it.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / 60)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Seconds until amount can be taken. More than the capacity only waits for a full bucket.
+        """
+        if self.unlimited:
+            return 0.0
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60 / self.capacity)
+
+    def take(self, amount: float) -> None:
+        if not self.unlimited:
+            # Can go below zero: a call bigger than the bucket is paid back before the next one
+            self.level -= amount
+
+    def give_back(self, amount: float) -> None:
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """
+    Same pattern as `db`: instantiate once, bind to the app later with init_app()
+    """
+
+    def __init__(self):
+        self.requests_per_minute = 15
+        self.tokens_per_minute = 250000
+        self.max_retries = 4
+        self.backoff_base = 1.0
+        self.backoff_max = 30.0
+        # Longest a call may queue for its turn before giving up
+        self.max_wait = 120.0
+
+        self._requests = TokenBucket(self.requests_per_minute)
+        self._tokens = TokenBucket(self.tokens_per_minute)
+        self._cond = threading.Condition()
+        # (priority, arrival) of every queued call, the smallest one is served next
+        self._queue: list[tuple[int, int]] = []
+        self._arrivals = itertools.count()
+        # (time, requests, tokens) of the last minute, for the usage report
+        self._recent: deque[tuple[float, int, float]] = deque()
+        self._counters = {
+            "calls": 0,
+            "retries": 0,
+            "throttled": 0,
+            "failures": 0,
+            "queue_timeouts": 0,
+            "waited_seconds": 0.0
+        }
+
+    def init_app(self, app: Flask) -> None:
+        self.requests_per_minute = app.config.get("GENAI_RPM", self.requests_per_minute)
+        self.tokens_per_minute = app.config.get("GENAI_TPM", self.tokens_per_minute)
+        self.max_retries = app.config.get("GENAI_MAX_RETRIES", self.max_retries)
+        self.backoff_base = app.config.get("GENAI_BACKOFF_BASE", self.backoff_base)
+        self.backoff_max = app.config.get("GENAI_BACKOFF_MAX", self.backoff_max)
+        self.max_wait = app.config.get("GENAI_MAX_WAIT", self.max_wait)
+
+        with self._cond:
+            self._requests = TokenBucket(self.requests_per_minute)
+            self._tokens = TokenBucket(self.tokens_per_minute)
+        app.extensions["rate_limiter"] = self
+
+    def call(
+        self,
+        fn: Callable[[], tuple[Any, int | None]],
+        estimated_tokens: int,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> Any:
+        """
+        Runs fn() once the quota allows it, retrying retryable errors.
+        fn returns (result, tokens actually used or None), only the result is returned.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(estimated_tokens, priority)
+            try:
+                result, used_tokens = fn()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                with metrics.stage("llm_retry_backoff"):
+                    time.sleep(delay)
+                continue
+
+            if used_tokens is not None:
+                self.settle(estimated_tokens, used_tokens)
+            return result
+
+    async def acall(
+        self,
+        fn: Callable[[], Awaitable[tuple[Any, int | None]]],
+        estimated_tokens: int,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> Any:
+        """
+        call() for coroutines: waits for the quota and the backoff without blocking the event loop
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.aacquire(estimated_tokens, priority)
+            try:
+                result, used_tokens = await fn()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                with metrics.stage("llm_retry_backoff"):
+                    await asyncio.sleep(delay)
+                continue
+
+            if used_tokens is not None:
+                self.settle(estimated_tokens, used_tokens)
+            return result
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        """
+        Seconds to wait before retrying the failed call. Raises GenAIUnavailableError when it must not be retried.
+        """
+        # The request was sent, its quota stays spent
+        if not is_retryable(error):
+            self._count("failures")
+            raise GenAIUnavailableError(f"GenAI rejected the request: {error}", status_code=502)
+
+        retry_after = server_retry_delay(error)
+        if is_rate_limited(error):
+            self._count("throttled")
+            self._throttle()
+        if attempt == self.max_retries:
+            self._count("failures")
+            raise GenAIUnavailableError(
+                f"GenAI is unavailable after {attempt + 1} attempts: {error}",
+                retry_after=retry_after or self.backoff_max
+            )
+
+        delay = self.backoff_delay(attempt, retry_after)
+        logging.warning(f"GenAI call failed ({error}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        self._count("retries")
+        return delay
+
+    def acquire(self, tokens: int, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """
+        Blocks until it is this call's turn and the quota allows it, returns the seconds waited.
+        Raises GenAIUnavailableError after max_wait seconds.
+        """
+        ticket = (priority, next(self._arrivals))
+        started = time.monotonic()
+
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    waited, wait = self._try_take(ticket, tokens, started)
+                    if waited is not None:
+                        return waited
+                    self._cond.wait(wait)
+            except BaseException:
+                self._leave_queue(ticket)
+                raise
+
+    async def aacquire(self, tokens: int, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """
+        acquire() for coroutines, in the same queue as the threads
+        """
+        ticket = (priority, next(self._arrivals))
+        started = time.monotonic()
+
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+        try:
+            while True:
+                with self._cond:
+                    waited, wait = self._try_take(ticket, tokens, started)
+                if waited is not None:
+                    return waited
+                # The condition only wakes threads up, check again at least every ASYNC_POLL_SECONDS
+                await asyncio.sleep(min(wait, ASYNC_POLL_SECONDS))
+        except BaseException:
+            with self._cond:
+                self._leave_queue(ticket)
+            raise
+
+    def _try_take(self, ticket: tuple[int, int], tokens: int, started: float) -> tuple[float | None, float]:
+        """
+        Takes the quota if it is ticket's turn and there is enough left: returns (seconds waited, 0).
+        Otherwise (None, seconds to wait at most before trying again). Call it with _cond held.
+        """
+        self._requests.refill()
+        self._tokens.refill()
+        now = time.monotonic()
+        deadline = started + self.max_wait
+
+        if self._queue[0] == ticket:
+            wait = max(self._requests.wait_time(1), self._tokens.wait_time(tokens))
+            if wait <= 0:
+                self._requests.take(1)
+                self._tokens.take(tokens)
+                heapq.heappop(self._queue)
+                self._recent.append((time.time(), 1, tokens))
+                waited = now - started
+                self._counters["calls"] += 1
+                self._counters["waited_seconds"] += waited
+                # The next call in line may be able to go too
+                self._cond.notify_all()
+                metrics.record_stage("llm_queue_wait", waited)
+                return waited, 0.0
+            if now + wait > deadline:
+                self._counters["queue_timeouts"] += 1
+                raise GenAIUnavailableError("GenAI quota is exhausted, try again later", retry_after=wait)
+            return None, wait
+
+        # Woken up when the calls before this one move on
+        wait = deadline - now
+        if wait <= 0:
+            self._counters["queue_timeouts"] += 1
+            raise GenAIUnavailableError("Too many GenAI calls queued, try again later", retry_after=self.max_wait)
+        return None, wait
+
+    def _leave_queue(self, ticket: tuple[int, int]) -> None:
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+            self._cond.notify_all()
+
+    def settle(self, estimated_tokens: int, used_tokens: int) -> None:
+        """
+        Corrects the token bucket once the real usage of a call is known
+        """
+        with self._cond:
+            difference = estimated_tokens - used_tokens
+            if difference > 0:
+                self._tokens.give_back(difference)
+            else:
+                self._tokens.take(-difference)
+            self._recent.append((time.time(), 0, -difference))
+            self._cond.notify_all()
+
+    def backoff_delay(self, attempt: int, retry_after: float | None = None) -> float:
+        # "Full jitter": callers failing together don't all come back at the same moment
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after:
+            delay = max(delay, retry_after)
+        return delay
+
+    def stats(self) -> dict[str, Any]:
+        with self._cond:
+            self._requests.refill()
+            self._tokens.refill()
+
+            minute_ago = time.time() - 60
+            while self._recent and self._recent[0][0] < minute_ago:
+                self._recent.popleft()
+
+            return {
+                "limits": {
+                    "requests_per_minute": self.requests_per_minute,
+                    "tokens_per_minute": self.tokens_per_minute
+                },
+                "available": {
+                    "requests": None if self._requests.unlimited else max(0, int(self._requests.level)),
+                    "tokens": None if self._tokens.unlimited else max(0, int(self._tokens.level))
+                },
+                "used_last_minute": {
+                    "requests": sum(requests for _, requests, _ in self._recent),
+                    "tokens": int(sum(tokens for _, _, tokens in self._recent))
+                },
+                "queued": {
+                    name: sum(1 for priority, _ in self._queue if priority == level)
+                    for level, name in PRIORITY_NAMES.items()
+                },
+                **self._counters,
+                "waited_seconds": round(self._counters["waited_seconds"], 3)
+            }
+
+    def _throttle(self) -> None:
+        # GenAI says we are over its quota: whatever our buckets think, nobody goes for a while
+        with self._cond:
+            self._requests.refill()
+            self._requests.level = min(self._requests.level, 0)
+
+    def _count(self, counter: str) -> None:
+        with self._cond:
+            self._counters[counter] += 1
+
+
+def is_api_error(error: Exception) -> bool:
+    # Looked up instead of imported: if the SDK was never imported, the error cannot come from it
+    errors = sys.modules.get("google.genai.errors")
+    return errors is not None and isinstance(error, errors.APIError)
+
+
+def is_retryable(error: Exception) -> bool:
+    if is_api_error(error):
+        return error.code in RETRYABLE_STATUS_CODES
+    httpx = sys.modules.get("httpx")
+    if httpx is not None and isinstance(error, (httpx.TimeoutException, httpx.NetworkError)):
+        return True
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+def is_rate_limited(error: Exception) -> bool:
+    return is_api_error(error) and error.code == 429
+
+
+def server_retry_delay(error: Exception) -> float | None:
+    """
+    The delay a 429 asks for, found in its RetryInfo detail ("retryDelay": "37s")
+    """
+    if not is_api_error(error) or not error.details:
+        return None
+    match = re.search(r'"retryDelay":\s*"([\d.]+)s"', json.dumps(error.details))
+    return float(match.group(1)) if match else None
+
+
+rate_limiter = RateLimiter()
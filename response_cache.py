@@ -0,0 +1,211 @@
+"""
+Server-side cache for the JSON of the read endpoints, with ETags.
+
+Every cached payload is tagged with the version stamp of the scopes it was
+built from ("courses", "course:<id>", "week:<id>"). The write paths bump the
+scopes they touch, which makes exactly those payloads stale. While a payload
+is fresh, a request carrying its ETag in If-None-Match gets a 304 without
+touching the database.
+
+Versions live in memory, so they are only bumped by writes made in this process.
+With several server processes (serve.py), RESPONSE_CACHE_SHARED_VERSIONS names a
+file the processes map in memory and keep the versions in instead: a write in
+one process makes the payloads cached by the others stale too.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable
+from flask import Flask, Response, current_app, request
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: only single process servers there (waitress), the in-memory versions are enough
+    fcntl = None
+
+SHARED_VERSION_SLOTS = 4096
+
+
+@dataclass
+class CachedResponse:
+    stamp: tuple[int, ...]
+    body: bytes
+    etag: str
+
+
+class SharedVersions:
+    """
+    Version counters in a memory mapped file shared by processes. Scopes are hashed
+    into SHARED_VERSION_SLOTS slots: two scopes sharing a slot only cost extra misses.
+    """
+
+    def __init__(self, path: str, slots: int = SHARED_VERSION_SLOTS):
+        self.path = path
+        self.slots = slots
+        self._pid: int | None = None
+        self._open()
+
+    def get(self, scope: str) -> int:
+        return struct.unpack_from("<Q", self._map, self._offset(scope))[0]
+
+    def bump(self, scopes: tuple[str, ...]) -> None:
+        # A forked worker shares its parent's open file, and with it the parent's locks: open our own
+        if self._pid != os.getpid():
+            self._open()
+        # Locked across processes: two increments racing must not end as one
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            for offset in {self._offset(scope) for scope in scopes}:
+                struct.pack_into("<Q", self._map, offset, struct.unpack_from("<Q", self._map, offset)[0] + 1)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def _open(self) -> None:
+        size = self.slots * 8
+        self._file = open(self.path, "a+b")
+        if os.path.getsize(self.path) < size:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._pid = os.getpid()
+
+    def _offset(self, scope: str) -> int:
+        return zlib.crc32(scope.encode("utf-8")) % self.slots * 8
+
+
+class ResponseCache:
+    """
+    Same pattern as `db`: instantiate once, bind to the app later with init_app()
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.max_entries = 512
+
+        self._versions: dict[str, int] = {}
+        self._shared: SharedVersions | None = None
+        # Part of every stamp, bumped when a write may have touched anything (e.g. an import)
+        self._epoch = 0
+        # key -> cached payload, least recently used first
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "not_modified": 0,
+            "invalidations": 0
+        }
+
+    def init_app(self, app: Flask) -> None:
+        self.enabled = app.config.get("RESPONSE_CACHE_ENABLED", self.enabled)
+        self.max_entries = app.config.get("RESPONSE_CACHE_MAX_ENTRIES", self.max_entries)
+        shared_path = app.config.get("RESPONSE_CACHE_SHARED_VERSIONS")
+        if shared_path:
+            if fcntl is None:
+                raise ValueError("RESPONSE_CACHE_SHARED_VERSIONS needs fcntl, it is not available on this platform")
+            self._shared = SharedVersions(shared_path)
+        app.extensions["response_cache"] = self
+
+    def bump(self, *scopes: str) -> None:
+        """
+        Marks every payload built from these scopes as stale.
+        Call it after the write is committed.
+        """
+        if self._shared is not None:
+            self._shared.bump(scopes)
+        with self._lock:
+            for scope in scopes:
+                self._versions[scope] = self._versions.get(scope, 0) + 1
+            self._counters["invalidations"] += 1
+
+    def invalidate_all(self) -> None:
+        if self._shared is not None:
+            self._shared.bump(("*",))
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._counters["invalidations"] += 1
+
+    def json_response(
+        self,
+        key: str,
+        scopes: list[str],
+        build: Callable[[], tuple[Any, int]],
+    ) -> Response:
+        """
+        Returns the cached payload for key, or builds it with build().
+        build() returns (payload, status_code). Only 200s are cached.
+        """
+        # Take the stamp before building: a write committed meanwhile bumps the
+        # version, so what we build now can only ever be treated as stale
+        with self._lock:
+            stamp = self._stamp(scopes)
+            entry = self._entries.get(key) if self.enabled else None
+            if entry is not None and entry.stamp != stamp:
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is not None:
+            if request.if_none_match.contains(entry.etag):
+                with self._lock:
+                    self._counters["not_modified"] += 1
+                return self._not_modified(entry.etag)
+            with self._lock:
+                self._counters["hits"] += 1
+            return self._response(entry.body, entry.etag)
+
+        payload, status = build()
+        response = current_app.json.response(payload)
+        if status != 200:
+            response.status_code = status
+            return response
+
+        body = response.get_data()
+        etag = hashlib.sha1(body).hexdigest()
+        with self._lock:
+            self._counters["misses"] += 1
+            if self.enabled:
+                self._entries[key] = CachedResponse(stamp=stamp, body=body, etag=etag)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        if request.if_none_match.contains(etag):
+            return self._not_modified(etag)
+        return self._response(body, etag)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                **self._counters,
+                "entries": len(self._entries)
+            }
+
+    def _stamp(self, scopes: list[str]) -> tuple[int, ...]:
+        if self._shared is not None:
+            return tuple(self._shared.get(scope) for scope in ("*", *scopes))
+        return (self._epoch, *(self._versions.get(scope, 0) for scope in scopes))
+
+    def _response(self, body: bytes, etag: str) -> Response:
+        response = Response(body, status=200, mimetype="application/json")
+        response.set_etag(etag)
+        # Let the browser keep the payload, but always revalidate it with us
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    def _not_modified(self, etag: str) -> Response:
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+
+response_cache = ResponseCache()
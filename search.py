@@ -0,0 +1,232 @@
+"""
+Full-text search over the courses, weeks and session minutes, with SQLite FTS5.
+
+One FTS5 table, search_index, holds a row per course (name, content), per
+week (topic, summary) and per session segment (topic, content). Triggers on
+those tables keep it up to date, so every write path (ORM, Core bulk inserts
+and deletes, /api/db-import) updates the index in the same transaction,
+without the app doing anything. The table and its triggers are created, and
+filled from the existing rows, by migrations.py.
+
+The rowid of an indexed row is its id * KIND_STRIDE + the code of its kind:
+a trigger finds the row to update or delete by rowid, not by scanning.
+Results are ranked with BM25 (the title weighs more than the body) and come
+with a snippet around the matched words.
+
+The index is derived data: search_index and its shadow tables are left out of
+/api/db-dump, /api/db-export and /api/db-import (see is_search_table()).
+"""
+from typing import Any
+from sqlalchemy import Connection, text
+from sqlalchemy.exc import OperationalError
+
+import html
+import re
+
+SEARCH_TABLE = "search_index"
+
+# rowid = id * KIND_STRIDE + code
+KIND_STRIDE = 4
+KINDS = {
+    "course": 1,
+    "week": 2,
+    "segment": 3,
+}
+
+# BM25 weights of the columns matched by the queries (scope is only a filter)
+TITLE_WEIGHT = 4.0
+BODY_WEIGHT = 1.0
+
+SNIPPET_TOKENS = 16
+# Put around the matches by snippet(), replaced by <mark> once the snippet is HTML escaped
+MARK_START = "\ue000"
+MARK_END = "\ue001"
+
+# Words of a query taken into account, the others are dropped
+MAX_QUERY_TERMS = 16
+
+TERM = re.compile(r'"([^"]*)"?|(\w+)')
+WORD = re.compile(r"\w+")
+# Two letters or more at the very end of the query
+UNFINISHED = re.compile(r"\w\w$")
+
+# Course of the session of a segment `new`
+SEGMENT_COURSE = "(SELECT w.course_id FROM sessions s JOIN weeks w ON w.id = s.week_id WHERE s.id = new.session_id)"
+
+# Table -> (kind, the values of the index columns for its row `new`, the columns whose update changes them)
+SOURCES = {
+    "courses": ("course", {
+        "course_id": "new.id", "week_id": "NULL", "session_id": "NULL", "title": "new.name", "body": "new.content"
+    }, "name, content"),
+    "weeks": ("week", {
+        "course_id": "new.course_id", "week_id": "new.id", "session_id": "NULL", "title": "new.topic", "body": "new.summary"
+    }, "course_id, topic, summary"),
+    "session_segments": ("segment", {
+        "course_id": SEGMENT_COURSE,
+        "week_id": "(SELECT s.week_id FROM sessions s WHERE s.id = new.session_id)",
+        "session_id": "new.session_id", "title": "new.topic", "body": "new.content"
+    }, "topic, content"),
+}
+INDEX_COLUMNS = ("kind", "ref_id", "course_id", "week_id", "session_id", "title", "body", "scope")
+
+
+def row_insert(table: str, conflict: str = "") -> str:
+    """
+    The INSERT of the index row of every `new` row of table (one in a trigger, all of them FROM table AS new)
+    """
+    kind, values, columns = SOURCES[table]
+    return (
+        f"INSERT {conflict} INTO {SEARCH_TABLE} (rowid, {', '.join(INDEX_COLUMNS)}) "
+        f"SELECT new.id * {KIND_STRIDE} + {KINDS[kind]}, '{kind}', new.id, "
+        f"{values['course_id']}, {values['week_id']}, {values['session_id']}, {values['title']}, {values['body']}, "
+        # A token of the course ("c12"), so a course filter is matched by the index too
+        f"'c' || {values['course_id']}"
+    )
+
+
+def schema() -> list[str]:
+    """
+    The statements creating the index and the triggers of every source table
+    """
+    statements = [f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+            kind UNINDEXED, ref_id UNINDEXED, course_id UNINDEXED, week_id UNINDEXED, session_id UNINDEXED,
+            title, body, scope,
+            tokenize = 'porter unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """]
+    for table, (kind, values, columns) in SOURCES.items():
+        # OR REPLACE: an INSERT OR REPLACE into the table (db-import ?on_conflict=replace) does not fire the delete trigger
+        upsert = row_insert(table, "OR REPLACE")
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS {table}_search_insert AFTER INSERT ON {table} BEGIN {upsert}; END",
+            f"CREATE TRIGGER IF NOT EXISTS {table}_search_update AFTER UPDATE OF {columns} ON {table} BEGIN {upsert}; END",
+            f"CREATE TRIGGER IF NOT EXISTS {table}_search_delete AFTER DELETE ON {table} BEGIN "
+            f"DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * {KIND_STRIDE} + {KINDS[kind]}; END",
+        ]
+    return statements
+
+
+class SearchUnavailableError(Exception):
+    """The SQLite library has no FTS5, or the index has not been created yet"""
+
+
+def is_search_table(table: str) -> bool:
+    """
+    Whether table is the index or one of the shadow tables FTS5 keeps it in (search_index_data, ...)
+    """
+    return table == SEARCH_TABLE or table.startswith(SEARCH_TABLE + "_")
+
+
+def create_search_index(conn: Connection) -> int:
+    """
+    Creates the index and its triggers, and fills it from the rows already there. Returns how many rows it holds.
+    """
+    for statement in schema():
+        conn.execute(text(statement))
+
+    # Built again from scratch, so running it twice does not index anything twice
+    conn.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+    for table in SOURCES:
+        conn.execute(text(f"{row_insert(table)} FROM {table} AS new"))
+    conn.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"))
+    return conn.execute(text(f"SELECT COUNT(*) FROM {SEARCH_TABLE}")).scalar()
+
+
+def match_query(query: str) -> str | None:
+    """
+    The FTS5 query for what a user typed: every word (or "quoted phrase") must match,
+    and the last word may be unfinished. None when there is nothing to search for.
+    The words are quoted, so the FTS5 operators and punctuation typed are taken literally.
+    """
+    terms = []
+    for phrase, word in TERM.findall(query):
+        words = WORD.findall(phrase or word)
+        if words:
+            terms.append('"' + " ".join(words) + '"')
+    if not terms:
+        return None
+
+    # Searched while typing: "algo" finds "algorithms"
+    if len(terms) <= MAX_QUERY_TERMS and UNFINISHED.search(query):
+        terms[-1] += "*"
+    return " ".join(terms[:MAX_QUERY_TERMS])
+
+
+def highlight(snippet: str) -> str:
+    return html.escape(snippet).replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+
+def search(
+    conn: Connection,
+    query: str,
+    kinds: list[str] | None = None,
+    course_id: int | None = None,
+    limit: int = 20,
+    offset: int = 0,
+) -> tuple[list[dict[str, Any]], bool]:
+    """
+    The hits of query, best first, from offset on, and whether there are more.
+    Every hit has its kind, where it is (course, week, session) and an HTML snippet with the matches in <mark>.
+    """
+    match = match_query(query)
+    if match is None:
+        return [], False
+
+    # Both filters are answered from the index, not by reading every matching row:
+    # the course by its scope token, the kind by the rowid
+    match = f"{{title body}} : ({match})"
+    if course_id is not None:
+        match += f' AND scope : "c{int(course_id)}"'
+    conditions = [f"{SEARCH_TABLE} MATCH :match"]
+    if kinds:
+        conditions.append(f"rowid % {KIND_STRIDE} IN ({', '.join(str(KINDS[kind]) for kind in kinds)})")
+    params = {"match": match, "mark_start": MARK_START, "mark_end": MARK_END, "limit": limit + 1, "offset": offset}
+
+    # Every match is ranked, only the page kept is joined with the names and numbers shown with it
+    sql = f"""
+        WITH hits AS (
+            SELECT kind, ref_id, course_id, week_id, session_id, title,
+                   snippet({SEARCH_TABLE}, -1, :mark_start, :mark_end, '…', {SNIPPET_TOKENS}) AS snippet,
+                   bm25({SEARCH_TABLE}, 0, 0, 0, 0, 0, {TITLE_WEIGHT}, {BODY_WEIGHT}, 0) AS score
+            FROM {SEARCH_TABLE}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY score
+            LIMIT :limit OFFSET :offset
+        )
+        SELECT hits.*, c.code AS course_code, c.name AS course_name, w.week_number,
+               s.session_no, g.label
+        FROM hits
+        LEFT JOIN courses c ON c.id = hits.course_id
+        LEFT JOIN weeks w ON w.id = hits.week_id
+        LEFT JOIN sessions s ON s.id = hits.session_id
+        LEFT JOIN session_segments g ON hits.kind = 'segment' AND g.id = hits.ref_id
+        ORDER BY hits.score
+    """
+    try:
+        rows = conn.execute(text(sql), params).mappings().all()
+    except OperationalError as e:
+        if "no such table" in str(e) or "no such module" in str(e):
+            raise SearchUnavailableError("Full-text search is not available: SQLite without FTS5, or the database was not migrated")
+        raise
+
+    hits = [
+        {
+            "kind": row["kind"],
+            "id": row["ref_id"],
+            "course_id": row["course_id"],
+            "course_code": row["course_code"],
+            "course_name": row["course_name"],
+            "week_id": row["week_id"],
+            "week_number": row["week_number"],
+            "session_id": row["session_id"],
+            "session_no": row["session_no"],
+            "label": row["label"],
+            "title": row["title"],
+            "snippet": highlight(row["snippet"]),
+            # BM25 as FTS5 gives it is lower for better hits
+            "score": round(-row["score"], 4)
+        } for row in rows[:limit]
+    ]
+    return hits, len(rows) > limit
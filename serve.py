@@ -0,0 +1,243 @@
+"""
+Production entry point: serves the app with several processes and threads.
+
+    python serve.py                                     # SERVE_* settings from .env, or the defaults
+    python serve.py --port 8000 --workers 4 --threads 8
+
+On Linux / macOS it runs gunicorn (gthread workers). The app is built once in
+the parent process and, before any worker is forked:
+    - the tables are created / migrated (init_db)
+    - the jobs left "running" by the last run are queued again, once for all workers
+    - the prompt templates are read and compiled
+Every worker then opens its database connections before taking requests. The
+workers share the response cache versions through a file and their metrics
+through a directory (METRICS_SHARED_DIR), and the GenAI quota
+(GENAI_RPM / GENAI_TPM) is split between them.
+
+On SIGTERM (or Ctrl+C) the workers stop accepting connections and get
+--graceful-timeout seconds to finish the requests in flight, streamed
+generations included, and the background jobs they are running. Jobs that
+had not started stay queued for the next start.
+
+On Windows it runs waitress instead: one process, --threads threads, same
+warm-up and draining.
+
+--server uvicorn serves asgi.py instead: one process, where the generations
+of async_api.py wait on GenAI as coroutines (hundreds at once), and the other
+requests run in --threads threads.
+"""
+from flask import Flask
+from dotenv import load_dotenv
+from werkzeug.wsgi import ClosingIterator
+
+import argparse
+import atexit
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+
+from app import create_app, init_db
+from db import db
+from db_profile import warm_pool
+from jobs import job_queue
+from prompts import prompt_registry
+from rate_limit import rate_limiter
+
+
+def prepare(workers: int) -> Flask:
+    """
+    The app, with everything that must happen once (not once per worker) done
+    """
+    config = {}
+    if workers > 1:
+        # A new file every start: the versions of an older run must not match anything cached now
+        shared_dir = tempfile.mkdtemp(prefix="syllabus-")
+        atexit.register(shutil.rmtree, shared_dir, ignore_errors=True)
+        config["RESPONSE_CACHE_SHARED_VERSIONS"] = os.path.join(shared_dir, "response-versions")
+        # Every worker writes its counters there, /api/metrics adds them up
+        config["METRICS_SHARED_DIR"] = os.path.join(shared_dir, "metrics")
+        os.mkdir(config["METRICS_SHARED_DIR"])
+    app = create_app(config)
+    init_db(app)
+
+    if workers > 1:
+        # Every worker has its own buckets, together they must stay within the quota
+        for key in ("GENAI_RPM", "GENAI_TPM"):
+            if app.config[key] > 0:
+                app.config[key] = max(1, app.config[key] // workers)
+        rate_limiter.init_app(app)
+
+    requeued = job_queue.requeue_interrupted()
+    if requeued:
+        print(f"Queued {requeued} interrupted job(s) again")
+    job_queue.requeue_running = False
+
+    print(f"Compiled {prompt_registry.warm()} prompt templates")
+
+    # No connection may be shared with the forked workers, they open their own
+    with app.app_context():
+        db.engine.dispose()
+    return app
+
+
+def warm_worker(app: Flask) -> None:
+    started = time.perf_counter()
+    connections = warm_pool(app)
+    # Picks up the queued jobs now rather than on the first request
+    job_queue.resume_pending()
+    print(f"[{os.getpid()}] Ready: {connections} database connections opened in {time.perf_counter() - started:.3f}s")
+
+
+def serve_gunicorn(app: Flask, args: argparse.Namespace) -> None:
+    from gunicorn.app.base import BaseApplication
+
+    def post_fork(server, worker):
+        # The parent's pool has been disposed, but drop any reference to it in this process too
+        with app.app_context():
+            db.engine.dispose(close=False)
+        warm_worker(app)
+
+    def worker_exit(server, worker):
+        # The requests in flight are drained by gunicorn, the background jobs here
+        still_running = job_queue.drain(args.graceful_timeout)
+        if still_running:
+            print(f"[{os.getpid()}] {still_running} job(s) still running, they will be resumed on the next start")
+
+    class Server(BaseApplication):
+
+        def load_config(self):
+            for key, value in {
+                "bind": f"{args.host}:{args.port}",
+                "workers": args.workers,
+                "threads": args.threads,
+                "worker_class": "gthread",
+                "timeout": args.timeout,
+                "graceful_timeout": args.graceful_timeout,
+                "keepalive": 5,
+                "preload_app": True,
+                "post_fork": post_fork,
+                "worker_exit": worker_exit,
+            }.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    Server().run()
+
+
+def serve_waitress(app: Flask, args: argparse.Namespace) -> None:
+    from waitress.server import create_server
+
+    if args.workers > 1:
+        print(f"waitress runs a single process, --workers {args.workers} is ignored (use --threads)")
+
+    in_flight = InFlight(app.wsgi_app)
+    app.wsgi_app = in_flight
+    warm_worker(app)
+    server = create_server(app, host=args.host, port=args.port, threads=args.threads, channel_timeout=args.timeout)
+
+    def stop(signum, frame):
+        # Stop accepting, give the requests in flight and the jobs their time, then exit
+        print(f"Shutting down, waiting up to {args.graceful_timeout}s for {in_flight.count} request(s)")
+        server.close()
+        deadline = time.monotonic() + args.graceful_timeout
+        in_flight.wait(args.graceful_timeout)
+        job_queue.drain(max(0.0, deadline - time.monotonic()))
+        os._exit(0)
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: threading.Thread(target=stop, args=(signum, frame)).start())
+
+    print(f"Serving on http://{args.host}:{args.port} with {args.threads} threads")
+    server.run()
+
+
+def serve_uvicorn(app: Flask, args: argparse.Namespace) -> None:
+    import uvicorn
+    from asgi import create_asgi_app
+
+    warm_worker(app)
+    server = uvicorn.Server(uvicorn.Config(
+        create_asgi_app(app, wsgi_threads=args.threads),
+        host=args.host,
+        port=args.port,
+        lifespan="off",
+        timeout_keep_alive=5,
+        # On SIGTERM / Ctrl+C: stop accepting, then give the requests in flight their time
+        timeout_graceful_shutdown=args.graceful_timeout
+    ))
+    server.run()
+
+    still_running = job_queue.drain(args.graceful_timeout)
+    if still_running:
+        print(f"{still_running} job(s) still running, they will be resumed on the next start")
+
+
+class InFlight:
+    """
+    WSGI middleware counting the requests whose response is not fully sent yet
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.count = 0
+        self._cond = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self._cond:
+            self.count += 1
+        try:
+            body = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self._done()
+            raise
+        # Closed by the server once the body is sent, or the client went away
+        return ClosingIterator(body, self._done)
+
+    def wait(self, timeout: float) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self.count == 0, timeout)
+
+    def _done(self) -> None:
+        with self._cond:
+            self.count -= 1
+            self._cond.notify_all()
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("SERVE_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 5000)))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVE_WORKERS", 2)), help="Processes (gunicorn only)")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("SERVE_THREADS", 8)), help="Threads per process")
+    parser.add_argument("--timeout", type=int, default=int(os.getenv("SERVE_TIMEOUT", 300)),
+                        help="Seconds a request may take (generations are slow) before its worker is restarted")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("SERVE_GRACEFUL_TIMEOUT", 120)),
+                        help="Seconds given to the requests and jobs in flight on shutdown")
+    parser.add_argument("--server", choices=("auto", "gunicorn", "waitress", "uvicorn"), default=os.getenv("SERVE_SERVER", "auto"))
+    args = parser.parse_args()
+
+    server = args.server
+    if server == "auto":
+        server = "waitress" if sys.platform == "win32" else "gunicorn"
+    if server in ("waitress", "uvicorn"):
+        # One process: the in-memory response cache versions are enough
+        args.workers = 1
+
+    app = prepare(args.workers)
+    if server == "gunicorn":
+        serve_gunicorn(app, args)
+    elif server == "uvicorn":
+        serve_uvicorn(app, args)
+    else:
+        serve_waitress(app, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Coalescing of duplicate generations running at the same time.
+
+A double click on "Generate" or two open tabs send the same request twice, and
+both would pay for a GenAI call and write the same rows. Calls are keyed (e.g.
+("week_sessions", week_id)): the first one for a key runs, the ones arriving
+while it is in flight wait for it and get its result, or its exception. Once
+it finished the key is free again.
+
+Coroutines (asgi.py) use ado(), in the same flights as the threads.
+
+This only covers one process, the database claims in api.py (and the unique
+constraints) cover the rest.
+"""
+from typing import Any, Awaitable, Callable, Hashable
+from flask import Flask
+
+import asyncio
+import threading
+
+# How often a coroutine following a flight checks whether it finished
+ASYNC_POLL_SECONDS = 0.05
+
+
+class Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+        self.followers = 0
+
+    def wait(self) -> Any:
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Same pattern as `db`: instantiate once, bind to the app later with init_app()
+    """
+
+    def __init__(self):
+        self._flights: dict[Hashable, Flight] = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            "leaders": 0,
+            "followers": 0
+        }
+
+    def init_app(self, app: Flask) -> None:
+        app.extensions["single_flight"] = self
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Runs fn, unless a call with the same key is in flight: then waits for it and returns its result
+        """
+        flight, leader = self.join(key)
+        if not leader:
+            return flight.wait()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result=result)
+        return result
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        do() for coroutines: followers wait for the flight (led by a thread or a coroutine) without blocking the event loop
+        """
+        flight, leader = self.join(key)
+        if not leader:
+            while not flight.done.is_set():
+                await asyncio.sleep(ASYNC_POLL_SECONDS)
+            return flight.wait()
+
+        try:
+            result = await fn()
+        except BaseException as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result=result)
+        return result
+
+    def join(self, key: Hashable) -> tuple[Flight, bool]:
+        """
+        The flight of key and whether the caller leads it. The leader must call finish(),
+        for when fn() cannot be wrapped by do() (e.g. a streamed response).
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self._counters["followers"] += 1
+                return flight, False
+
+            flight = self._flights[key] = Flight()
+            self._counters["leaders"] += 1
+            return flight, True
+
+    def finish(self, key: Hashable, flight: Flight, result: Any = None, error: BaseException | None = None) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.result = result
+        flight.error = error
+        flight.done.set()
+
+    def in_flight(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._flights
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                **self._counters,
+                "in_flight": len(self._flights)
+            }
+
+
+single_flight = SingleFlight()
@@ -1 +1 @@
-python -u app.py
+python -u serve.py
\ No newline at end of file
@@ -7,9 +7,13 @@
 const API_ENDPOINTS = {
     GENERATE_STRUCTURE: '/api/generate-course-structure/',
     GENERATE_WEEK_CONTENT: '/api/generate-week-contents/',
-    GET_ALL_COURSES: '/api/get-all-courses' // Added endpoint for sidebar
+    GET_COURSE_INDEX: '/api/courses', // Names and week titles only, paginated
+    GET_JOB: '/api/jobs/' // Status of a background generation job
 };
 
+// How often to ask the server whether a generation job has finished
+const JOB_POLL_INTERVAL_MS = 2000;
+
 // The URL to redirect to after successful generation or clicking a course.
 const VIEW_SYLLABUS_URL = '/view-syllabus'; 
 
@@ -30,17 +34,25 @@ document.addEventListener('DOMContentLoaded', () => {
 
 /**
  * Fetch Courses for Sidebar
- * Retrieves all courses to display in the "My Courses" list.
+ * Retrieves the names of all courses (page by page) to display in the "My Courses" list.
  */
 async function fetchCourses() {
     try {
-        const response = await fetch(API_ENDPOINTS.GET_ALL_COURSES);
-        if (response.ok) {
-            const courses = await response.json();
-            renderSidebar(courses);
-        } else {
-            console.error("Failed to fetch courses for sidebar.");
-        }
+        const courses = [];
+        let cursor = null;
+        do {
+            const url = cursor ? `${API_ENDPOINTS.GET_COURSE_INDEX}?cursor=${cursor}` : API_ENDPOINTS.GET_COURSE_INDEX;
+            const response = await fetch(url);
+            if (!response.ok) {
+                console.error("Failed to fetch courses for sidebar.");
+                return;
+            }
+            const page = await response.json();
+            courses.push(...page.courses);
+            cursor = page.next_cursor;
+        } while (cursor);
+
+        renderSidebar(courses);
     } catch (error) {
         console.error("Error loading sidebar courses:", error);
     }
@@ -101,8 +113,8 @@ function toggleLoader(show) {
  * Handle Course Generation
  * 1. Prevents default form submission.
  * 2. Scrapes data from DOM based on IDs.
- * 3. Sends POST request to Flask API.
- * 4. Redirects to the syllabus view on success.
+ * 3. Sends POST request to Flask API, which queues a generation job.
+ * 4. Waits for the job, then redirects to the syllabus view on success.
  */
 async function handleCourseGeneration(event) {
     event.preventDefault(); // Stop standard HTML form submission
@@ -127,12 +139,20 @@ async function handleCourseGeneration(event) {
         });
 
         if (response.ok) {
-            console.log("Course generated successfully. Redirecting...");
-            window.location.href = VIEW_SYLLABUS_URL;
+            const { job_id } = await response.json();
+            const job = await waitForJob(job_id);
+
+            if (job.status === 'done') {
+                console.log("Course generated successfully. Redirecting...");
+                window.location.href = VIEW_SYLLABUS_URL;
+            } else {
+                console.error('Job Error:', job);
+                alert(`Error: ${job.error || 'Failed to generate syllabus'}`);
+            }
         } else {
             const errorData = await response.json();
             console.error('Server Error:', errorData);
-            alert(`Error: ${errorData.message || 'Failed to generate syllabus'}`);
+            alert(`Error: ${errorData.error || 'Failed to generate syllabus'}`);
         }
 
     } catch (error) {
@@ -141,4 +161,25 @@ async function handleCourseGeneration(event) {
     } finally {
         toggleLoader(false);
     }
-}
\ No newline at end of file
+}
+
+/**
+ * Wait For Job
+ * Polls a background job until it is either done or failed.
+ * @param {string} jobId - ID returned by the server when the job was queued
+ * @returns {Object} The final job object
+ */
+async function waitForJob(jobId) {
+    while (true) {
+        const response = await fetch(API_ENDPOINTS.GET_JOB + jobId);
+        if (!response.ok) {
+            throw new Error(`Server returned ${response.status} ${response.statusText}`);
+        }
+
+        const job = await response.json();
+        if (job.status === 'done' || job.status === 'failed') {
+            return job;
+        }
+        await new Promise(r => setTimeout(r, JOB_POLL_INTERVAL_MS));
+    }
+}
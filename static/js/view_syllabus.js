@@ -8,13 +8,27 @@ const CONSTANTS = {
     API_UPDATE_AI: '/api/update-syllabus',
     API_GET_SESSIONS: '/api/get-week-sessions',
     API_GENERATE_SESSIONS: '/api/generate-week-sessions', // New Endpoint
+    API_STREAM_SESSIONS: '/api/generate-week-sessions/stream', // Server-Sent Events, one event per session
     // ### NEW CODE ###
     API_REGENERATE_SESSION: '/api/regenerate-week-sessions' // New Endpoint for regeneration
     // ### NEW CODE ###
 };
+// Client data cache: responses are kept in memory and in IndexedDB with their ETag
+const CACHE = {
+    DB_NAME: 'syllabus-ai-cache',
+    STORE: 'responses',
+    FRESH_MS: 30 * 1000, // A response checked with the server this recently is used without asking again
+    MAX_AGE_MS: 7 * 24 * 60 * 60 * 1000, // Stored responses not refreshed for this long are dropped
+    MEMORY_ENTRIES: 200,
+    PREFETCH_WEEKS: 1 // Weeks before and after the one shown whose sessions are fetched in the background
+};
+
 // State management
 let coursesData = [];
 let activeCourseId = null;
+let shownWeekId = null;
+// Course id -> its sidebar nodes, so a click only touches the nodes it changes
+const sidebarNodes = new Map();
 
 /**
  * Initialization: Fetches data from the server.
@@ -23,27 +37,192 @@ document.addEventListener('DOMContentLoaded', () => {
     fetchCourses();
 });
 
+// --- Client data cache ---
+// A view is drawn at once from the cached copy (memory, else IndexedDB), which is then revalidated
+// with If-None-Match: the server answers 304 when nothing changed, and the view is only drawn again when it did.
+
+const memoryCache = new Map(); // url -> {url, etag, data, checkedAt}
+const revalidations = new Map(); // url -> request in flight, shared by the views and prefetches asking at once
+let cacheDbPromise = null;
+
+function openCacheDb() {
+    if (!cacheDbPromise) {
+        cacheDbPromise = new Promise(resolve => {
+            if (!window.indexedDB) {
+                resolve(null);
+                return;
+            }
+            const request = indexedDB.open(CACHE.DB_NAME, 1);
+            request.onupgradeneeded = () => request.result.createObjectStore(CACHE.STORE, { keyPath: 'url' });
+            request.onsuccess = () => {
+                resolve(request.result);
+                pruneStoredResponses(request.result);
+            };
+            // Private windows, blocked storage...: the memory cache is used alone
+            request.onerror = () => resolve(null);
+            request.onblocked = () => resolve(null);
+        });
+    }
+    return cacheDbPromise;
+}
+
+/**
+ * Runs action(store) in a transaction of the cache store, resolves with the result of its request (null without IndexedDB)
+ */
+async function withCacheStore(mode, action) {
+    const cacheDb = await openCacheDb();
+    if (!cacheDb) return null;
+    return new Promise(resolve => {
+        try {
+            const request = action(cacheDb.transaction(CACHE.STORE, mode).objectStore(CACHE.STORE));
+            request.onsuccess = () => resolve(request.result || null);
+            request.onerror = () => resolve(null);
+        } catch (error) {
+            console.warn('Cache storage error:', error);
+            resolve(null);
+        }
+    });
+}
+
+function pruneStoredResponses(cacheDb) {
+    const oldest = Date.now() - CACHE.MAX_AGE_MS;
+    const request = cacheDb.transaction(CACHE.STORE, 'readwrite').objectStore(CACHE.STORE).openCursor();
+    request.onsuccess = () => {
+        const cursor = request.result;
+        if (!cursor) return;
+        if (cursor.value.savedAt < oldest) cursor.delete();
+        cursor.continue();
+    };
+}
+
+function rememberResponse(entry) {
+    // Least recently used first in the Map, dropped first
+    memoryCache.delete(entry.url);
+    memoryCache.set(entry.url, entry);
+    if (memoryCache.size > CACHE.MEMORY_ENTRIES) {
+        memoryCache.delete(memoryCache.keys().next().value);
+    }
+}
+
+/**
+ * Drops the cached copy of url, after a change made from this page
+ */
+function forgetResponse(url) {
+    memoryCache.delete(url);
+    withCacheStore('readwrite', store => store.delete(url));
+}
+
+/**
+ * Fetches JSON through the cache. onData(data) is called with the cached copy straight away when
+ * there is one, and again with the server's copy if it is different. Resolves with the latest data.
+ */
+async function cachedJson(url, onData = null) {
+    let entry = memoryCache.get(url);
+    if (!entry) {
+        const stored = await withCacheStore('readonly', store => store.get(url));
+        if (stored) {
+            // Kept from an earlier visit, always checked with the server
+            entry = { url, etag: stored.etag, data: stored.data, checkedAt: 0 };
+            rememberResponse(entry);
+        }
+    }
+    if (entry && onData) onData(entry.data);
+    if (entry && Date.now() - entry.checkedAt < CACHE.FRESH_MS) return entry.data;
+
+    let fresh;
+    try {
+        fresh = await revalidate(url, entry);
+    } catch (error) {
+        if (!entry) throw error;
+        // The cached copy stays on screen
+        console.warn(`Could not revalidate ${url}:`, error);
+        return entry.data;
+    }
+    if (fresh !== entry && onData) onData(fresh.data);
+    return fresh.data;
+}
+
+function revalidate(url, entry) {
+    if (!revalidations.has(url)) {
+        const request = (async () => {
+            const headers = entry && entry.etag ? { 'If-None-Match': entry.etag } : {};
+            // no-store: the 304 comes to us instead of being answered from the browser's HTTP cache
+            const response = await fetch(url, { headers, cache: 'no-store' });
+            if (response.status === 304 && entry) {
+                entry.checkedAt = Date.now();
+                return entry;
+            }
+
+            const data = await response.json();
+            if (!response.ok) {
+                throw new Error(data.error || `Server returned ${response.status} ${response.statusText}`);
+            }
+            const etag = response.headers.get('ETag');
+            // Without an ETag (server cache off) the copies are compared
+            if (entry && !etag && JSON.stringify(entry.data) === JSON.stringify(data)) {
+                entry.checkedAt = Date.now();
+                return entry;
+            }
+
+            const fresh = { url, etag, data, checkedAt: Date.now() };
+            rememberResponse(fresh);
+            withCacheStore('readwrite', store => store.put({ url, etag, data, savedAt: Date.now() }));
+            return fresh;
+        })();
+        revalidations.set(url, request);
+        const done = () => revalidations.delete(url);
+        request.then(done, done);
+    }
+    return revalidations.get(url);
+}
+
+function sessionsUrl(weekId) {
+    return `${CONSTANTS.API_GET_SESSIONS}?week_id=${encodeURIComponent(weekId)}`;
+}
+
+/**
+ * Fetches the sessions of the planned weeks around weekId in the background, so opening them is instant
+ */
+function prefetchAdjacentWeeks(courseId, weekId) {
+    const course = coursesData.find(c => c.id === courseId);
+    if (!course || !course.weeks) return;
+    const index = course.weeks.findIndex(w => w.id === weekId);
+    if (index < 0) return;
+
+    const neighbours = [];
+    for (let distance = 1; distance <= CACHE.PREFETCH_WEEKS; distance++) {
+        neighbours.push(course.weeks[index + distance], course.weeks[index - distance]);
+    }
+    const whenIdle = window.requestIdleCallback || (callback => setTimeout(callback, 200));
+    whenIdle(() => {
+        neighbours
+            .filter(week => week && week.planned)
+            .forEach(week => cachedJson(sessionsUrl(week.id)).catch(error => console.warn('Prefetch failed:', error)));
+    });
+}
+
 /**
  * Fetches the hierarchical course data from the Flask API.
+ * Drawn from the cached copy first, then again if the server's one is different.
  */
 async function fetchCourses() {
+    let opened = false;
     try {
-        const response = await fetch(CONSTANTS.API_GET_COURSES);
-        
-        if (!response.ok) {
-            throw new Error(`Server returned ${response.status} ${response.statusText}`);
-        }
-        
-        coursesData = await response.json();
-        
-        if (coursesData.length > 0) {
+        await cachedJson(CONSTANTS.API_GET_COURSES, courses => {
+            coursesData = courses;
+
+            if (coursesData.length === 0) {
+                renderEmptyState();
+                return;
+            }
             renderSidebar();
-            // Automatically open the first course for better UX
-            toggleCourseDropdown(coursesData[0].id);
-            renderContent(coursesData[0].id, 'intro');
-        } else {
-            renderEmptyState();
-        }
+            if (!opened) {
+                opened = true;
+                // Automatically open the first course for better UX
+                toggleCourseDropdown(coursesData[0].id);
+                renderContent(coursesData[0].id, 'intro');
+            }
+        });
     } catch (error) {
         console.error('Error fetching courses:', error);
         document.getElementById('course-list-container').innerHTML = 
@@ -64,10 +243,12 @@ function renderEmptyState() {
 
 /**
  * Renders the Sidebar Navigation (Courses -> Weeks)
+ * Only the course headers are built here, the weeks of a course are added the first time it is opened.
  */
 function renderSidebar() {
     const container = document.getElementById('course-list-container');
-    container.innerHTML = '';
+    const fragment = document.createDocumentFragment();
+    sidebarNodes.clear();
 
     coursesData.forEach(course => {
         const li = document.createElement('li');
@@ -75,53 +256,79 @@ function renderSidebar() {
 
         // 1. Course Header (Click to toggle)
         const header = document.createElement('div');
-        header.className = `course-header ${activeCourseId === course.id ? 'active' : ''}`;
+        header.className = 'course-header';
         // Using course.code and course.name from DB
         header.innerHTML = `<span>${course.code || ''} ${course.name}</span> <span>▼</span>`;
         header.onclick = () => toggleCourseDropdown(course.id);
 
         // 2. Dropdown List (Container for Intro + Weeks)
         const dropdownUl = document.createElement('ul');
-        dropdownUl.className = `session-list ${activeCourseId === course.id ? 'open' : ''}`;
+        dropdownUl.className = 'session-list';
         dropdownUl.id = `weeks-list-${course.id}`;
 
-        // A. Static 'Introduction' Item
-        const introLi = document.createElement('li');
-        introLi.className = 'session-item';
-        introLi.innerText = 'Course Introduction';
-        introLi.onclick = (e) => {
-            e.stopPropagation(); // Prevent triggering the header click
-            renderContent(course.id, 'intro');
-        };
-        dropdownUl.appendChild(introLi);
-
-        // B. Dynamic Week Items from Database
-        if (course.weeks && course.weeks.length > 0) {
-            course.weeks.forEach(week => {
-                const weekLi = document.createElement('li');
-                weekLi.className = 'session-item';
-                // Display "Week X: Topic Name"
-                weekLi.innerText = `Week ${week.week_number}: ${week.topic}`;
-                weekLi.onclick = (e) => {
-                    e.stopPropagation();
-                    renderContent(course.id, 'week', week.id);
-                };
-                dropdownUl.appendChild(weekLi);
-            });
-        } else {
-            // Fallback if no weeks exist yet
-            const emptyLi = document.createElement('li');
-            emptyLi.style.padding = '8px 15px';
-            emptyLi.style.fontSize = '0.85em';
-            emptyLi.style.color = '#888';
-            emptyLi.innerText = '(No weeks generated)';
-            dropdownUl.appendChild(emptyLi);
-        }
-
         li.appendChild(header);
         li.appendChild(dropdownUl);
-        container.appendChild(li);
+        fragment.appendChild(li);
+        sidebarNodes.set(course.id, { course, header, list: dropdownUl, filled: false });
     });
+
+    container.innerHTML = '';
+    container.appendChild(fragment);
+    if (activeCourseId !== null) {
+        setCourseOpen(activeCourseId, true);
+    }
+}
+
+/**
+ * Builds the items of a course's dropdown: its introduction and its weeks
+ */
+function fillWeeksList(dropdownUl, course) {
+    // A. Static 'Introduction' Item
+    const introLi = document.createElement('li');
+    introLi.className = 'session-item';
+    introLi.innerText = 'Course Introduction';
+    introLi.onclick = (e) => {
+        e.stopPropagation(); // Prevent triggering the header click
+        renderContent(course.id, 'intro');
+    };
+    dropdownUl.appendChild(introLi);
+
+    // B. Dynamic Week Items from Database
+    if (course.weeks && course.weeks.length > 0) {
+        course.weeks.forEach(week => {
+            const weekLi = document.createElement('li');
+            weekLi.className = 'session-item';
+            // Display "Week X: Topic Name"
+            weekLi.innerText = `Week ${week.week_number}: ${week.topic}`;
+            weekLi.onclick = (e) => {
+                e.stopPropagation();
+                renderContent(course.id, 'week', week.id);
+            };
+            dropdownUl.appendChild(weekLi);
+        });
+    } else {
+        // Fallback if no weeks exist yet
+        const emptyLi = document.createElement('li');
+        emptyLi.style.padding = '8px 15px';
+        emptyLi.style.fontSize = '0.85em';
+        emptyLi.style.color = '#888';
+        emptyLi.innerText = '(No weeks generated)';
+        dropdownUl.appendChild(emptyLi);
+    }
+}
+
+/**
+ * Opens or closes one course of the sidebar, building its weeks on its first opening
+ */
+function setCourseOpen(courseId, open) {
+    const nodes = sidebarNodes.get(courseId);
+    if (!nodes) return;
+    if (open && !nodes.filled) {
+        fillWeeksList(nodes.list, nodes.course);
+        nodes.filled = true;
+    }
+    nodes.header.classList.toggle('active', open);
+    nodes.list.classList.toggle('open', open);
 }
 
 /**
@@ -129,8 +336,11 @@ function renderSidebar() {
  */
 function toggleCourseDropdown(courseId) {
     // If clicking the already open course, close it. Otherwise, open the new one.
+    const previousCourseId = activeCourseId;
     activeCourseId = (activeCourseId === courseId) ? null : courseId;
-    renderSidebar(); // Re-render to apply CSS classes
+    // Only the two courses concerned change
+    if (previousCourseId !== null) setCourseOpen(previousCourseId, false);
+    if (activeCourseId !== null) setCourseOpen(activeCourseId, true);
 }
 
 /**
@@ -146,6 +356,7 @@ function renderContent(courseId, type, weekId = null) {
     if (!course) return;
 
     if (type === 'intro') {
+        shownWeekId = null;
         // --- VIEW 1: Course Metadata ---
         main.innerHTML = `
             <div class="syllabus-meta-header">
@@ -192,6 +403,7 @@ function renderContent(courseId, type, weekId = null) {
  */
 function renderWeekView(week, courseId) {
     const main = document.getElementById('main-content');
+    shownWeekId = week.id;
 
     // 1. Basic Week Structure
     main.innerHTML = `
@@ -215,7 +427,7 @@ function renderWeekView(week, courseId) {
     if (week.planned) {
         // If planned, fetch and show details
         container.innerHTML = '<p>Loading details...</p>';
-        loadSessionDetails(week.id);
+        loadSessionDetails(week.id, courseId);
         
         // ### NEW CODE ###
         // If planned, show the regeneration prompt/button
@@ -227,8 +439,17 @@ function renderWeekView(week, courseId) {
             const btn = clone.querySelector('.regenerate-btn');
             // The prompt input field
             const promptInput = clone.querySelector('.regeneration-prompt-input');
+            // The whole week, one session or one minute block (filled once the sessions are loaded)
+            const targetSelect = clone.querySelector('.regeneration-target');
             
-            btn.onclick = () => handleRegenerateClick(week.id, courseId, promptInput.value);
+            btn.onclick = () => {
+                const option = targetSelect.selectedOptions[0];
+                if (option && option.dataset.sessionNo) {
+                    handleRegenerateSessionClick(week.id, promptInput.value, Number(option.dataset.sessionNo), option.dataset.minutes || null);
+                } else {
+                    handleRegenerateClick(week.id, courseId, promptInput.value);
+                }
+            };
             
             regenContainer.appendChild(clone);
         }
@@ -248,38 +469,59 @@ function renderWeekView(week, courseId) {
     }
 }
 
-/**
- * Toggles the sidebar dropdown open/close state.
- */
-function toggleCourseDropdown(courseId) {
-    // If clicking the already open course, close it. Otherwise, open the new one.
-    activeCourseId = (activeCourseId === courseId) ? null : courseId;
-    renderSidebar(); // Re-render to apply CSS classes
-}
-
 /**
  * HANDLER: Trigger AI Generation for a specific week
+ * Sessions are streamed from the server and rendered one by one as soon as they are ready.
  */
-async function handleGenerateClick(weekId, courseId) {
+function handleGenerateClick(weekId, courseId) {
     const container = document.getElementById('session-details-container');
     
     // 1. Update UI to Loading State
     updateLoadingState(container, 'AI is generating minute-by-minute plans...');
 
-    try {
-        // 2. Call the API
-        const response = await fetch(CONSTANTS.API_GENERATE_SESSIONS, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ week_id: weekId })
-        });
+    // 2. Open the stream
+    const source = new EventSource(`${CONSTANTS.API_STREAM_SESSIONS}?week_id=${encodeURIComponent(weekId)}`);
+    let sessionsList = null;
 
-        await handleGenerationResponse(response, courseId, weekId);
-        
-    } catch (error) {
-        console.error('Generation error:', error);
-        container.innerHTML = `<p style="color:red">Error while generating sessions: ${error.message || 'Server connection failed'}</p>`;
-    }
+    source.addEventListener('session', (event) => {
+        const session = JSON.parse(event.data);
+
+        // Replace the spinner with the first session, keep a small one below for the rest
+        if (!sessionsList) {
+            container.innerHTML = '<h4>📚 Detailed Session Plan</h4><div class="streamed-sessions"></div><div class="stream-loading"></div>';
+            sessionsList = container.querySelector('.streamed-sessions');
+            updateLoadingState(container.querySelector('.stream-loading'), 'Generating the next session...');
+        }
+        sessionsList.insertAdjacentHTML('beforeend', renderSessionHtml(session, session.session_no - 1));
+    });
+
+    source.addEventListener('done', () => {
+        source.close();
+
+        // 3. Update Local Data State (the cached course list is the same object, the server's copy is fetched on the next visit)
+        const course = coursesData.find(c => c.id === courseId);
+        const week = course.weeks.find(w => w.id === weekId);
+        if (week) {
+            week.planned = true;
+        }
+        forgetResponse(sessionsUrl(weekId));
+
+        // 4. Refresh View (loads the stored sessions and shows the regeneration form)
+        renderWeekView(week, courseId);
+    });
+
+    source.addEventListener('failed', (event) => {
+        source.close();
+        const errorData = JSON.parse(event.data);
+        container.innerHTML = `<p style="color:red">Generation Failed: ${errorData.error || 'Unknown error'}</p>`;
+    });
+
+    source.onerror = () => {
+        // Without this EventSource keeps reconnecting, which would start the generation again
+        source.close();
+        console.error('Generation stream error');
+        container.innerHTML = `<p style="color:red">Error while generating sessions: Server connection failed</p>`;
+    };
 }
 
 // ### NEW CODE ###
@@ -306,6 +548,7 @@ async function handleRegenerateClick(weekId, courseId, prompt) {
 
         // 3. Handle response, but we don't need to update `planned` state since it was already planned
         if (response.ok) {
+            forgetResponse(sessionsUrl(weekId));
             // Find week to refresh the view
             const course = coursesData.find(c => c.id === courseId);
             const week = course.weeks.find(w => w.id === weekId);
@@ -326,6 +569,77 @@ async function handleRegenerateClick(weekId, courseId, prompt) {
     }
 }
 
+/**
+ * HANDLER: Regenerate one session, or one minute block of it, and patch only that part of the page
+ */
+async function handleRegenerateSessionClick(weekId, prompt, sessionNo, minutes) {
+    const status = document.querySelector('#session-regeneration-container .regeneration-status');
+    updateLoadingState(status, minutes ? `AI is regenerating "${minutes}" of session ${sessionNo}...` : `AI is regenerating session ${sessionNo}...`);
+
+    try {
+        const response = await fetch(CONSTANTS.API_REGENERATE_SESSION, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                week_id: weekId,
+                prompt: prompt,
+                session_no: sessionNo,
+                minutes: minutes
+            })
+        });
+        const data = await response.json();
+
+        if (!response.ok) {
+            status.innerHTML = `<p style="color:red">Regeneration Failed: ${data.error || 'Unknown error'}</p>`;
+            return;
+        }
+        // The page is patched below, the cached copy is fetched again next time
+        forgetResponse(sessionsUrl(weekId));
+
+        const container = document.getElementById('session-details-container');
+        const sessionEl = container.querySelector(`.session-item[data-session-no="${sessionNo}"]`);
+        const blockEl = minutes && sessionEl
+            ? Array.from(sessionEl.querySelectorAll('.minute-block')).find(el => el.dataset.minutes === minutes)
+            : null;
+
+        if (blockEl) {
+            blockEl.outerHTML = renderBlockHtml(minutes, data.session.minutes_data[minutes]);
+        } else if (sessionEl) {
+            sessionEl.outerHTML = renderSessionHtml(data.session, sessionNo - 1);
+        } else {
+            // The session did not exist yet
+            container.insertAdjacentHTML('beforeend', renderSessionHtml(data.session, sessionNo - 1));
+            fillRegenerationTargets([data.session]);
+        }
+        status.innerHTML = '';
+    } catch (error) {
+        console.error('Regeneration error:', error);
+        status.innerHTML = `<p style="color:red">Error while regenerating the session: ${error.message || 'Server connection failed'}</p>`;
+    }
+}
+
+/**
+ * Adds the sessions and their minute blocks to the choices of the regeneration form
+ */
+function fillRegenerationTargets(sessions) {
+    const select = document.querySelector('#session-regeneration-container .regeneration-target');
+    if (!select) return;
+
+    sessions.forEach((session, index) => {
+        const sessionNo = session.session_no || index + 1;
+        const sessionOption = new Option(`Session ${sessionNo} only`);
+        sessionOption.dataset.sessionNo = sessionNo;
+        select.add(sessionOption);
+
+        Object.keys(session.minutes_data || {}).forEach(minutes => {
+            const blockOption = new Option(`Session ${sessionNo}: ${minutes}`);
+            blockOption.dataset.sessionNo = sessionNo;
+            blockOption.dataset.minutes = minutes;
+            select.add(blockOption);
+        });
+    });
+}
+
 /**
  * Helper to update the UI to a loading/spinner state.
  */
@@ -339,74 +653,67 @@ function updateLoadingState(element, message) {
     `;
 }
 
-/**
- * Helper to handle the common response logic for generation/regeneration.
- */
-async function handleGenerationResponse(response, courseId, weekId) {
-    const container = document.getElementById('session-details-container');
-    
-    if (response.ok) {
-        // 3. Update Local Data State
-        const course = coursesData.find(c => c.id === courseId);
-        const week = course.weeks.find(w => w.id === weekId);
-        // Ensure planned status is set
-        if (week) {
-            week.planned = true;
-        }
-
-        // 4. Refresh View
-        renderWeekView(week, courseId);
-    } else {
-        const errorData = await response.json();
-        container.innerHTML = `<p style="color:red">Generation Failed: ${errorData.error || 'Unknown error'}</p>`;
-    }
-}
 // ### NEW CODE ###
 
-async function loadSessionDetails(weekId) {
-    const container = document.getElementById('session-details-container');
-
+async function loadSessionDetails(weekId, courseId) {
     try {
-        const response = await fetch('/api/get-week-sessions', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ week_id: weekId })
+        // Drawn from the cache at once when the week was seen (or prefetched), again if the server has changed it
+        await cachedJson(sessionsUrl(weekId), data => {
+            // The user may have opened another week meanwhile
+            const container = document.getElementById('session-details-container');
+            if (shownWeekId !== weekId || !container) return;
+
+            // Built in one string, the container is only written once
+            container.innerHTML = '<h4>📚 Detailed Session Plan</h4>' +
+                data.sessions.map((session, index) => renderSessionHtml(session, index)).join('');
+
+            const select = document.querySelector('#session-regeneration-container .regeneration-target');
+            if (select) select.length = 1; // Keep "All sessions of the week"
+            fillRegenerationTargets(data.sessions);
         });
-
-        const data = await response.json();
-
-        if (response.ok) {
-            // Clear the "Loading..." text
-            container.innerHTML = '<h4>📚 Detailed Session Plan</h4>';
-
-            // Loop through each session found
-            data.sessions.forEach((session, index) => {
-                const minutesData = session.minutes_data;
-                
-                // Create a wrapper for this session
-                let sessionHtml = `<div class="session-item" style="margin-bottom: 20px; border-left: 3px solid var(--secondary-color); padding-left: 15px;">`;
-                sessionHtml += `<h5>Session ${index + 1}</h5>`;
-
-                // Loop through the minutes keys (e.g., "Minutes 00-15")
-                // Object.entries converts {"key": val} into [["key", val], ...]
-                for (const [timeRange, contentObj] of Object.entries(minutesData)) {
-                    sessionHtml += `
-                        <div style="background: #f8f9fa; padding: 10px; margin-bottom: 8px; border-radius: 6px;">
-                            <strong style="color: #4b5563;">⏱️ ${timeRange}: ${contentObj.topic}</strong>
-                            <p style="margin-top: 5px; font-size: 0.95em; color: #374151;">${contentObj.content}</p>
-                        </div>
-                    `;
-                }
-                
-                sessionHtml += `</div>`;
-                container.innerHTML += sessionHtml;
-            });
-
-        } else {
-            container.innerHTML = `<p style="color:red">Error loading sessions: ${data.error}</p>`;
-        }
+        prefetchAdjacentWeeks(courseId, weekId);
     } catch (error) {
         console.error("Fetch error:", error);
-        container.innerHTML = `<p style="color:red">Failed to connect to server.</p>`;
+        const container = document.getElementById('session-details-container');
+        if (shownWeekId === weekId && container) {
+            container.innerHTML = `<p style="color:red">Error loading sessions: ${error.message || 'Failed to connect to server.'}</p>`;
+        }
+    }
+}
+
+/**
+ * Builds the HTML block of one session and its minutes.
+ * @param {Object} session - Session as returned by the API (needs minutes_data)
+ * @param {number} index - 0-based position of the session in the week
+ */
+function renderSessionHtml(session, index) {
+    const minutesData = session.minutes_data;
+    
+    const sessionNo = session.session_no || index + 1;
+    
+    // Create a wrapper for this session (data-session-no lets a regeneration patch it in place)
+    let sessionHtml = `<div class="session-item" data-session-no="${sessionNo}" style="margin-bottom: 20px; border-left: 3px solid var(--secondary-color); padding-left: 15px;">`;
+    sessionHtml += `<h5>Session ${sessionNo}</h5>`;
+
+    // Loop through the minutes keys (e.g., "Minutes 00-15")
+    // Object.entries converts {"key": val} into [["key", val], ...]
+    for (const [timeRange, contentObj] of Object.entries(minutesData)) {
+        sessionHtml += renderBlockHtml(timeRange, contentObj);
     }
-}
\ No newline at end of file
+    
+    sessionHtml += `</div>`;
+    return sessionHtml;
+}
+
+/**
+ * Builds the HTML of one minute block of a session
+ */
+function renderBlockHtml(timeRange, contentObj) {
+    const minutesAttr = timeRange.replace(/&/g, '&amp;').replace(/"/g, '&quot;');
+    return `
+            <div class="minute-block" data-minutes="${minutesAttr}" style="background: #f8f9fa; padding: 10px; margin-bottom: 8px; border-radius: 6px;">
+                <strong style="color: #4b5563;">⏱️ ${timeRange}: ${contentObj.topic}</strong>
+                <p style="margin-top: 5px; font-size: 0.95em; color: #374151;">${contentObj.content}</p>
+            </div>
+        `;
+}
@@ -0,0 +1,57 @@
+"""
+Fixtures shared by the tests: an app on a fresh SQLite file answered by the fake LLM backend.
+"""
+import pytest
+
+from app import create_app, init_db
+from db import db, Teacher, Course, Week
+from llm_cache import llm_cache
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.db'}",
+        "LLM_BACKEND": "fake",
+        "GENAI_RPM": 0,
+        "GENAI_TPM": 0,
+        "EMBEDDINGS_ENABLED": False,
+        "JOB_WORKERS": 1,
+    })
+    init_db(app)
+    with app.app_context():
+        # The in-memory layer of the cache outlives the apps of the previous tests
+        llm_cache.clear()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_course(app):
+    """
+    Adds a course with unplanned weeks, returns it
+    """
+    def make(code: str = "TST101", weeks: int = 3, sessions_per_week: int = 2) -> Course:
+        teacher = db.session.execute(db.select(Teacher).where(Teacher.email == "Jane.Doe@metropolia.fi")).scalar_one_or_none()
+        if teacher is None:
+            teacher = Teacher(email="Jane.Doe@metropolia.fi", handle="Jane.Doe")
+            db.session.add(teacher)
+            db.session.flush()
+        course = Course(
+            teacher_id=teacher.id, code=code, name=f"Course {code}", content="Testing the app",
+            meta_data={"objectives": "Tests pass", "sessionsPerWeek": sessions_per_week, "duration": weeks}
+        )
+        db.session.add(course)
+        db.session.flush()
+        db.session.add_all([
+            Week(course_id=course.id, week_number=no, topic=f"Topic {no}", summary=f"Summary {no}", planned=False)
+            for no in range(1, weeks + 1)
+        ])
+        db.session.commit()
+        return course
+    return make
@@ -0,0 +1,113 @@
+import pytest
+
+from batching import BatchScheduler, BatchItem
+from db import db, Week, LLMCacheEntry
+from llm import llm
+from rate_limit import GenAIUnavailableError
+import api
+
+
+def items(n: int, tokens: int = 100) -> list[BatchItem]:
+    return [BatchItem(key=i, tokens=tokens) for i in range(1, n + 1)]
+
+
+def test_pack_keeps_order_under_the_budget_and_max_items():
+    scheduler = BatchScheduler(token_budget=1000, max_items=3)
+    batches = scheduler.pack(items(7, tokens=200), shared_tokens=300)
+    # 300 + 3 * 200 fits, a fourth item would not
+    assert [[item.key for item in batch] for batch in batches] == [[1, 2, 3], [4, 5, 6], [7]]
+
+    # An item over the budget on its own still gets a batch
+    batches = scheduler.pack([BatchItem(key="big", tokens=5000), *items(1)], shared_tokens=300)
+    assert [[item.key for item in batch] for batch in batches] == [["big"], [1]]
+
+
+def test_unanswered_items_are_split_down_to_single_items():
+    scheduler = BatchScheduler(token_budget=10000, max_items=6)
+    asked = []
+
+    def ask_batch(batch):
+        asked.append([item.key for item in batch])
+        if len(batch) == 6:
+            raise TypeError("AI failed to return valid JSON")
+        # Leaves its first item out
+        return {item.key: f"batch {item.key}" for item in batch[1:]}
+
+    results = list(scheduler.run(scheduler.pack(items(6), 0), ask_batch, lambda item: f"single {item.key}", max_workers=1))
+
+    assert asked == [[1, 2, 3, 4, 5, 6], [1, 2, 3], [4, 5, 6]]
+    answers = {item.key: answer for item, answer, error in results}
+    assert answers == {1: "single 1", 2: "batch 2", 3: "batch 3", 4: "single 4", 5: "batch 5", 6: "batch 6"}
+    assert all(error is None for _, _, error in results)
+    assert scheduler.stats()["splits"] == 3
+
+
+def test_no_split_when_out_of_quota():
+    scheduler = BatchScheduler(token_budget=10000, max_items=6)
+
+    def ask_batch(batch):
+        raise GenAIUnavailableError("quota")
+
+    def ask_one(item):
+        pytest.fail("A batch out of quota must not be split")
+
+    results = list(scheduler.run(scheduler.pack(items(4), 0), ask_batch, ask_one, max_workers=1))
+    assert all(isinstance(error, GenAIUnavailableError) for _, _, error in results)
+    assert scheduler.stats()["splits"] == 0
+
+
+def test_course_sessions_in_batches_are_cached(app, make_course, monkeypatch):
+    monkeypatch.setattr(api.batch_scheduler, "max_items", 3)
+    course = make_course(weeks=7)
+    week_ids = [week.id for week in course.weeks]
+
+    progress = api.run_course_sessions_job({"course_id": course.id, "max_concurrency": 2}, lambda progress: None)
+
+    assert progress["completed"] == 7 and progress["prompts"] == 3
+    db.session.expire_all()
+    for week_id in week_ids:
+        assert sorted(s.session_no for s in db.session.get(Week, week_id).sessions) == [1, 2]
+    # Every batch, the ones asking for weeks 4-6 and 7 too, went in the cache
+    assert db.session.query(LLMCacheEntry).count() == 3
+
+
+def test_broken_batch_answer_falls_back(app, make_course, monkeypatch):
+    course = make_course(weeks=4)
+    week_ids = [week.id for week in course.weeks]
+    generate = llm.backend.generate
+    shapes = []
+
+    def broken_batches(prompt, shape):
+        shapes.append(shape)
+        answer = generate(prompt, shape)
+        if shape.nested:
+            answer.text = answer.text[:len(answer.text) // 3]
+        return answer
+
+    monkeypatch.setattr(llm.backend, "generate", broken_batches)
+    progress = api.run_course_sessions_job({"course_id": course.id, "max_concurrency": 1}, lambda progress: None)
+
+    assert progress["completed"] == 4 and progress["failed"] == 0
+    assert any(shape.nested for shape in shapes) and any(not shape.nested for shape in shapes)
+    db.session.expire_all()
+    for week_id in week_ids:
+        assert sorted(s.session_no for s in db.session.get(Week, week_id).sessions) == [1, 2]
+        assert db.session.get(Week, week_id).planned
+
+
+def test_weeks_planned_elsewhere_are_skipped_not_completed(app, make_course):
+    from singleflight import single_flight
+
+    course = make_course(weeks=3)
+    # Week 1 is being generated by another request
+    key = api.week_sessions_flight(course.weeks[0].id)
+    flight, _ = single_flight.join(key)
+    try:
+        progress = api.run_course_sessions_job({"course_id": course.id, "max_concurrency": 1}, lambda progress: None)
+    finally:
+        single_flight.finish(key, flight, result=None)
+
+    assert progress["completed"] == 2
+    assert progress["skipped"] == 1
+    assert progress["failed"] == 0
+    assert progress["weeks"][str(course.weeks[0].id)]["status"] == "skipped"
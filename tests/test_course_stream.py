@@ -0,0 +1,67 @@
+import asyncio
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from db import db, Course
+from rate_limit import GenAIUnavailableError
+import api
+import async_api
+
+FORM = {
+    "teacherEmail": "Jane.Doe@metropolia.fi", "courseCode": "STR101", "courseName": "Streaming",
+    "content": "Streams", "objectives": "Streams", "prerequisites": "None",
+    "duration": "6", "sessionsPerWeek": "2", "homework": "4",
+}
+
+
+def course_weeks(code: str) -> list[tuple[int, str]]:
+    db.session.expire_all()
+    course = db.session.execute(db.select(Course).where(Course.code == code)).scalar_one()
+    return [(week.week_number, week.topic) for week in course.weeks]
+
+
+def test_cut_off_stream_leaves_placeholder_weeks(app, client):
+    response = client.post("/api/generate-course-structure/stream", data=FORM, buffered=False)
+    received = b""
+    for data in response.response:
+        received += data
+        if b"event: week" in received:
+            break
+    response.close()
+
+    weeks = course_weeks("STR101")
+    assert [no for no, _ in weeks] == [1, 2, 3, 4, 5, 6]
+    assert weeks[0][1] != "WIP"
+    assert weeks[-1][1] == "WIP"
+
+
+def test_failed_stream_leaves_placeholder_weeks(app, client, monkeypatch):
+    def failing_stream(prompt, shape, use_cache=True, priority=None):
+        yield '{"week 1": {"topic": "Streamed", "summary": "Streamed"}, '
+        raise GenAIUnavailableError("GenAI stream was cut off", status_code=502)
+
+    monkeypatch.setattr(api, "ask_genai_stream", failing_stream)
+    body = client.post("/api/generate-course-structure/stream", data=FORM).get_data(as_text=True)
+
+    assert "event: failed" in body
+    assert course_weeks("STR101") == [(1, "Streamed"), *((no, "WIP") for no in range(2, 7))]
+
+
+def test_async_stream_cut_off_leaves_placeholder_weeks(app):
+    async_api.init_app(app)
+    handler = async_api.ROUTES[("POST", "/api/generate-course-structure/stream")]
+    request = Request(EnvironBuilder(method="POST", path="/api/generate-course-structure/stream", data=FORM).get_environ())
+
+    async def read_first_week():
+        response = await handler(app, request)
+        async for event in response.body:
+            if event.startswith("event: week"):
+                break
+        await response.body.aclose()
+
+    asyncio.run(read_first_week())
+
+    weeks = course_weeks("STR101")
+    assert [no for no, _ in weeks] == [1, 2, 3, 4, 5, 6]
+    assert weeks[-1][1] == "WIP"
@@ -0,0 +1,33 @@
+import json
+
+from sqlalchemy import text
+
+from db import db, Session
+from db_transfer import export_rows, import_rows
+from search import search
+
+
+def test_legacy_session_minutes_are_indexed_with_their_course(app, make_course):
+    course = make_course(weeks=1)
+    course_id = course.id
+    week_id = course.weeks[0].id
+    lines = list(export_rows(db.engine, ["teachers", "courses", "weeks"]))
+    # A session exported before the minutes moved to session_segments
+    lines.append(json.dumps({"table": "sessions", "rowid": 1, "row": {
+        "id": 1, "week_id": week_id, "session_no": 1,
+        "data": json.dumps({"Minutes 00 - 30": {"topic": "Call stack", "content": "Frames of recursive calls"}}),
+    }}))
+    with db.engine.begin() as conn:
+        for table in ("weeks", "courses", "teachers"):
+            conn.execute(text(f"DELETE FROM {table}"))
+
+    summary = import_rows(db.engine, lines)
+
+    assert "error" not in summary
+    assert db.session.get(Session, 1).data["Minutes 00 - 30"]["topic"] == "Call stack"
+    with db.engine.connect() as conn:
+        row = conn.execute(text("SELECT course_id, week_id, scope FROM search_index WHERE kind = 'segment'")).one()
+        assert (row.course_id, row.week_id) == (course_id, week_id)
+        assert row.scope == f"c{course_id}"
+        hits, _ = search(conn, "call stack", course_id=course_id)
+    assert [(hit["kind"], hit["course_id"]) for hit in hits] == [("segment", course_id)]
@@ -0,0 +1,53 @@
+import threading
+
+from db import db, Job
+from jobs import job_queue, QUEUED, DONE, FAILED
+
+
+def queue_job(kind: str, handler) -> str:
+    job_queue.handlers[kind] = handler
+    try:
+        job = Job(id=f"{kind}-job", kind=kind, status=QUEUED, payload={"n": 1})
+        db.session.add(job)
+        db.session.commit()
+        return job.id
+    except Exception:
+        del job_queue.handlers[kind]
+        raise
+
+
+def test_job_runs_once_when_claimed_twice(app):
+    runs = []
+    job_id = queue_job("test_once", lambda payload, report: runs.append(payload) or {"ok": True})
+    try:
+        threads = [threading.Thread(target=job_queue._run, args=(job_id,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        del job_queue.handlers["test_once"]
+
+    db.session.expire_all()
+    job = db.session.get(Job, job_id)
+    assert runs == [{"n": 1}]
+    assert job.status == DONE
+    assert job.result == {"ok": True}
+
+
+def test_failed_job_keeps_its_error(app):
+    def fail(payload, report):
+        report({"step": 1})
+        raise ValueError("broken")
+
+    job_id = queue_job("test_fail", fail)
+    try:
+        job_queue._run(job_id)
+    finally:
+        del job_queue.handlers["test_fail"]
+
+    db.session.expire_all()
+    job = db.session.get(Job, job_id)
+    assert job.status == FAILED
+    assert job.error == "broken"
+    assert job.result == {"step": 1}
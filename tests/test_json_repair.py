@@ -0,0 +1,45 @@
+from json_repair import extract_members
+from llm import ResponseShape
+
+WEEK = '"week %d": {"topic": "Topic %d", "summary": "Summary %d"}'
+
+
+def weeks(*numbers: int) -> str:
+    return ", ".join(WEEK % (n, n, n) for n in numbers)
+
+
+def test_valid_answer_in_fences():
+    extracted = extract_members("```json\n{" + weeks(1, 2) + "}\n```", ResponseShape("week", 2))
+    assert list(extracted.members) == ["week 1", "week 2"]
+    assert extracted.missing == []
+    assert not extracted.repaired
+
+
+def test_trailing_comma_and_smart_quotes_are_repaired():
+    text = "{" + weeks(1) + ', “week 2”: {"topic": "T", "summary": "S"},}'
+    extracted = extract_members(text, ResponseShape("week", 2))
+    assert list(extracted.members) == ["week 1", "week 2"]
+    assert extracted.repaired
+
+
+def test_cut_off_answer_keeps_the_complete_members():
+    text = "{" + weeks(1, 2) + ', "week 3": {"topic": "Topic 3", "summ'
+    extracted = extract_members(text, ResponseShape("week", 3))
+    assert list(extracted.members) == ["week 1", "week 2"]
+    assert extracted.missing == [3]
+
+
+def test_members_not_matching_the_schema_are_missing():
+    text = '{"week 1": {"topic": "T"}, "week 2": "only a string", ' + weeks(3) + ', "week 9": {"topic": "T", "summary": "S"}}'
+    extracted = extract_members(text, ResponseShape("week", 3))
+    assert list(extracted.members) == ["week 3"]
+    assert extracted.missing == [1, 2]
+
+
+def test_nested_members_must_be_complete():
+    shape = ResponseShape("week", 2, nested=(ResponseShape("session", 2), ResponseShape("session", 2)))
+    session = '{"Minutes 00 - 30": {"topic": "T", "content": "C"}}'
+    text = '{"week 1": {"session 1": %s, "session 2": %s}, "week 2": {"session 1": %s}}' % (session, session, session)
+    extracted = extract_members(text, shape)
+    assert list(extracted.members) == ["week 1"]
+    assert extracted.missing == [2]
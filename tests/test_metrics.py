@@ -0,0 +1,29 @@
+import json
+
+from metrics import Metrics
+
+
+def test_render_adds_up_every_worker(tmp_path):
+    other = Metrics()
+    other.llm_calls.inc(2, backend="fake", mode="json")
+    other.job_duration.observe(0.3, kind="course_sessions", status="done")
+    (tmp_path / "metrics-1.json").write_text(json.dumps({m.name: m.snapshot() for m in other.series()}))
+
+    metrics = Metrics()
+    metrics.shared_dir = str(tmp_path)
+    metrics.llm_calls.inc(backend="fake", mode="json")
+    metrics.job_duration.observe(2.0, kind="course_sessions", status="done")
+
+    text = metrics.render()
+    assert 'syllabus_llm_calls_total{backend="fake",mode="json"} 3' in text
+    assert 'syllabus_job_duration_seconds_count{kind="course_sessions",status="done"} 2' in text
+    assert 'syllabus_job_duration_seconds_sum{kind="course_sessions",status="done"} 2.3' in text
+    assert 'syllabus_job_duration_seconds_bucket{kind="course_sessions",status="done",le="0.5"} 1' in text
+    # This worker's own snapshot was written for the other workers to read
+    assert len(list(tmp_path.glob("metrics-*.json"))) == 2
+
+
+def test_render_without_shared_dir_is_this_process():
+    metrics = Metrics()
+    metrics.llm_calls.inc(backend="fake", mode="json")
+    assert 'syllabus_llm_calls_total{backend="fake",mode="json"} 1' in metrics.render()
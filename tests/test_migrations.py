@@ -0,0 +1,87 @@
+import json
+import sqlite3
+
+import pytest
+from sqlalchemy import inspect, text
+
+from app import create_app, init_db
+from db import db, Session
+from migrations import MIGRATIONS, upgrade
+from search import search
+
+LATEST = MIGRATIONS[-1][0]
+
+# The tables as the first versions of the app created them: no unique course code, the minutes in sessions.data
+OLD_SCHEMA = """
+CREATE TABLE teachers (id INTEGER PRIMARY KEY, email VARCHAR(120) UNIQUE, handle VARCHAR(80));
+CREATE TABLE courses (
+    id INTEGER PRIMARY KEY, teacher_id INTEGER REFERENCES teachers (id), code VARCHAR(20) NOT NULL,
+    name VARCHAR(200) NOT NULL, content TEXT NOT NULL, meta_data JSON NOT NULL
+);
+CREATE TABLE weeks (
+    id INTEGER PRIMARY KEY, week_number INTEGER NOT NULL, course_id INTEGER REFERENCES courses (id),
+    topic VARCHAR(200) NOT NULL, summary TEXT NOT NULL, planned BOOLEAN NOT NULL,
+    CONSTRAINT unique_course_week UNIQUE (course_id, week_number)
+);
+CREATE TABLE sessions (id INTEGER PRIMARY KEY, week_id INTEGER REFERENCES weeks (id), session_no INTEGER NOT NULL, data JSON);
+INSERT INTO teachers VALUES (1, 'Jane.Doe@metropolia.fi', 'Jane.Doe');
+INSERT INTO courses VALUES (1, 1, 'OLD101', 'Old course', 'Old content', '{}');
+INSERT INTO courses VALUES (2, 1, 'OLD101', 'Same code', 'Old content', '{}');
+INSERT INTO weeks VALUES (1, 1, 1, 'Recursion', 'Recursive functions', 1);
+"""
+MINUTES = {
+    "Minutes 00 - 30": {"topic": "Base cases", "content": "Where recursion stops"},
+    "Minutes 30 - 60": {"topic": "Call stack", "content": "Frames of recursive calls"},
+}
+
+
+@pytest.fixture
+def old_database(tmp_path):
+    path = tmp_path / "old.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(OLD_SCHEMA)
+    conn.execute("INSERT INTO sessions VALUES (1, 1, 1, ?)", (json.dumps(MINUTES),))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def user_version(engine) -> int:
+    with engine.connect() as conn:
+        return conn.execute(text("PRAGMA user_version")).scalar()
+
+
+def test_fresh_database_is_at_the_latest_version(app):
+    assert user_version(db.engine) == LATEST
+    # Running them again changes nothing
+    upgrade(db.engine)
+    assert user_version(db.engine) == LATEST
+
+
+def test_unfinished_step_does_not_hold_back_the_others(old_database):
+    app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{old_database}", "LLM_BACKEND": "fake", "EMBEDDINGS_ENABLED": False})
+    init_db(app)
+
+    with app.app_context():
+        engine = db.engine
+        # Duplicate course codes: the unique index waits for them to be fixed
+        assert user_version(engine) == 0
+        assert "ix_courses_code" not in [index["name"] for index in inspect(engine).get_indexes("courses")]
+
+        # The minutes were still moved to session_segments, and are searchable
+        assert "data" not in [column["name"] for column in inspect(engine).get_columns("sessions")]
+        assert db.session.get(Session, 1).data == MINUTES
+        with engine.connect() as conn:
+            hits, _ = search(conn, "call stack")
+        assert [hit["kind"] for hit in hits] == ["segment"]
+
+        # Fixed, the next start finishes the migration
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE courses SET code = 'OLD102' WHERE id = 2"))
+        upgrade(engine)
+        assert user_version(engine) == LATEST
+        assert "ix_courses_code" in [index["name"] for index in inspect(engine).get_indexes("courses")]
+        assert db.session.get(Session, 1).data == MINUTES
+        with engine.connect() as conn:
+            assert len(search(conn, "call stack")[0]) == 1
+        db.session.remove()
@@ -0,0 +1,62 @@
+import pytest
+
+from rate_limit import RateLimiter, TokenBucket, GenAIUnavailableError
+
+
+def limiter(max_retries: int = 2) -> RateLimiter:
+    limiter = RateLimiter()
+    limiter.max_retries = max_retries
+    limiter.backoff_base = 0.0
+    limiter.backoff_max = 0.0
+    return limiter
+
+
+def test_retryable_errors_are_retried():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("reset")
+        return "answer", 10
+
+    rate_limiter = limiter()
+    assert rate_limiter.call(flaky, estimated_tokens=10) == "answer"
+    assert len(attempts) == 3
+    assert rate_limiter.stats()["retries"] == 2
+
+
+def test_other_errors_fail_right_away():
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(GenAIUnavailableError) as error:
+        limiter().call(broken, estimated_tokens=10)
+    assert error.value.status_code == 502
+    assert len(attempts) == 1
+
+
+def test_gives_up_after_the_retries():
+    def down():
+        raise TimeoutError()
+
+    rate_limiter = limiter(max_retries=1)
+    with pytest.raises(GenAIUnavailableError) as error:
+        rate_limiter.call(down, estimated_tokens=10)
+    assert error.value.status_code == 503
+    assert rate_limiter.stats()["failures"] == 1
+
+
+def test_requests_per_minute_are_enforced():
+    rate_limiter = limiter()
+    rate_limiter.max_wait = 0.05
+    rate_limiter._requests = TokenBucket(2)
+    rate_limiter._tokens = TokenBucket(0)
+
+    rate_limiter.acquire(1)
+    rate_limiter.acquire(1)
+    with pytest.raises(GenAIUnavailableError):
+        rate_limiter.acquire(1)
@@ -0,0 +1,38 @@
+from db import db, LLMCacheEntry
+import api
+
+
+def planned_week(client, make_course) -> int:
+    week_id = make_course(weeks=1).weeks[0].id
+    assert client.post("/api/generate-week-sessions", json={"week_id": week_id}).status_code == 200
+    return week_id
+
+
+def test_one_session_regenerated_is_cached(app, client, make_course):
+    week_id = planned_week(client, make_course)
+    entries = db.session.query(LLMCacheEntry).count()
+
+    request = {"week_id": week_id, "session_no": 2, "prompt": "More exercises"}
+    first = client.post("/api/regenerate-week-sessions", json=request)
+    assert first.status_code == 200, first.json
+    assert db.session.query(LLMCacheEntry).count() == entries + 1
+
+    block = next(iter(first.json["session"]["minutes_data"]))
+    response = client.post("/api/regenerate-week-sessions", json={**request, "minutes": block})
+    assert response.status_code == 200, response.json
+    assert list(response.json["session"]["minutes_data"]) == list(first.json["session"]["minutes_data"])
+    assert db.session.query(LLMCacheEntry).count() == entries + 2
+
+
+def test_session_not_matching_the_schema_is_not_stored(app, client, make_course, monkeypatch):
+    week_id = planned_week(client, make_course)
+    before = client.get(f"/api/get-week-sessions?week_id={week_id}").json
+    assert "error" not in before
+
+    monkeypatch.setattr(api, "ask_genai", lambda *args, **kwargs: {"session 1": "Only a string"})
+    response = client.post("/api/regenerate-week-sessions", json={
+        "week_id": week_id, "session_no": 1, "minutes": "Minutes 00 - 20", "prompt": "More exercises", "no_cache": True
+    })
+
+    assert response.status_code == 502
+    assert client.get(f"/api/get-week-sessions?week_id={week_id}").json == before
@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do("key", slow)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flights.do("key", slow))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    while flights.stats()["followers"] < 3:
+        pass
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert calls == [1]
+    assert results == ["result"] * 4
+    assert not flights.in_flight("key")
+
+
+def test_followers_get_the_error():
+    flights = SingleFlight()
+    flight, leader = flights.join("key")
+    follower, follower_leads = flights.join("key")
+    assert leader and not follower_leads
+
+    flights.finish("key", flight, error=RuntimeError("failed"))
+    with pytest.raises(RuntimeError):
+        follower.wait()
+    # The key is free again for the next call
+    assert flights.do("key", lambda: 2) == 2
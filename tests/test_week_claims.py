@@ -0,0 +1,117 @@
+from datetime import timedelta
+
+from db import db, Week, naive_utcnow
+from api import claim_week, release_week
+from jobs import job_queue
+
+
+def test_claim_week_once(app, make_course):
+    week_id = make_course(weeks=1).weeks[0].id
+
+    assert claim_week(week_id)
+    assert not claim_week(week_id)
+    assert db.session.get(Week, week_id).planned
+
+
+def test_release_week_lets_it_be_claimed_again(app, make_course):
+    week_id = make_course(weeks=1).weeks[0].id
+
+    assert claim_week(week_id)
+    release_week(week_id)
+    assert not db.session.get(Week, week_id).planned
+    assert claim_week(week_id)
+
+
+def cut_off_stream(client, week_id: int) -> None:
+    """
+    Opens the sessions stream of the week and goes away after its first session
+    """
+    response = client.get(f"/api/generate-week-sessions/stream?week_id={week_id}", buffered=False)
+    received = b""
+    for data in response.response:
+        received += data
+        if b"event: session" in received:
+            break
+    response.close()
+
+
+def test_stream_cut_off_then_generated_again(app, client, make_course):
+    week_id = make_course(weeks=1, sessions_per_week=3).weeks[0].id
+
+    cut_off_stream(client, week_id)
+    db.session.expire_all()
+    week = db.session.get(Week, week_id)
+    assert not week.planned
+    assert len(week.sessions) >= 1
+
+    response = client.post("/api/generate-week-sessions", json={"week_id": week_id})
+    assert response.status_code == 200, response.json
+    assert [s["session_no"] for s in response.json["sessions"]] == [1, 2, 3]
+
+    db.session.expire_all()
+    assert sorted(s.session_no for s in db.session.get(Week, week_id).sessions) == [1, 2, 3]
+
+
+def test_stream_cut_off_then_planned_by_the_course_job(app, make_course):
+    from api import run_course_sessions_job
+
+    course = make_course(weeks=2, sessions_per_week=2)
+    course_id, week_id = course.id, course.weeks[0].id
+    cut_off_stream(app.test_client(), week_id)
+
+    progress = run_course_sessions_job({"course_id": course_id, "max_concurrency": 2}, lambda progress: None)
+    assert progress["failed"] == 0
+
+    db.session.expire_all()
+    assert sorted(s.session_no for s in db.session.get(Week, week_id).sessions) == [1, 2]
+
+
+def crashed_claim(week_id: int, seconds_ago: int) -> None:
+    """
+    Claims the week as a generation whose process died seconds_ago, before storing any session
+    """
+    assert claim_week(week_id)
+    db.session.execute(db.update(Week).where(Week.id == week_id).values(claimed_at=naive_utcnow() - timedelta(seconds=seconds_ago)))
+    db.session.commit()
+
+
+def test_generated_week_keeps_its_claim(app, client, make_course):
+    week_id = make_course(weeks=1).weeks[0].id
+    assert client.post("/api/generate-week-sessions", json={"week_id": week_id}).status_code == 200
+
+    db.session.expire_all()
+    assert db.session.get(Week, week_id).claimed_at is None
+    app.config["WEEK_CLAIM_TIMEOUT_SECONDS"] = 0
+    assert not claim_week(week_id)
+
+
+def test_crashed_claim_is_taken_over_after_the_timeout(app, client, make_course):
+    week_id = make_course(weeks=1, sessions_per_week=2).weeks[0].id
+    crashed_claim(week_id, seconds_ago=60)
+
+    # Too recent: the generation may still be running
+    assert client.post("/api/generate-week-sessions", json={"week_id": week_id}).status_code == 400
+
+    app.config["WEEK_CLAIM_TIMEOUT_SECONDS"] = 30
+    response = client.post("/api/generate-week-sessions", json={"week_id": week_id})
+    assert response.status_code == 200, response.json
+    assert [s["session_no"] for s in response.json["sessions"]] == [1, 2]
+
+
+def test_requeued_course_job_plans_the_crashed_week(app, make_course, monkeypatch):
+    from api import run_course_sessions_job
+
+    course = make_course(weeks=2, sessions_per_week=2)
+    course_id, week_id = course.id, course.weeks[0].id
+    crashed_claim(week_id, seconds_ago=60)
+    monkeypatch.setattr(job_queue, "_started_at", naive_utcnow())
+
+    # Restarted: the claims of the process before are given back with its jobs
+    job_queue.requeue_interrupted()
+    progress = run_course_sessions_job({"course_id": course_id, "max_concurrency": 2}, lambda progress: None)
+    assert (progress["total"], progress["completed"], progress["skipped"]) == (2, 2, 0)
+
+    db.session.expire_all()
+    week = db.session.get(Week, week_id)
+    assert week.planned and week.claimed_at is None
+    assert sorted(s.session_no for s in week.sessions) == [1, 2]